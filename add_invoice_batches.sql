@@ -0,0 +1,11 @@
+-- Migration for existing databases: batch uploads (POST /api/invoices/batch)
+CREATE TABLE IF NOT EXISTS invoice_batches (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT,
+    total_items INT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
+);
+ALTER TABLE invoices ADD COLUMN batch_id INT NULL;
+ALTER TABLE invoices ADD CONSTRAINT fk_invoices_batch_id FOREIGN KEY (batch_id) REFERENCES invoice_batches(id) ON DELETE SET NULL;
+CREATE INDEX idx_invoices_batch_id ON invoices(batch_id);
@@ -0,0 +1,10 @@
+-- Migration for existing databases: invoice status events for GET /api/invoices/events (services/invoice_events.py).
+CREATE TABLE IF NOT EXISTS invoice_events (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    invoice_id INT NOT NULL,
+    user_id INT NULL,
+    status VARCHAR(50) NOT NULL,
+    summary TEXT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_invoice_events_created_at (created_at)
+);
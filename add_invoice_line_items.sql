@@ -0,0 +1,13 @@
+-- Migration for existing databases: typed line items (services/line_items.py).
+-- After creating the table, move the existing line_item_<n>_<column> rows out of invoice_fields with
+-- `flask --app app backfill-line-items` (from the backend directory); the app can keep running meanwhile.
+CREATE TABLE IF NOT EXISTS invoice_line_items (
+    invoice_id INT NOT NULL,
+    line_index INT NOT NULL,
+    description TEXT NULL,
+    quantity DECIMAL(15, 3) NULL,
+    unit_price DECIMAL(15, 4) NULL,
+    item_total DECIMAL(15, 2) NULL,
+    PRIMARY KEY (invoice_id, line_index),
+    FOREIGN KEY (invoice_id) REFERENCES invoices(id) ON DELETE CASCADE
+);
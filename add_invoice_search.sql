@@ -0,0 +1,13 @@
+-- Migration for existing databases: full-text search (GET /api/invoices/search, services/invoice_search.py).
+-- Run after `flask --app app backfill-line-items`, so the line item descriptions are in invoice_line_items.
+-- Adding the first FULLTEXT index rebuilds the invoices table (InnoDB adds a hidden FTS_DOC_ID column).
+ALTER TABLE invoices ADD COLUMN line_items_text TEXT NULL;
+SET SESSION group_concat_max_len = 65535;
+UPDATE invoices i
+JOIN (
+    SELECT invoice_id, GROUP_CONCAT(description ORDER BY line_index SEPARATOR '\n') AS descriptions
+    FROM invoice_line_items WHERE description IS NOT NULL GROUP BY invoice_id
+) l ON l.invoice_id = i.id
+SET i.line_items_text = l.descriptions;
+CREATE FULLTEXT INDEX ftx_invoices_search ON invoices(vendor_name, invoice_number, line_items_text, raw_text);
+CREATE FULLTEXT INDEX ftx_invoices_search_ids ON invoices(vendor_name, invoice_number);
@@ -0,0 +1,11 @@
+-- Migration for existing databases: spend rollups (services/spend_rollups.py).
+-- After creating the table, fill it from the existing invoices with
+-- `flask --app app rebuild-spend-rollups` (from the backend directory).
+CREATE TABLE IF NOT EXISTS invoice_spend_rollups (
+    dimension VARCHAR(16) NOT NULL,          -- 'vendor', 'month', 'currency' or 'user'
+    dimension_key VARCHAR(255) NOT NULL,     -- vendor_name, 'YYYY-MM' of invoice_date, currency or user_id ('' when unknown)
+    currency VARCHAR(10) NOT NULL,           -- '' when unknown
+    invoice_count INT NOT NULL DEFAULT 0,
+    total_amount DECIMAL(19, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (dimension, dimension_key, currency)
+);
@@ -0,0 +1,9 @@
+-- Migration for existing databases: conditional GET and response caching of invoice reads (services/response_cache.py).
+-- Existing rows get the time of the migration as updated_at, which only makes their first revalidation a full response.
+ALTER TABLE invoices ADD COLUMN updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6);
+CREATE TABLE IF NOT EXISTS cache_versions (
+    name VARCHAR(64) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)
+);
+INSERT INTO cache_versions (name, version) VALUES ('invoices', 1) ON DUPLICATE KEY UPDATE version = version + 1;
@@ -1,8 +1,9 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
 import os
 from dotenv import load_dotenv
 import logging # Added for logging
+import click
 
 # Load environment variables from .env file
 load_dotenv()
@@ -13,21 +14,164 @@ CORS(app, origins="http://localhost:5173", methods=["GET", "POST", "PUT", "DELET
 
 # Configure logging
 logging.basicConfig(level=logging.INFO) # For general Flask/werkzeug logs
-app.logger.setLevel(logging.DEBUG) # Set app's own logger to DEBUG to see more details
+app.logger.setLevel(os.getenv('LOG_LEVEL', 'DEBUG').upper()) # App's own logger; DEBUG shows prompts, responses and extracted data
+# Large DEBUG payloads (OCR text, prompts, Gemini responses) are only formatted for a sample of calls
+# and cut to a maximum length (see services/payload_logging.py)
+app.config['LOG_PAYLOAD_SAMPLE_RATE'] = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', 1.0))
+app.config['LOG_PAYLOAD_MAX_CHARS'] = int(os.getenv('LOG_PAYLOAD_MAX_CHARS', 2000)) # 0 = no limit
+# Port for a /metrics endpoint in `flask run-workers` processes (the web app serves /metrics itself); 0 = off
+app.config['METRICS_PORT'] = int(os.getenv('METRICS_PORT', 0))
 
 # Database configuration
 app.config['MYSQL_HOST'] = os.getenv('MYSQL_HOST', 'localhost')
 app.config['MYSQL_USER'] = os.getenv('MYSQL_USER', 'root')
 app.config['MYSQL_PASSWORD'] = os.getenv('MYSQL_PASSWORD', '')
 app.config['MYSQL_DB'] = os.getenv('MYSQL_DB', 'expense_management')
+# Connection pool settings (see db.ConnectionPool)
+app.config['MYSQL_POOL_SIZE'] = int(os.getenv('MYSQL_POOL_SIZE', 5))
+app.config['MYSQL_POOL_MAX_OVERFLOW'] = int(os.getenv('MYSQL_POOL_MAX_OVERFLOW', 10))
+app.config['MYSQL_POOL_RECYCLE_SECONDS'] = int(os.getenv('MYSQL_POOL_RECYCLE_SECONDS', 3600))
+app.config['MYSQL_POOL_PRE_PING'] = os.getenv('MYSQL_POOL_PRE_PING', 'true').lower() == 'true'
+app.config['MYSQL_POOL_TIMEOUT'] = int(os.getenv('MYSQL_POOL_TIMEOUT', 30)) # Seconds to wait for a free connection
+# Upper bound for a single multi-row INSERT; keep well below the server's max_allowed_packet
+app.config['MYSQL_MAX_INSERT_BYTES'] = int(os.getenv('MYSQL_MAX_INSERT_BYTES', 1024 * 1024))
+# Read line_item_<n>_* rows from invoice_fields for invoices the backfill-line-items command hasn't migrated yet
+app.config['LINE_ITEMS_EAV_FALLBACK'] = os.getenv('LINE_ITEMS_EAV_FALLBACK', 'true').lower() == 'true'
 # MYSQL_CURSORCLASS is usually set when you create the cursor, not in app.config for mysql.connector
 # However, if you were using Flask-MySQLdb, it would be relevant.
 # For mysql.connector, you typically get a dictionary cursor by cursor = db.cursor(dictionary=True)
 
+# Background job queue configuration (uploads are processed asynchronously by a worker pool)
+app.config['JOB_QUEUE_BACKEND'] = os.getenv('JOB_QUEUE_BACKEND', 'sqlite') # 'sqlite' (durable) or 'memory'
+app.config['JOB_QUEUE_PATH'] = os.getenv('JOB_QUEUE_PATH', os.path.join(app.root_path, 'job_queue.sqlite3'))
+app.config['JOB_WORKER_CONCURRENCY'] = int(os.getenv('JOB_WORKER_CONCURRENCY', 4))
+# A running job whose worker stops sending heartbeats for this long is claimed again, at most JOB_MAX_ATTEMPTS times
+app.config['JOB_STALE_AFTER_SECONDS'] = int(os.getenv('JOB_STALE_AFTER_SECONDS', 600))
+app.config['JOB_MAX_ATTEMPTS'] = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+# Set to 'false' when workers run in a separate process via `flask run-workers`
+app.config['JOB_WORKERS_IN_PROCESS'] = os.getenv('JOB_WORKERS_IN_PROCESS', 'true').lower() == 'true'
+
+# OCR / extraction result cache (in-memory LRU in front of the processing_cache table)
+app.config['CACHE_ENABLED'] = os.getenv('CACHE_ENABLED', 'true').lower() == 'true'
+app.config['CACHE_MEMORY_MAX_ENTRIES'] = int(os.getenv('CACHE_MEMORY_MAX_ENTRIES', 1024))
+app.config['CACHE_MEMORY_TTL_SECONDS'] = int(os.getenv('CACHE_MEMORY_TTL_SECONDS', 86400))
+
+# PDF text extraction: pages of large PDFs are extracted in a process pool
+app.config['PDF_EXTRACTION_WORKERS'] = int(os.getenv('PDF_EXTRACTION_WORKERS', min(4, os.cpu_count() or 1)))
+app.config['PDF_PARALLEL_MIN_PAGES'] = int(os.getenv('PDF_PARALLEL_MIN_PAGES', 16))
+# Stop reading a PDF once the page with the totals section has been extracted
+app.config['PDF_STOP_AT_TOTALS'] = os.getenv('PDF_STOP_AT_TOTALS', 'false').lower() == 'true'
+
+# OCR backend for images and scanned PDF pages: 'vision' (Google Cloud Vision) or 'tesseract'
+app.config['OCR_BACKEND'] = os.getenv('OCR_BACKEND', 'vision')
+# Only PDF pages without a usable text layer are rasterized and OCRed
+app.config['PDF_OCR_SCANNED_PAGES'] = os.getenv('PDF_OCR_SCANNED_PAGES', 'true').lower() == 'true'
+app.config['PDF_MIN_TEXT_CHARS'] = int(os.getenv('PDF_MIN_TEXT_CHARS', 20))
+app.config['PDF_OCR_RESOLUTION'] = int(os.getenv('PDF_OCR_RESOLUTION', 200))
+app.config['PDF_OCR_CONCURRENCY'] = int(os.getenv('PDF_OCR_CONCURRENCY', 4))
+
+# Images are rotated, grayscaled, cropped to the document and downscaled in a process pool before OCR
+app.config['IMAGE_PREPROCESS_ENABLED'] = os.getenv('IMAGE_PREPROCESS_ENABLED', 'true').lower() == 'true'
+app.config['IMAGE_PREPROCESS_WORKERS'] = int(os.getenv('IMAGE_PREPROCESS_WORKERS', min(2, os.cpu_count() or 1)))
+app.config['IMAGE_PREPROCESS_MIN_BYTES'] = int(os.getenv('IMAGE_PREPROCESS_MIN_BYTES', 256 * 1024)) # Smaller images are sent as-is
+app.config['IMAGE_MAX_LONG_EDGE'] = int(os.getenv('IMAGE_MAX_LONG_EDGE', 2400)) # Pixels of the cropped document (~200 dpi for A4)
+app.config['IMAGE_TARGET_DPI'] = int(os.getenv('IMAGE_TARGET_DPI', 300))
+app.config['IMAGE_CROP_TO_DOCUMENT'] = os.getenv('IMAGE_CROP_TO_DOCUMENT', 'true').lower() == 'true'
+app.config['IMAGE_OUTPUT_FORMAT'] = os.getenv('IMAGE_OUTPUT_FORMAT', 'JPEG') # 'JPEG' or 'PNG'
+app.config['IMAGE_JPEG_QUALITY'] = int(os.getenv('IMAGE_JPEG_QUALITY', 85))
+app.config['IMAGE_PREPROCESS_CACHE_MAX_BYTES'] = int(os.getenv('IMAGE_PREPROCESS_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+# Google API clients are created once per process and reused; timeouts and retry deadlines (seconds, 0 = no deadline)
+app.config['GEMINI_MODEL'] = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash-latest')
+app.config['GEMINI_TIMEOUT_SECONDS'] = float(os.getenv('GEMINI_TIMEOUT_SECONDS', 120))
+app.config['GEMINI_RETRY_DEADLINE_SECONDS'] = float(os.getenv('GEMINI_RETRY_DEADLINE_SECONDS', 180))
+app.config['VISION_TIMEOUT_SECONDS'] = float(os.getenv('VISION_TIMEOUT_SECONDS', 60))
+app.config['VISION_RETRY_DEADLINE_SECONDS'] = float(os.getenv('VISION_RETRY_DEADLINE_SECONDS', 120))
+
+# Batch uploads (POST /api/invoices/batch)
+app.config['BATCH_MAX_FILES'] = int(os.getenv('BATCH_MAX_FILES', 500))
+app.config['BATCH_MAX_TOTAL_BYTES'] = int(os.getenv('BATCH_MAX_TOTAL_BYTES', 500 * 1024 * 1024))
+app.config['VISION_BATCH_SIZE'] = int(os.getenv('VISION_BATCH_SIZE', 16)) # Images per batch annotate request (API max 16)
+app.config['BATCH_OCR_CONCURRENCY'] = int(os.getenv('BATCH_OCR_CONCURRENCY', 4)) # Batch annotate requests in flight
+
+# Multi-document Gemini prompts for batch uploads (instructions are sent once per request, not once per invoice)
+app.config['GEMINI_BATCH_ENABLED'] = os.getenv('GEMINI_BATCH_ENABLED', 'true').lower() == 'true'
+app.config['GEMINI_BATCH_MAX_DOCS'] = int(os.getenv('GEMINI_BATCH_MAX_DOCS', 8))
+app.config['GEMINI_BATCH_TOKEN_BUDGET'] = int(os.getenv('GEMINI_BATCH_TOKEN_BUDGET', 16000)) # Estimated OCR tokens per request
+
+# Prompts get compacted OCR text (no whitespace runs, repeated page headers/footers or boilerplate);
+# documents still over GEMINI_MAX_PROMPT_TOKENS are extracted in chunks and the results merged
+app.config['GEMINI_COMPACT_TEXT'] = os.getenv('GEMINI_COMPACT_TEXT', 'true').lower() == 'true'
+app.config['GEMINI_MAX_PROMPT_TOKENS'] = int(os.getenv('GEMINI_MAX_PROMPT_TOKENS', 12000)) # Estimated OCR tokens
+app.config['GEMINI_CHUNK_TOKENS'] = int(os.getenv('GEMINI_CHUNK_TOKENS', 6000))
+app.config['GEMINI_CHUNK_CONCURRENCY'] = int(os.getenv('GEMINI_CHUNK_CONCURRENCY', 4))
+
+# Rule/template pre-extraction: Gemini is skipped when the local extractor's confidence reaches the threshold
+app.config['PRE_EXTRACTION_ENABLED'] = os.getenv('PRE_EXTRACTION_ENABLED', 'true').lower() == 'true'
+app.config['PRE_EXTRACTION_THRESHOLD'] = float(os.getenv('PRE_EXTRACTION_THRESHOLD', 0.9))
+app.config['PRE_EXTRACTION_DAYFIRST'] = os.getenv('PRE_EXTRACTION_DAYFIRST', 'true').lower() == 'true' # 04/03/2024 = 4 March
+app.config['VENDOR_TEMPLATES_PATH'] = os.getenv('VENDOR_TEMPLATES_PATH', os.path.join(app.root_path, 'vendor_templates.json'))
+
+# Vendor layouts learned from processed invoices (services/layout_index.py): matching documents use a learned
+# field and line item row template, or a few-shot Gemini prompt until the layout has LAYOUT_MIN_SAMPLES consistent samples
+app.config['LAYOUT_INDEX_ENABLED'] = os.getenv('LAYOUT_INDEX_ENABLED', 'true').lower() == 'true'
+app.config['LAYOUT_MATCH_THRESHOLD'] = float(os.getenv('LAYOUT_MATCH_THRESHOLD', 0.6)) # Estimated Jaccard similarity of header/footer shingles
+app.config['LAYOUT_MIN_SAMPLES'] = int(os.getenv('LAYOUT_MIN_SAMPLES', 3))
+app.config['LAYOUT_INDEX_MAX_LAYOUTS'] = int(os.getenv('LAYOUT_INDEX_MAX_LAYOUTS', 5000))
+app.config['LAYOUT_INDEX_TTL_DAYS'] = int(os.getenv('LAYOUT_INDEX_TTL_DAYS', 90))
+app.config['LAYOUT_INDEX_BOOTSTRAP_LIMIT'] = int(os.getenv('LAYOUT_INDEX_BOOTSTRAP_LIMIT', 5000)) # Recent invoices indexed on first use
+
+# Invoice reads answer If-None-Match / If-Modified-Since with 304 and keep serialized bodies in a per-process
+# LRU keyed by their validators (services/response_cache.py), so writes invalidate it without any messaging
+app.config['RESPONSE_CACHE_ENABLED'] = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+app.config['RESPONSE_CACHE_MAX_BYTES'] = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+# Server-sent events of invoice status transitions (services/invoice_events.py): each web process polls
+# invoice_events once per EVENTS_POLL_SECONDS for all of its subscribers. Every open stream holds a thread.
+app.config['EVENTS_MAX_SUBSCRIBERS'] = int(os.getenv('EVENTS_MAX_SUBSCRIBERS', 100)) # Per process; more get 503
+app.config['EVENTS_POLL_SECONDS'] = float(os.getenv('EVENTS_POLL_SECONDS', 0.5))
+app.config['EVENTS_HEARTBEAT_SECONDS'] = float(os.getenv('EVENTS_HEARTBEAT_SECONDS', 15))
+app.config['EVENTS_RETRY_MS'] = int(os.getenv('EVENTS_RETRY_MS', 3000)) # EventSource reconnect delay
+app.config['EVENTS_REPLAY_LIMIT'] = int(os.getenv('EVENTS_REPLAY_LIMIT', 500)) # Beyond this a reconnecting client reloads
+app.config['EVENTS_SUBSCRIBER_QUEUE'] = int(os.getenv('EVENTS_SUBSCRIBER_QUEUE', 1000)) # Slower clients are disconnected
+app.config['EVENTS_GAP_SECONDS'] = float(os.getenv('EVENTS_GAP_SECONDS', 10)) # How long to wait for out-of-order commits
+app.config['EVENTS_RETENTION_HOURS'] = int(os.getenv('EVENTS_RETENTION_HOURS', 24))
+
+# Outbound API scheduler (services/api_scheduler.py): per-process rate limits (0 = unlimited), calls in flight,
+# and retries with exponential backoff + jitter on 429/5xx. Interactive uploads are admitted before batch items.
+app.config['GEMINI_REQUESTS_PER_MINUTE'] = int(os.getenv('GEMINI_REQUESTS_PER_MINUTE', 60))
+app.config['GEMINI_TOKENS_PER_MINUTE'] = int(os.getenv('GEMINI_TOKENS_PER_MINUTE', 1000000)) # Estimated prompt tokens
+app.config['GEMINI_MAX_IN_FLIGHT'] = int(os.getenv('GEMINI_MAX_IN_FLIGHT', 4))
+app.config['VISION_REQUESTS_PER_MINUTE'] = int(os.getenv('VISION_REQUESTS_PER_MINUTE', 600)) # Images per minute
+app.config['VISION_MAX_IN_FLIGHT'] = int(os.getenv('VISION_MAX_IN_FLIGHT', 8))
+app.config['API_BURST_SECONDS'] = float(os.getenv('API_BURST_SECONDS', 10)) # Quota that may be used in one burst
+app.config['API_MAX_ATTEMPTS'] = int(os.getenv('API_MAX_ATTEMPTS', 5))
+app.config['API_BACKOFF_BASE_SECONDS'] = float(os.getenv('API_BACKOFF_BASE_SECONDS', 1))
+app.config['API_BACKOFF_MAX_SECONDS'] = float(os.getenv('API_BACKOFF_MAX_SECONDS', 30))
+
+# Streaming exports (GET /api/invoices/export): rows fetched from the server-side cursor per chunk,
+# Parquet row group size, and how long MySQL waits on a client that reads the export slowly
+app.config['EXPORT_CHUNK_ROWS'] = int(os.getenv('EXPORT_CHUNK_ROWS', 1000))
+app.config['EXPORT_PARQUET_ROW_GROUP_ROWS'] = int(os.getenv('EXPORT_PARQUET_ROW_GROUP_ROWS', 10000))
+app.config['EXPORT_NET_WRITE_TIMEOUT_SECONDS'] = int(os.getenv('EXPORT_NET_WRITE_TIMEOUT_SECONDS', 600))
+
+# Uploaded files are streamed straight into the upload folder (hashed and size-checked while the
+# request body is parsed) instead of being spooled to a temporary file and copied afterwards
+from services import upload_storage
+app.request_class = upload_storage.UploadRequest
+app.config['MAX_UPLOAD_BYTES'] = int(os.getenv('MAX_UPLOAD_BYTES', 50 * 1024 * 1024)) # Per file, 0 = no limit
+
 # Initialize DB with the app
 import db
 db.init_app(app)
 
+# Initialize the job queue and register the background job handlers
+from services import job_queue, invoice_processor
+job_queue.register_handler('process_invoice', invoice_processor.process_invoice)
+job_queue.register_handler('process_batch', invoice_processor.process_batch)
+job_queue.register_handler('extract_batch', invoice_processor.extract_batch)
+job_queue.init_app(app)
+
 # Import and register blueprints
 from routes.invoice_routes import invoice_bp
 app.register_blueprint(invoice_bp)
@@ -55,6 +199,59 @@ def test_route():
     else:
         return jsonify({'status': 'error', 'message': 'API is working but could not connect to the database.'}), 500
 
+# Connection pool statistics for monitoring
+@app.route('/api/db/pool-stats')
+def db_pool_stats_route():
+    return jsonify(db.get_pool_stats() or {'message': 'Connection pool not initialized yet.'})
+
+# Hit/miss counters for the OCR and extraction cache
+@app.route('/api/cache/stats')
+def cache_stats_route():
+    from services import result_cache
+    return jsonify(result_cache.get_cache().stats())
+
+# Rate limiter / retry counters for the outbound Gemini and Vision calls
+@app.route('/api/scheduler/stats')
+def scheduler_stats_route():
+    from services import api_scheduler
+    return jsonify(api_scheduler.get_all_stats())
+
+# Estimated prompt tokens before/after OCR text compaction, and chunked extractions
+@app.route('/api/extraction/compaction/stats')
+def compaction_stats_route():
+    from services import vision_service
+    return jsonify(vision_service.get_compaction_stats())
+
+# Images preprocessed before OCR, bytes saved and preprocessing cache hits
+@app.route('/api/ocr/preprocessing/stats')
+def image_preprocessing_stats_route():
+    from services import vision_service
+    return jsonify(vision_service.get_image_preprocessor().stats())
+
+# Hits, misses and 304s of the invoice read response cache
+@app.route('/api/cache/responses/stats')
+def response_cache_stats_route():
+    from services import response_cache
+    return jsonify(response_cache.get_cache().stats())
+
+# Invoice events stream: subscribers, events fanned out, slow or rejected subscribers
+@app.route('/api/events/stats')
+def events_stats_route():
+    from services import invoice_events
+    return jsonify(invoice_events.get_broker().stats())
+
+# Learned vendor layouts: matches, learned-template extractions and evictions
+@app.route('/api/layouts/stats')
+def layout_stats_route():
+    from services import layout_index
+    return jsonify(layout_index.get_index().stats())
+
+# Per-stage durations and error counts of the invoice pipeline, in the Prometheus text format
+@app.route('/metrics')
+def metrics_route():
+    from services import metrics
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 # Route to initialize DB schema (for development/setup)
 @app.route('/api/init-db', methods=['POST'])
 def init_db_route():
@@ -70,6 +267,33 @@ def init_db_route():
         return jsonify({'message': f'Error initializing database schema: {str(e)}'}), 500
 
 
+# Moves line items from invoice_fields (EAV rows) to invoice_line_items in small transactions;
+# safe to run while the app is serving: `flask --app app backfill-line-items --pause 0.05`
+@app.cli.command('backfill-line-items')
+@click.option('--batch-size', default=500, show_default=True, help='Invoices per transaction')
+@click.option('--pause', default=0.0, show_default=True, help='Seconds to sleep between batches')
+@click.option('--keep-eav', is_flag=True, help='Copy without deleting the invoice_fields rows')
+def backfill_line_items_command(batch_size, pause, keep_eav):
+    from services import line_items
+    conn = db.get_db()
+    if not conn:
+        raise click.ClickException('Database connection failed')
+    stats = line_items.backfill_from_fields(conn, batch_size=batch_size, pause_seconds=pause, delete_eav=not keep_eav)
+    click.echo(f"Migrated {stats['line_items']} line items of {stats['invoices']} invoices "
+               f"in {stats['batches']} batches; deleted {stats['eav_rows_deleted']} invoice_fields rows.")
+
+
+# Recomputes invoice_spend_rollups from invoices (after the migration, or if they are ever suspected to drift)
+@app.cli.command('rebuild-spend-rollups')
+def rebuild_spend_rollups_command():
+    from services import spend_rollups
+    conn = db.get_db()
+    if not conn:
+        raise click.ClickException('Database connection failed')
+    rows = spend_rollups.rebuild(conn)
+    click.echo(f"Rebuilt {rows} spend rollup rows.")
+
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     # Set debug=False for production if FLASK_ENV is 'production'
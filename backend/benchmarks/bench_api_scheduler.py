@@ -0,0 +1,133 @@
+"""
+Harness: outbound API calls under a quota, with and without services/api_scheduler.py.
+
+A burst of bulk calls (a large batch upload) and a trickle of interactive calls
+(single uploads) hit a FakeQuotaAPI (benchmarks/fakes.py) that rejects anything
+over its per-window request/token quota with a 429. Two modes are compared:
+
+    direct:    every call retries on its own with exponential backoff and jitter,
+               like the SDK-level retries the app used before the scheduler.
+    scheduled: calls go through APIScheduler (token buckets, in-flight cap,
+               shared backoff on 429, interactive lane first).
+
+Reported: throughput achieved, 429s returned by the fake, calls that gave up,
+and p50/p95 latency per lane.
+
+Usage (from the backend directory):
+    python benchmarks/bench_api_scheduler.py --quota 20 --window 1 --bulk-calls 200
+"""
+import argparse
+import logging
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from fakes import FakeQuotaAPI, ResourceExhausted
+from services import api_scheduler
+
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    return statistics.quantiles(values, n=100, method='inclusive')[pct - 1] if len(values) > 1 else values[0]
+
+
+def direct_call(api, tokens, args):
+    for attempt in range(1, args.max_attempts + 1):
+        try:
+            return api.call(tokens)
+        except ResourceExhausted:
+            if attempt == args.max_attempts:
+                raise
+            time.sleep(random.uniform(0, min(args.backoff_max, args.backoff_base * 2 ** (attempt - 1))))
+
+
+def run(mode, args):
+    api = FakeQuotaAPI(args.quota, args.token_quota, args.window, args.latency)
+    scheduler = api_scheduler.APIScheduler(
+        'fake',
+        requests_per_minute=args.quota * 60 / args.window * args.headroom,
+        tokens_per_minute=args.token_quota * 60 / args.window * args.headroom,
+        max_in_flight=args.max_in_flight,
+        burst_seconds=args.burst_seconds,
+        max_attempts=args.max_attempts,
+        backoff_base_seconds=args.backoff_base,
+        backoff_max_seconds=args.backoff_max,
+    )
+    app = Flask(__name__)
+    app.logger.setLevel(logging.ERROR)
+    latencies = {api_scheduler.INTERACTIVE: [], api_scheduler.BULK: []}
+    failures = []
+    lock = threading.Lock()
+    rng = random.Random(0)
+    token_sizes = [rng.randint(args.tokens_per_call // 2, args.tokens_per_call * 3 // 2) for _ in range(args.bulk_calls + args.interactive_calls)]
+
+    def one_call(lane_name, tokens):
+        started = time.perf_counter()
+        try:
+            if mode == 'direct':
+                direct_call(api, tokens, args)
+            else:
+                with app.app_context(), api_scheduler.lane(lane_name):
+                    scheduler.call(lambda: api.call(tokens), tokens=tokens)
+        except ResourceExhausted as e:
+            with lock:
+                failures.append(e)
+            return
+        with lock:
+            latencies[lane_name].append(time.perf_counter() - started)
+
+    def interactive_stream(executor):
+        for i in range(args.interactive_calls):
+            time.sleep(args.interactive_interval)
+            executor.submit(one_call, api_scheduler.INTERACTIVE, token_sizes[args.bulk_calls + i])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.bulk_threads) as bulk, ThreadPoolExecutor(max_workers=4) as interactive:
+        for i in range(args.bulk_calls):
+            bulk.submit(one_call, api_scheduler.BULK, token_sizes[i])
+        interactive_stream(interactive)
+    elapsed = time.perf_counter() - started
+
+    done = sum(len(values) for values in latencies.values())
+    lane_report = ", ".join(
+        f"{lane_name} p50 {percentile(values, 50):.2f}s / p95 {percentile(values, 95):.2f}s"
+        for lane_name, values in latencies.items()
+    )
+    print(f"{mode:>9}: {done} calls in {elapsed:.1f} s ({done / elapsed:.1f}/s, quota {args.quota / args.window:.1f}/s), "
+          f"{api.rejected} x 429, {len(failures)} gave up; {lane_report}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quota', type=int, default=20, help='Requests per window accepted by the fake API')
+    parser.add_argument('--token-quota', type=int, default=20000, help='Tokens per window (0 = unlimited)')
+    parser.add_argument('--window', type=float, default=1.0, help='Quota window in seconds (Google uses 60)')
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--tokens-per-call', type=int, default=800)
+    parser.add_argument('--bulk-calls', type=int, default=200)
+    parser.add_argument('--bulk-threads', type=int, default=32)
+    parser.add_argument('--interactive-calls', type=int, default=20)
+    parser.add_argument('--interactive-interval', type=float, default=0.25)
+    parser.add_argument('--max-in-flight', type=int, default=8)
+    parser.add_argument('--burst-seconds', type=float, default=0.1)
+    parser.add_argument('--headroom', type=float, default=0.9, help='Fraction of the quota the scheduler aims for')
+    parser.add_argument('--max-attempts', type=int, default=6)
+    parser.add_argument('--backoff-base', type=float, default=0.05)
+    parser.add_argument('--backoff-max', type=float, default=1.0)
+    args = parser.parse_args()
+
+    for mode in ('direct', 'scheduled'):
+        run(mode, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark: per-image Vision calls vs. grouped batch_annotate_images requests.
+
+Runs the batch OCR fan-out from services/invoice_processor.py against the local
+FakeVisionClient (benchmarks/fakes.py), so no Google credentials are needed
+(the google-cloud-vision package must be installed for its request types).
+
+Usage (from the backend directory):
+    python benchmarks/bench_batch_ocr.py --images 200 --request-latency-ms 300
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from fakes import FakeVisionClient
+from services import invoice_processor, ocr_backends, vision_service
+
+
+def report(label, images, requests, elapsed):
+    print(f"{label:>10}: {images} images, {requests} API requests, {elapsed:.2f} s, {images / elapsed:.1f} images/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--images', type=int, default=200)
+    parser.add_argument('--request-latency-ms', type=float, default=300)
+    parser.add_argument('--per-image-latency-ms', type=float, default=20)
+    parser.add_argument('--group-size', type=int, default=16)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config.update(CACHE_ENABLED=False, OCR_BACKEND='vision')
+    with tempfile.TemporaryDirectory() as tmp, app.app_context():
+        images = []
+        for i in range(args.images):
+            path = os.path.join(tmp, f"receipt_{i}.jpg")
+            with open(path, 'wb') as f:
+                f.write(os.urandom(2048))
+            images.append((i + 1, path))
+        backend = ocr_backends.get_backend()
+
+        # Baseline: one text_detection call per image, as POST /upload does
+        client = FakeVisionClient(args.request_latency_ms / 1000.0, args.per_image_latency_ms / 1000.0)
+        vision_service.set_vision_client(client)
+        started = time.perf_counter()
+        for _, path in images:
+            with open(path, 'rb') as f:
+                backend.image_to_text(f.read())
+        report('per-image', len(images), client.requests, time.perf_counter() - started)
+
+        # Batch endpoint: grouped batch_annotate_images requests, several in flight
+        client = FakeVisionClient(args.request_latency_ms / 1000.0, args.per_image_latency_ms / 1000.0)
+        vision_service.set_vision_client(client)
+        groups = [images[i:i + args.group_size] for i in range(0, len(images), args.group_size)]
+        started = time.perf_counter()
+        texts = {}
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            for result in executor.map(lambda group: invoice_processor._ocr_image_group(app, backend, group), groups):
+                texts.update(result)
+        report('batched', len(texts), client.requests, time.perf_counter() - started)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Benchmark: bytes and latency of invoice reads with conditional GET and the response cache.
+
+Serves the real invoice blueprint (routes/invoice_routes.py) from a Flask test client
+over a SQLite stand-in (benchmarks/sqlite_standin.py) seeded with invoices that carry
+realistic raw_text and line items, and compares, for the list and detail endpoints:
+
+    full:        a 200 built from the database with every column (?fields=... incl. raw_text),
+                 the response cache disabled (what every poll cost before)
+    projected:   the default projection (no raw_text), cache disabled
+    cached:      the default projection served from services/response_cache.py
+    revalidated: a repeat request with If-None-Match, answered 304 without a body
+
+Latency is per request, in-process (no network), with an optional simulated database
+round trip (--db-latency-ms) so that skipped queries show up.
+
+Usage (from the backend directory):
+    python benchmarks/bench_conditional_get.py --invoices 20000 --requests 500 --db-latency-ms 0.5
+"""
+import argparse
+import datetime
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+import db
+from sqlite_standin import SQLiteStandInConnection, INVOICE_FIELDS_DDL
+from fixtures import invoice_lines
+from services import response_cache
+from routes import invoice_routes
+
+# SQLite subset of schema.sql
+SCHEMA = """
+CREATE TABLE invoices (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INT,
+    batch_id INT NULL,
+    file_name VARCHAR(255) NOT NULL,
+    original_file_path VARCHAR(512),
+    status VARCHAR(50) DEFAULT 'uploaded',
+    uploaded_at TIMESTAMP,
+    processed_at TIMESTAMP NULL,
+    updated_at TIMESTAMP,
+    raw_text MEDIUMTEXT NULL,
+    vendor_name VARCHAR(255) NULL,
+    invoice_number VARCHAR(255) NULL,
+    invoice_date DATE NULL,
+    total_amount DECIMAL(15, 2) NULL,
+    currency VARCHAR(10) NULL
+);
+CREATE INDEX idx_invoices_uploaded_at_id ON invoices(uploaded_at, id);
+CREATE TABLE invoice_line_items (
+    invoice_id INT NOT NULL,
+    line_index INT NOT NULL,
+    description TEXT NULL,
+    quantity DECIMAL(15, 3) NULL,
+    unit_price DECIMAL(15, 4) NULL,
+    item_total DECIMAL(15, 2) NULL,
+    PRIMARY KEY (invoice_id, line_index)
+);
+CREATE TABLE cache_versions (
+    name VARCHAR(64) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP
+);
+"""
+
+FULL_FIELDS = ','.join(invoice_routes.INVOICE_COLUMNS)
+
+
+def seed(args):
+    conn = SQLiteStandInConnection(latency_seconds=args.db_latency_ms / 1000)
+    conn.raw.executescript(SCHEMA)
+    conn.raw.execute(INVOICE_FIELDS_DDL)
+    rng = random.Random(args.seed)
+    started_at = datetime.datetime(2024, 1, 1)
+    rows, items = [], []
+    for invoice_id in range(1, args.invoices + 1):
+        line_count = rng.randint(1, 8)
+        raw_text = "\n".join(invoice_lines(f"INV-{invoice_id:06d}", line_count, seed=invoice_id))
+        uploaded_at = started_at + datetime.timedelta(seconds=invoice_id * 37)
+        rows.append((invoice_id, rng.randrange(1, 50), f"invoice_{invoice_id}.jpg", f"uploads/invoice_{invoice_id}.jpg",
+                     'processed', uploaded_at, uploaded_at, uploaded_at, raw_text,
+                     f"Vendor {rng.randrange(300)}", f"INV-{invoice_id:06d}", uploaded_at.date(),
+                     str(Decimal(rng.randint(100, 500_000)) / 100), 'INR'))
+        for line_index in range(1, line_count + 1):
+            items.append((invoice_id, line_index, f"Item {rng.randrange(1000)}", '1.000', '10.0000', '10.00'))
+    conn.raw.executemany("INSERT INTO invoices (id, user_id, file_name, original_file_path, status, uploaded_at, processed_at, "
+                         "updated_at, raw_text, vendor_name, invoice_number, invoice_date, total_amount, currency) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.raw.executemany("INSERT INTO invoice_line_items VALUES (?, ?, ?, ?, ?, ?)", items)
+    conn.raw.execute("INSERT INTO cache_versions VALUES ('invoices', 1, ?)", (started_at,))
+    conn.raw.commit()
+    return conn
+
+
+def measure(client, conn, urls, enabled, revalidate=False):
+    """(mean response bytes, p50 ms, p95 ms, round trips per request) over `urls`."""
+    client.application.config['RESPONSE_CACHE_ENABLED'] = enabled
+    etags = {}
+    if revalidate or enabled:
+        # Warm up: the client / cache has seen every URL once
+        for url in urls:
+            etags[url] = client.get(url).headers.get('ETag')
+    sizes, latencies = [], []
+    round_trips = conn.round_trips
+    for url in urls:
+        headers = {'If-None-Match': etags[url]} if revalidate else {}
+        started = time.perf_counter()
+        response = client.get(url, headers=headers)
+        latencies.append(time.perf_counter() - started)
+        assert response.status_code == (304 if revalidate else 200), (url, response.status_code)
+        sizes.append(len(response.get_data()))
+    latencies.sort()
+    return (statistics.mean(sizes), latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.95)] * 1000, (conn.round_trips - round_trips) / len(urls))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--invoices', type=int, default=20_000)
+    parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint and mode')
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--db-latency-ms', type=float, default=0.5, help='Simulated database round trip')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    sqlite3.register_adapter(Decimal, str)
+    app = Flask(__name__)
+    app.logger.setLevel(logging.ERROR)
+    app.register_blueprint(invoice_routes.invoice_bp)
+    app.config['RESPONSE_CACHE_MAX_BYTES'] = 256 * 1024 * 1024
+    conn = seed(args)
+    # The benchmark's database: every request of the blueprint uses the stand-in connection
+    db.get_db = lambda: conn
+    client = app.test_client()
+
+    rng = random.Random(args.seed + 1)
+    pages = max(1, args.invoices // args.page_size)
+    with app.app_context():
+        # Walk the first pages once to collect their cursors; polling clients re-read the same few pages
+        cursors, url = [None], f"/api/invoices/?limit={args.page_size}"
+        for _ in range(min(pages, 20) - 1):
+            next_cursor = client.get(url + (f"&cursor={cursors[-1]}" if cursors[-1] else "")).get_json()['next_cursor']
+            if not next_cursor:
+                break
+            cursors.append(next_cursor)
+    list_urls = [f"/api/invoices/?limit={args.page_size}" + (f"&cursor={c}" if c else "")
+                 for c in (rng.choice(cursors) for _ in range(args.requests))]
+    detail_urls = [f"/api/invoices/{rng.randint(1, args.invoices)}" for _ in range(args.requests)]
+
+    print(f"{args.invoices} invoices, {args.requests} requests per row, simulated DB round trip {args.db_latency_ms} ms")
+    for name, urls in (('list', list_urls), ('detail', detail_urls)):
+        full_urls = [url + ('&' if '?' in url else '?') + f"fields={FULL_FIELDS}" for url in urls]
+        if name == 'detail':
+            full_urls = [url + ',line_items' for url in full_urls]
+        results = [
+            ('full', measure(client, conn, full_urls, enabled=False)),
+            ('projected', measure(client, conn, urls, enabled=False)),
+            ('cached', measure(client, conn, urls, enabled=True)),
+            ('revalidated', measure(client, conn, urls, enabled=True, revalidate=True)),
+        ]
+        full_bytes = results[0][1][0]
+        for mode, (size, p50, p95, trips) in results:
+            print(f"  {name:<6} {mode:<11} {size:>9,.0f} B ({size / full_bytes:6.1%})  p50 {p50:6.2f} ms  "
+                  f"p95 {p95:6.2f} ms  {trips:.1f} queries")
+    with app.app_context():
+        print(f"response cache: {response_cache.get_cache().stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+Benchmark: bulk invoice export, paging through the list endpoint vs. the streaming export.
+
+Serves the real invoice blueprint (routes/invoice_routes.py) from a Flask test client over a
+SQLite stand-in (benchmarks/sqlite_standin.py) seeded with invoices that carry additional
+fields (invoice_fields) and line items, and reads every invoice:
+
+    paged:      GET /api/invoices/?limit=200 following next_cursor, the way export scripts
+                use the API today (no invoice_fields; those are not in the list at all)
+    export:     GET /api/invoices/export?format=...&dataset=... streamed to the end
+
+For each mode it reports requests, wall time, bytes and the peak of Python memory allocated
+while the response is produced and consumed (tracemalloc, in a second pass, since tracing slows
+everything down). The export's peak should stay flat as --invoices grows; the page size bounds
+the paged mode's, at the cost of one request per 200 invoices.
+
+Usage (from the backend directory):
+    python benchmarks/bench_export.py --invoices 5000 20000 --db-latency-ms 0.5
+"""
+import argparse
+import datetime
+import logging
+import os
+import random
+import sqlite3
+import sys
+import time
+import tracemalloc
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+import db
+from sqlite_standin import SQLiteStandInConnection, INVOICE_FIELDS_DDL
+from routes import invoice_routes
+from services import invoice_export
+
+# SQLite subset of schema.sql
+SCHEMA = """
+CREATE TABLE invoices (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INT,
+    batch_id INT NULL,
+    file_name VARCHAR(255) NOT NULL,
+    original_file_path VARCHAR(512),
+    status VARCHAR(50) DEFAULT 'uploaded',
+    uploaded_at TIMESTAMP,
+    processed_at TIMESTAMP NULL,
+    updated_at TIMESTAMP,
+    raw_text MEDIUMTEXT NULL,
+    vendor_name VARCHAR(255) NULL,
+    invoice_number VARCHAR(255) NULL,
+    invoice_date DATE NULL,
+    total_amount DECIMAL(15, 2) NULL,
+    currency VARCHAR(10) NULL
+);
+CREATE INDEX idx_invoices_uploaded_at_id ON invoices(uploaded_at, id);
+CREATE TABLE invoice_line_items (
+    invoice_id INT NOT NULL,
+    line_index INT NOT NULL,
+    description TEXT NULL,
+    quantity DECIMAL(15, 3) NULL,
+    unit_price DECIMAL(15, 4) NULL,
+    item_total DECIMAL(15, 2) NULL,
+    PRIMARY KEY (invoice_id, line_index)
+);
+CREATE TABLE cache_versions (
+    name VARCHAR(64) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP
+);
+CREATE INDEX idx_invoice_fields_invoice_id ON invoice_fields(invoice_id);
+"""
+
+FIELD_NAMES = ('subtotal', 'tax_amount', 'payment_terms', 'gstin', 'due_date', 'po_number')
+
+
+def seed(invoice_count, args):
+    conn = SQLiteStandInConnection(latency_seconds=args.db_latency_ms / 1000)
+    conn.raw.execute(INVOICE_FIELDS_DDL)
+    conn.raw.executescript(SCHEMA)
+    rng = random.Random(args.seed)
+    started_at = datetime.datetime(2024, 1, 1)
+    invoices, fields, items = [], [], []
+    for invoice_id in range(1, invoice_count + 1):
+        uploaded_at = started_at + datetime.timedelta(seconds=invoice_id * 37)
+        invoices.append((invoice_id, rng.randrange(1, 50), f"invoice_{invoice_id}.jpg", f"uploads/invoice_{invoice_id}.jpg",
+                         'processed', uploaded_at, uploaded_at, uploaded_at, f"Vendor {rng.randrange(300)}",
+                         f"INV-{invoice_id:06d}", uploaded_at.date(), str(Decimal(rng.randint(100, 500_000)) / 100), 'INR'))
+        for field_name in rng.sample(FIELD_NAMES, rng.randint(2, len(FIELD_NAMES))):
+            fields.append((invoice_id, field_name, f"{field_name} value {rng.randrange(10_000)}"))
+        for line_index in range(1, rng.randint(1, 8) + 1):
+            items.append((invoice_id, line_index, f"Item {rng.randrange(1000)}", '1.000', '10.0000', '10.00'))
+    conn.raw.executemany("INSERT INTO invoices (id, user_id, file_name, original_file_path, status, uploaded_at, processed_at, "
+                         "updated_at, vendor_name, invoice_number, invoice_date, total_amount, currency) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", invoices)
+    conn.raw.executemany("INSERT INTO invoice_fields (invoice_id, field_name, field_value) VALUES (?, ?, ?)", fields)
+    conn.raw.executemany("INSERT INTO invoice_line_items VALUES (?, ?, ?, ?, ?, ?)", items)
+    conn.raw.execute("INSERT INTO cache_versions VALUES ('invoices', 1, ?)", (started_at,))
+    conn.raw.commit()
+    return conn, len(fields), len(items)
+
+
+def read_paged(client):
+    """(requests, bytes, invoices) of walking the list endpoint page by page."""
+    requests, size, invoices, cursor = 0, 0, 0, None
+    while True:
+        response = client.get(f"/api/invoices/?limit={invoice_routes.MAX_PAGE_SIZE}" + (f"&cursor={cursor}" if cursor else ""))
+        requests += 1
+        size += len(response.get_data())
+        page = response.get_json()
+        invoices += len(page['invoices'])
+        cursor = page['next_cursor']
+        if not cursor:
+            return requests, size, invoices
+
+
+def read_export(client, url):
+    """(requests, bytes, chunks) of one streamed export, consumed chunk by chunk."""
+    response = client.get(url, buffered=False)
+    assert response.status_code == 200, (url, response.status_code, response.get_data()[:200])
+    size = chunks = 0
+    for chunk in response.iter_encoded():
+        size += len(chunk)
+        chunks += 1
+    response.close()
+    return 1, size, chunks
+
+
+def measure(read):
+    started = time.perf_counter()
+    requests, size, count = read()
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    read()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return requests, size, count, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--invoices', type=int, nargs='+', default=[5000, 20000])
+    parser.add_argument('--chunk-rows', type=int, default=1000)
+    parser.add_argument('--db-latency-ms', type=float, default=0.5, help='Simulated database round trip')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    sqlite3.register_adapter(Decimal, str)
+    sqlite3.register_converter('DECIMAL', lambda value: Decimal(value.decode())) # Like mysql-connector
+    app = Flask(__name__)
+    app.logger.setLevel(logging.ERROR)
+    app.register_blueprint(invoice_routes.invoice_bp)
+    app.config.update(RESPONSE_CACHE_ENABLED=False, EXPORT_CHUNK_ROWS=args.chunk_rows)
+    client = app.test_client()
+    formats = ['csv', 'ndjson'] + (['parquet'] if invoice_export.parquet_available() else [])
+
+    for invoice_count in args.invoices:
+        conn, field_count, item_count = seed(invoice_count, args)
+        # The benchmark's database: every request of the blueprint uses the stand-in connection
+        db.get_db = lambda: conn
+        db.discard_db = lambda: None
+        print(f"{invoice_count} invoices, {field_count} invoice fields, {item_count} line items, "
+              f"simulated DB round trip {args.db_latency_ms} ms")
+        runs = [('paged list', 'invoices', lambda: read_paged(client))]
+        for export_format in formats:
+            for dataset in invoice_export.DATASETS:
+                url = f"/api/invoices/export?format={export_format}&dataset={dataset}"
+                runs.append((f"export {export_format} {dataset}", 'chunks', lambda url=url: read_export(client, url)))
+        for name, unit, read in runs:
+            requests, size, count, elapsed, peak = measure(read)
+            print(f"  {name:<28} {requests:>4} request(s) {elapsed * 1000:8.0f} ms {size / 1e6:8.2f} MB "
+                  f"({count} {unit})  peak {peak / 1e6:6.2f} MB")
+        conn.close()
+    if 'parquet' not in formats:
+        print("(parquet skipped: pyarrow is not installed)")
+
+
+if __name__ == '__main__':
+    main()
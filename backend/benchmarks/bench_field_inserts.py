@@ -0,0 +1,67 @@
+"""
+Micro-benchmark: per-row INSERTs vs. db.bulk_insert() for invoice_fields.
+
+Runs against a SQLite stand-in (benchmarks/sqlite_standin.py) with a simulated
+per-round-trip latency, so the numbers reflect what a remote MySQL would see.
+
+Usage (from the backend directory):
+    python benchmarks/bench_field_inserts.py --line-items 200 --latency-ms 0.5
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+from sqlite_standin import SQLiteStandInConnection, INVOICE_FIELDS_DDL
+
+
+def make_rows(invoice_id, line_items, additional_fields):
+    rows = []
+    for idx in range(line_items):
+        rows.append((invoice_id, f"line_item_{idx+1}_description", f"Usage charge for service line {idx+1}"))
+        rows.append((invoice_id, f"line_item_{idx+1}_amount", f"{(idx % 50) * 3.25:.2f}"))
+        rows.append((invoice_id, f"line_item_{idx+1}_quantity", str(idx % 7 + 1)))
+        rows.append((invoice_id, f"line_item_{idx+1}_unit_price", f"{(idx % 50) * 0.65:.2f}"))
+    for idx in range(additional_fields):
+        rows.append((invoice_id, f"additional_field_{idx+1}", f"value {idx+1}"))
+    return rows
+
+
+def run(strategy, rows, latency_seconds, max_statement_bytes):
+    conn = SQLiteStandInConnection(latency_seconds=latency_seconds)
+    conn.raw.execute(INVOICE_FIELDS_DDL)
+    cursor = conn.cursor()
+    started = time.perf_counter()
+    if strategy == 'per_row':
+        for row in rows:
+            cursor.execute("INSERT INTO invoice_fields (invoice_id, field_name, field_value) VALUES (%s, %s, %s)", row)
+    else:
+        db.bulk_insert(cursor, 'invoice_fields', ('invoice_id', 'field_name', 'field_value'), rows,
+                       max_statement_bytes=max_statement_bytes)
+    conn.commit()
+    elapsed = time.perf_counter() - started
+    stored = conn.raw.execute("SELECT COUNT(*) FROM invoice_fields").fetchone()[0]
+    conn.close()
+    return {'strategy': strategy, 'rows': stored, 'round_trips': conn.round_trips, 'seconds': elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--line-items', type=int, default=200)
+    parser.add_argument('--additional-fields', type=int, default=10)
+    parser.add_argument('--latency-ms', type=float, default=0.5, help='Simulated latency per round trip')
+    parser.add_argument('--max-statement-bytes', type=int, default=1024 * 1024)
+    args = parser.parse_args()
+
+    rows = make_rows(1, args.line_items, args.additional_fields)
+    for strategy in ('per_row', 'bulk'):
+        result = run(strategy, rows, args.latency_ms / 1000.0, args.max_statement_bytes)
+        print(f"{result['strategy']:>8}: {result['rows']} rows, {result['round_trips']} round trips, "
+              f"{result['seconds'] * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
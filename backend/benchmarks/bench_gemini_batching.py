@@ -0,0 +1,66 @@
+"""
+Benchmark: one Gemini prompt per invoice vs. multi-document prompts.
+
+Uses FakeGeminiModel (benchmarks/fakes.py), whose latency grows with prompt size,
+and reports requests, prompt tokens (estimated at ~4 characters per token), tokens
+saved and latency per document.
+
+Usage (from the backend directory):
+    python benchmarks/bench_gemini_batching.py --documents 40 --line-items 3
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from fakes import FakeGeminiModel
+from fixtures import invoice_lines
+from services import vision_service
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--documents', type=int, default=40)
+    parser.add_argument('--line-items', type=int, default=3, help='Small receipts are where batching pays off most')
+    parser.add_argument('--max-docs', type=int, default=8)
+    parser.add_argument('--token-budget', type=int, default=16000)
+    parser.add_argument('--request-latency-ms', type=float, default=400)
+    parser.add_argument('--malformed-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    os.environ.setdefault('GEMINI_API_KEY', 'benchmark-fake-key')
+    app = Flask(__name__)
+    app.config.update(GEMINI_BATCH_MAX_DOCS=args.max_docs, GEMINI_BATCH_TOKEN_BUDGET=args.token_budget)
+    documents = [(str(i), "\n".join(invoice_lines(f"R-{i:04d}", args.line_items, seed=i))) for i in range(args.documents)]
+
+    with app.app_context():
+        app.logger.disabled = True
+        model = FakeGeminiModel(request_latency=args.request_latency_ms / 1000.0, malformed_rate=args.malformed_rate)
+        vision_service.set_gemini_model(model)
+        failures = 0
+        started = time.perf_counter()
+        for _, ocr_text in documents:
+            try:
+                vision_service.extract_invoice_data_with_gemini(ocr_text)
+            except ValueError:
+                failures += 1
+        elapsed = time.perf_counter() - started
+        print(f"per-document: {model.requests} requests, ~{model.prompt_characters // 4} prompt tokens, "
+              f"{elapsed / len(documents) * 1000:.0f} ms/document, {failures} failures")
+
+        model = FakeGeminiModel(request_latency=args.request_latency_ms / 1000.0, malformed_rate=args.malformed_rate)
+        vision_service.set_gemini_model(model)
+        results, stats = vision_service.extract_invoice_data_batch(documents)
+        failures = sum(1 for result in results.values() if isinstance(result, Exception))
+        print(f"     batched: {model.requests} requests, ~{model.prompt_characters // 4} prompt tokens, "
+              f"{stats['latency_per_document_seconds'] * 1000:.0f} ms/document, "
+              f"~{stats['estimated_tokens_saved']} tokens saved, {stats['fallback_documents']} fallbacks, "
+              f"{stats['oversized_documents']} over budget, {failures} failures")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+"""
+Benchmark: bytes sent to OCR, OCR latency and text accuracy with image preprocessing.
+
+Generates invoice images like the ones users upload:
+
+    photo: a phone photo (4032x3024 JPEG, stored sideways with an EXIF orientation)
+           of a printed invoice lying on a darker desk
+    scan:  a 600 dpi grayscale PNG scan of a full A4 page
+
+and sends each one through vision_service.get_ocr_text_from_image() with the
+preprocessing stage (services/image_preprocessing.py) off, on (cold cache) and on
+again (cached). Vision is a local fake (benchmarks/fakes.py) whose request latency
+grows with the upload size (--upload-mbps) and the decoded pixels (--ms-per-megapixel).
+
+Accuracy is the difflib similarity between the fixture's text and what a local OCR
+reads from the exact bytes that were sent: pytesseract when it is installed
+(--ocr tesseract), otherwise a small glyph-matching OCR defined below that knows
+the fixture font but nothing about the layout, rotation or scale. The glyph OCR needs
+more pixels per character than Vision or Tesseract do, so it overstates what is lost
+by downscaling; treat its numbers as an upper bound on the accuracy cost.
+
+Usage (from the backend directory):
+    python benchmarks/bench_image_preprocessing.py --photos 6 --scans 4 --upload-mbps 20
+"""
+import argparse
+import difflib
+import io
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from PIL import Image, ImageChops, ImageDraw, ImageFilter, ImageFont, ImageMath, ImageOps, ImageStat
+
+from fakes import FakeVisionClient
+from fixtures import invoice_lines
+from services import image_preprocessing, vision_service
+
+A4_300DPI = (2480, 3508)
+FONT_SIZE_300DPI = 42 # ~10 pt
+CHARSET = ("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+           ":.,-/#()%&")
+
+
+def _font(size):
+    return ImageFont.load_default(size=size)
+
+
+def render_page(lines, dpi=300):
+    """A white A4 page with the lines printed on it, as a grayscale image."""
+    scale = dpi / 300
+    page = Image.new('L', (int(A4_300DPI[0] * scale), int(A4_300DPI[1] * scale)), 250)
+    draw = ImageDraw.Draw(page)
+    font = _font(int(FONT_SIZE_300DPI * scale))
+    y = int(300 * scale)
+    for line in lines:
+        draw.text((int(250 * scale), y), line, fill=20, font=font)
+        y += int(FONT_SIZE_300DPI * 1.6 * scale)
+    return page
+
+
+def make_photo(path, lines, seed):
+    """A phone photo of the page on a desk, stored sideways with EXIF orientation 6."""
+    rng = random.Random(seed)
+    page = render_page(lines).resize((2250, 3183), Image.BILINEAR)
+    desk = Image.effect_noise((3024, 4032), 12).point(lambda v: 110 + v // 8) # Textured desk, darker than paper
+    desk.paste(page, (rng.randint(150, 500), rng.randint(200, 600)))
+    # Sensor noise, then the uneven lighting of a handheld photo
+    photo = ImageChops.add(desk, Image.effect_noise(desk.size, 6), scale=1.0, offset=-128)
+    photo = ImageChops.multiply(photo, Image.linear_gradient('L').resize(photo.size).point(lambda v: 255 - v // 6))
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    photo.convert('RGB').transpose(Image.ROTATE_90).save(path, format='JPEG', quality=92, exif=exif, dpi=(72, 72))
+    return path
+
+
+def make_scan(path, lines):
+    page = render_page(lines, dpi=600)
+    # Scanner grain: what keeps real scans from compressing like clean renders
+    page = ImageChops.subtract(page, Image.effect_noise(page.size, 8).point(lambda v: max(0, v - 128)))
+    page.save(path, format='PNG', dpi=(600, 600))
+    return path
+
+
+class GlyphOCR:
+    """
+    Minimal OCR for text printed in the fixture font: finds text lines and glyphs from
+    ink projections, normalizes each glyph to the line's cap height and matches it
+    against rendered templates. Enough to tell whether preprocessing lost legibility.
+    """
+    HEIGHT = 32 # Normalized cap height + descender band, in pixels
+
+    def __init__(self):
+        font = _font(200)
+        cap_top, baseline = font.getbbox('H')[1], font.getbbox('H')[3]
+        self.templates = []
+        for char in CHARSET:
+            canvas = Image.new('L', (300, 300), 0)
+            ImageDraw.Draw(canvas).text((20, 0), char, fill=255, font=font)
+            left, _, right, _ = canvas.getbbox()
+            self.templates.append((char, self._normalize(canvas, left, right, cap_top, baseline)))
+
+    def _normalize(self, mask, left, right, cap_top, baseline):
+        cap = max(1, baseline - cap_top)
+        band = mask.crop((left, cap_top, right, baseline + int(cap * 0.35)))
+        width = max(1, round((right - left) * self.HEIGHT / band.height))
+        return band.resize((width, self.HEIGHT), Image.BOX)
+
+    def _match(self, glyph):
+        best, best_score = '?', None
+        for char, template in self.templates:
+            resized = glyph.resize(template.size, Image.BOX)
+            score = ImageStat.Stat(ImageChops.difference(resized, template)).mean[0]
+            score += 40 * abs(glyph.width - template.width) / max(glyph.width, template.width)
+            if best_score is None or score < best_score:
+                best, best_score = char, score
+        return best
+
+    @staticmethod
+    def _runs(profile, min_value=1):
+        runs, start = [], None
+        for i, value in enumerate(profile + [0]):
+            if value >= min_value and start is None:
+                start = i
+            elif value < min_value and start is not None:
+                runs.append((start, i))
+                start = None
+        return runs
+
+    def image_to_text(self, image_content):
+        image = ImageOps.exif_transpose(Image.open(io.BytesIO(bytes(image_content)))).convert('L')
+        # Ink is what is much darker than the local background (paper or desk, under uneven light)
+        background = image.resize((max(1, image.width // 32), max(1, image.height // 32)), Image.BOX)
+        background = background.filter(ImageFilter.MaxFilter(3)).resize(image.size, Image.BILINEAR)
+        ink = ImageMath.lambda_eval(lambda a: (a['image'] * 10 < a['background'] * 6) * 255,
+                                    image=image, background=background).convert('L')
+        # Drop the desk along the paper's edges: long runs of solid 16 px blocks, which text never fills
+        blocks = ink.resize((max(1, ink.width // 16), max(1, ink.height // 16)), Image.BOX)
+        solid = blocks.point(lambda v: 255 if v > 150 else 0)
+        edges = Image.new('L', blocks.size, 0)
+        for size in ((blocks.width, 1), (1, blocks.height)):
+            runs = solid.resize(size, Image.BOX).point(lambda v: 255 if v > 64 else 0)
+            edges = ImageChops.lighter(edges, runs.resize(blocks.size, Image.NEAREST))
+        ink = ImageChops.subtract(ink, edges.filter(ImageFilter.MaxFilter(3)).resize(ink.size, Image.NEAREST))
+        # Row/column means via a 1-pixel resize keep the projections in C
+        rows = self._runs(list(ink.resize((1, ink.height), Image.BOX).tobytes()), min_value=2)
+        lines = []
+        for top, bottom in rows:
+            if bottom - top < 6:
+                continue
+            band = ink.crop((0, top, ink.width, bottom))
+            columns = self._runs(list(band.resize((band.width, 1), Image.BOX).tobytes()), min_value=max(1, 510 // band.height))
+            glyph_boxes = [(left, right, band.crop((left, 0, right, band.height)).getbbox()) for left, right in columns]
+            glyph_boxes = [(left, right, box) for left, right, box in glyph_boxes if box]
+            if not glyph_boxes:
+                continue
+            baseline = sorted(box[3] for _, _, box in glyph_boxes)[len(glyph_boxes) // 2]
+            cap_top = min(box[1] for _, _, box in glyph_boxes)
+            cap = max(1, baseline - cap_top)
+            text, previous_right = "", None
+            for left, right, _ in glyph_boxes:
+                if previous_right is not None and left - previous_right > cap * 0.3:
+                    text += " "
+                text += self._match(self._normalize(band, left, right, cap_top, baseline))
+                previous_right = right
+            lines.append(text)
+        return "\n".join(lines)
+
+
+class TesseractOCR:
+    def __init__(self):
+        import pytesseract
+        self._pytesseract = pytesseract
+
+    def image_to_text(self, image_content):
+        return self._pytesseract.image_to_string(Image.open(io.BytesIO(bytes(image_content))))
+
+
+def similarity(expected, actual):
+    normalize = lambda text: "\n".join(" ".join(line.split()) for line in text.splitlines() if line.strip())
+    return difflib.SequenceMatcher(None, normalize(expected), normalize(actual), autojunk=False).ratio()
+
+
+class SizedLatencyVisionClient(FakeVisionClient):
+    """Fake Vision whose latency grows with the upload size and the pixels to decode; records what was sent."""
+
+    def __init__(self, request_latency, upload_mbps, ms_per_megapixel):
+        super().__init__(request_latency=request_latency, per_image_latency=0.0)
+        self.bytes_per_second = upload_mbps * 1_000_000 / 8
+        self.ms_per_megapixel = ms_per_megapixel
+        self.sent = []
+
+    def text_detection(self, image, retry=None, timeout=None, **kwargs):
+        content = image.content
+        width, height = Image.open(io.BytesIO(content)).size
+        time.sleep(len(content) / self.bytes_per_second + width * height / 1e6 * self.ms_per_megapixel / 1000)
+        self.sent.append(content)
+        return super().text_detection(image, retry=retry, timeout=timeout, **kwargs)
+
+
+def run(app, fixtures, args, enabled, ocr):
+    app.config['IMAGE_PREPROCESS_ENABLED'] = enabled
+    client = SizedLatencyVisionClient(args.request_latency_ms / 1000, args.upload_mbps, args.ms_per_megapixel)
+    vision_service.set_vision_client(client)
+    latencies = []
+    with app.app_context():
+        for path, _ in fixtures:
+            started = time.perf_counter()
+            vision_service.get_ocr_text_from_image(file_path=path, mime_type='image/jpeg')
+            latencies.append(time.perf_counter() - started)
+    accuracies = [similarity("\n".join(lines), ocr.image_to_text(sent)) for sent, (_, lines) in zip(client.sent, fixtures)]
+    latencies.sort()
+    sizes = [len(sent) for sent in client.sent]
+    return {
+        'bytes_mean': statistics.mean(sizes),
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'accuracy_mean': statistics.mean(accuracies),
+        'accuracy_min': min(accuracies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--photos', type=int, default=6)
+    parser.add_argument('--scans', type=int, default=4)
+    parser.add_argument('--line-items', type=int, default=12)
+    parser.add_argument('--request-latency-ms', type=float, default=150)
+    parser.add_argument('--upload-mbps', type=float, default=20, help='Client upload bandwidth to the OCR service')
+    parser.add_argument('--ms-per-megapixel', type=float, default=15, help='Service-side decode and detection time')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--max-long-edge', type=int, default=2400)
+    parser.add_argument('--jpeg-quality', type=int, default=85)
+    parser.add_argument('--ocr', choices=('glyph', 'tesseract'), default='glyph')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.logger.setLevel(logging.ERROR)
+    app.config.update(OCR_BACKEND='vision', CACHE_ENABLED=False, IMAGE_PREPROCESS_WORKERS=args.workers,
+                      IMAGE_MAX_LONG_EDGE=args.max_long_edge, IMAGE_JPEG_QUALITY=args.jpeg_quality)
+    ocr = TesseractOCR() if args.ocr == 'tesseract' else GlyphOCR()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fixtures = []
+        for i in range(args.photos + args.scans):
+            lines = invoice_lines(f"INV-{i:05d}", args.line_items, seed=i)
+            if i < args.photos:
+                fixtures.append((make_photo(os.path.join(tmp, f"photo_{i}.jpg"), lines, seed=i), lines))
+            else:
+                fixtures.append((make_scan(os.path.join(tmp, f"scan_{i}.png"), lines), lines))
+
+        with app.app_context():
+            # A long-running process has its pool up already; don't bill the spawn to the first image
+            image_preprocessing._get_executor(args.workers).submit(int).result()
+        print(f"{args.photos} photos + {args.scans} scans, {args.ocr} OCR for accuracy, "
+              f"upload {args.upload_mbps} Mbit/s, {args.request_latency_ms} ms + {args.ms_per_megapixel} ms/MP per request")
+        for kind, subset in (('photo', fixtures[:args.photos]), ('scan', fixtures[args.photos:])):
+            if not subset:
+                continue
+            rows = [('original', run(app, subset, args, False, ocr)),
+                    ('preprocessed', run(app, subset, args, True, ocr)),
+                    ('cached', run(app, subset, args, True, ocr))]
+            baseline = rows[0][1]['bytes_mean']
+            for mode, result in rows:
+                print(f"  {kind:<5} {mode:<12} {result['bytes_mean'] / 1024:8,.0f} KiB sent ({result['bytes_mean'] / baseline:6.1%})  "
+                      f"p50 {result['p50_ms']:7.1f} ms  max {result['max_ms']:7.1f} ms  "
+                      f"accuracy {result['accuracy_mean']:.3f} (min {result['accuracy_min']:.3f})")
+        with app.app_context():
+            print(f"preprocessing: {vision_service.get_image_preprocessor().stats()}")
+    image_preprocessing.shutdown_executor()
+
+
+if __name__ == '__main__':
+    main()
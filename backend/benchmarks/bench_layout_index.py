@@ -0,0 +1,100 @@
+"""
+Benchmark: the learned vendor layout index (services/layout_index.py).
+
+Streams a synthetic receipt corpus (benchmarks/fixtures.py) through a LayoutIndex the
+way invoice_processor does: each document is matched against the known layouts; if the
+matching layout has a learned template, it is extracted locally, otherwise "Gemini"
+(the corpus' expected values, so no API is needed) extracts it and the result is added
+to the index. Reports match latency, how many documents used the learned template,
+a few-shot prompt or the full prompt, and the accuracy of the learned extractions,
+line items included.
+
+Usage (from the backend directory):
+    python benchmarks/bench_layout_index.py --documents 5000 --noise 0.05
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from fixtures import ocr_noise, receipt_corpus
+from services import layout_index
+
+FIELDS = ('vendor_name', 'invoice_number', 'invoice_date', 'total_amount', 'detected_currency')
+
+
+def field_ok(field, value, expected):
+    if field == 'total_amount':
+        return value is not None and abs(value - expected) < 0.01
+    return value == expected
+
+
+def line_items_ok(items, expected):
+    return len(items) == len(expected) and all(
+        item['description'] == want['description']
+        and all(field_ok('total_amount', item[key], want[key]) if want[key] is not None else item[key] is None
+                for key in ('quantity', 'unit_price', 'item_total'))
+        for item, want in zip(items, expected))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--documents', type=int, default=5000)
+    parser.add_argument('--noise', type=float, default=0.05, help='Share of lines with an OCR character confusion')
+    parser.add_argument('--threshold', type=float, default=0.6)
+    parser.add_argument('--min-samples', type=int, default=3)
+    parser.add_argument('--max-layouts', type=int, default=5000)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.logger.setLevel(logging.ERROR)
+    corpus = [(ocr_noise(text, args.noise, seed=i), expected)
+              for i, (text, expected) in enumerate(receipt_corpus(args.documents, unknown_share=0.3))]
+    index = layout_index.LayoutIndex(match_threshold=args.threshold, min_samples=args.min_samples,
+                                     max_layouts=args.max_layouts)
+
+    match_latencies, learned_latencies = [], []
+    counts = {'learned': 0, 'few-shot': 0, 'full prompt': 0}
+    wrong_learned = 0
+    field_hits = {field: 0 for field in FIELDS + ('line_items',)}
+    with app.app_context():
+        for ocr_text, expected in corpus:
+            started = time.perf_counter()
+            layout, _ = index.match(ocr_text)
+            match_latencies.append(time.perf_counter() - started)
+            if layout is not None:
+                started = time.perf_counter()
+                data = index.extract_learned(layout, ocr_text)
+                learned_latencies.append(time.perf_counter() - started)
+                if data is not None:
+                    counts['learned'] += 1
+                    correct = {field: field_ok(field, data[field], expected[field]) for field in FIELDS}
+                    correct['line_items'] = line_items_ok(data['line_items'], expected['line_items'])
+                    wrong_learned += not all(correct.values())
+                    for field in correct:
+                        field_hits[field] += correct[field]
+                    continue
+            counts['few-shot' if layout is not None and layout.example_text else 'full prompt'] += 1
+            index.add_sample(ocr_text, expected)
+        stats = index.stats()
+
+    match_us = sorted(latency * 1e6 for latency in match_latencies)
+    print(f"{len(corpus)} documents, {stats['layouts']} layout(s), {stats['layouts_with_template']} with a learned template")
+    print(f"match latency: mean {statistics.mean(match_us):.0f} us, p95 {match_us[int(len(match_us) * 0.95) - 1]:.0f} us, "
+          f"max {match_us[-1]:.0f} us")
+    if learned_latencies:
+        print(f"learned-template extraction: mean {statistics.mean(learned_latencies) * 1e6:.0f} us")
+    print("extraction path: " + ", ".join(f"{path} {count} ({count / len(corpus):.0%})" for path, count in counts.items()))
+    if counts['learned']:
+        print(f"  learned extractions with a wrong field: {wrong_learned}; accuracy: " + ", ".join(
+            f"{field} {hits / counts['learned']:.1%}" for field, hits in field_hits.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark: cost of the per-stage timers (services/metrics.py) and of payload logging.
+
+    timer:    an empty block vs. the same block under metrics.stage_timer()
+    logging:  logging the structured data of a multi-page invoice (with its raw_text) the old
+              way (f-string at INFO) vs. payload_logging.debug() with the logger at INFO
+              (nothing formatted) and at DEBUG (formatted and truncated)
+    pipeline: vision_service.extract_invoice_data_with_gemini() against a zero-latency
+              FakeGeminiModel (benchmarks/fakes.py), so the timers' share of the hot path
+              is not hidden behind API latency
+
+and prints the /metrics output of the run.
+
+Usage (from the backend directory):
+    python benchmarks/bench_metrics_overhead.py --iterations 200000 --pages 20
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from fakes import FakeGeminiModel
+from fixtures import invoice_lines
+from services import metrics, payload_logging, vision_service
+
+
+def per_call(function, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - started) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200000)
+    parser.add_argument('--pages', type=int, default=20, help='Size of the logged invoice')
+    parser.add_argument('--extractions', type=int, default=2000)
+    args = parser.parse_args()
+
+    os.environ.setdefault('GEMINI_API_KEY', 'benchmark-fake-key')
+    app = Flask(__name__)
+    app.config.update(LOG_PAYLOAD_SAMPLE_RATE=1.0, LOG_PAYLOAD_MAX_CHARS=2000)
+    logger = logging.getLogger('bench_metrics_overhead')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    with app.app_context():
+        def empty():
+            pass
+
+        def timed():
+            with metrics.stage_timer('benchmark'):
+                pass
+
+        base, with_timer = per_call(empty, args.iterations), per_call(timed, args.iterations)
+        print(f"timer:    empty block {base * 1e9:6.0f} ns, with stage_timer {with_timer * 1e9:6.0f} ns "
+              f"(+{(with_timer - base) * 1e9:.0f} ns per stage)")
+
+        text = "\n".join(invoice_lines("INV-0001", line_items=args.pages * 30, seed=1))
+        structured_data = {'vendor_name': 'Acme Utilities Pvt Ltd', 'total_amount': 1234.5, 'raw_text': text,
+                           'line_items': [{'description': f'Service item {i}', 'item_total': 10.0} for i in range(args.pages * 30)]}
+        iterations = max(1, args.iterations // 100)
+        logger.setLevel(logging.INFO)
+        old = per_call(lambda: logger.info(f"Final Processed Structured Data: {structured_data}"), iterations)
+        gated = per_call(lambda: payload_logging.debug(logger, "Final Processed Structured Data: ", structured_data), iterations)
+        logger.setLevel(logging.DEBUG)
+        sampled = per_call(lambda: payload_logging.debug(logger, "Final Processed Structured Data: ", structured_data), iterations)
+        print(f"logging:  {len(text)} characters of raw_text; f-string at INFO {old * 1e6:8.1f} us, "
+              f"payload_logging at INFO {gated * 1e6:6.2f} us, at DEBUG {sampled * 1e6:8.1f} us")
+
+        app.logger.disabled = True
+        vision_service.set_gemini_model(FakeGeminiModel(request_latency=0, seconds_per_1k_tokens=0))
+        app.config.update(GEMINI_COMPACT_TEXT=True, GEMINI_MAX_PROMPT_TOKENS=10 ** 9)
+        short_text = "\n".join(invoice_lines("INV-0002", line_items=5, seed=2))
+        started = time.perf_counter()
+        for _ in range(args.extractions):
+            vision_service.extract_invoice_data_with_gemini(short_text)
+        elapsed = (time.perf_counter() - started) / args.extractions
+        count, total = metrics.STAGE_SECONDS.summary('gemini')
+        print(f"pipeline: {elapsed * 1e6:.0f} us per extraction with 2 timed stages (gemini, json_parse); "
+              f"timers ~{2 * (with_timer - base) / elapsed:.2%} of it; {count} gemini calls, {total:.3f}s")
+
+    print()
+    print("\n".join(line for line in metrics.render().splitlines() if 'benchmark' not in line))
+
+
+if __name__ == '__main__':
+    main()
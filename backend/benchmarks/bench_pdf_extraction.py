@@ -0,0 +1,79 @@
+"""
+Benchmark: PDF text extraction throughput and peak memory.
+
+Generates synthetic multi-page statements and extracts them sequentially and
+with the process pool from services/pdf_extraction.py. Each run happens in a
+fresh subprocess so that peak RSS (ru_maxrss, including pool workers) is per run.
+
+Usage (from the backend directory):
+    python benchmarks/bench_pdf_extraction.py --pages 50 200 --workers 1 4
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from fixtures import make_text_pdf, statement_pages
+
+
+def run_single(pdf_path, workers, stop_at_totals):
+    from services import pdf_extraction
+    started = time.perf_counter()
+    pages = characters = 0
+    for page_number, text in pdf_extraction.iter_page_texts(
+        pdf_path, workers=workers, parallel_min_pages=2, stop_at_totals=stop_at_totals
+    ):
+        pages = page_number
+        characters += len(text)
+    elapsed = time.perf_counter() - started
+    pdf_extraction.shutdown_executor()  # reap the pool so its peak RSS shows up in RUSAGE_CHILDREN
+    # ru_maxrss is in KiB on Linux
+    peak_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    print(json.dumps({
+        'pages': pages,
+        'characters': characters,
+        'seconds': elapsed,
+        'pages_per_sec': pages / elapsed if elapsed else 0.0,
+        'peak_rss_mib': peak_self / 1024,
+        'peak_worker_rss_mib': peak_children / 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, nargs='+', default=[20, 100])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--stop-at-totals', action='store_true')
+    parser.add_argument('--single', nargs=3, metavar=('PDF', 'WORKERS', 'STOP'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        pdf_path, workers, stop = args.single
+        run_single(pdf_path, int(workers), stop == '1')
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for page_count in args.pages:
+            pdf_path = make_text_pdf(os.path.join(tmp, f"statement_{page_count}.pdf"), statement_pages(page_count))
+            for workers in args.workers:
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--single', pdf_path, str(workers),
+                     '1' if args.stop_at_totals else '0'],
+                    check=True, capture_output=True, text=True, cwd=BACKEND_DIR
+                ).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                print(f"{page_count:>5} pages, {workers} worker(s): {result['pages_per_sec']:8.1f} pages/s, "
+                      f"{result['seconds']:6.2f} s, peak RSS {result['peak_rss_mib']:.1f} MiB "
+                      f"(workers {result['peak_worker_rss_mib']:.1f} MiB)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,403 @@
+"""
+Benchmark: the whole POST /api/invoices/upload -> OCR -> extraction -> persistence pipeline, offline.
+
+Runs the real app (app.py: routes, job queue workers, invoice_processor) with
+FakeVisionClient / FakeGeminiModel (benchmarks/fakes.py) in place of the Google APIs and
+a SQLite stand-in database (benchmarks/sqlite_standin.py, schema.sql translated) in place
+of MySQL. Uploads go through the Flask test client, so request parsing and the streaming
+upload path are included; the in-process job workers do the rest.
+
+The corpus is generated: PNG scans, text PDFs and scanned (image-only) PDFs with varying
+page and line item counts (fixtures.py). API latencies follow configurable distributions
+(fixed:S, uniform:LOW,HIGH, lognormal:MEDIAN,SIGMA, in seconds) with failure rates.
+
+For each concurrency level (clients uploading at once) it reports:
+    - upload request latency and end-to-end latency (upload start -> processed / error) p50/p95/p99
+    - invoices/s from the first upload to the last invoice finished
+    - per-stage timings: save (commit_upload), ocr (_get_ocr_text, incl. PDF parsing),
+      llm (_extract_structured_data), store (_store_extraction), db (all database time),
+      queue (upload response -> worker start)
+    - peak RSS during the level, API requests and database round trips per invoice
+
+Results are written as JSON (--output); --compare BASELINE.json prints the differences to
+an earlier run and exits with status 1 if p95 latency or throughput regressed by more than
+--regression-threshold.
+
+By default the shortcuts that skip OCR or Gemini (result cache, pre-extraction, learned
+layouts) and the API rate limits are off so every invoice exercises every stage at the
+speed of the fakes; turn them on with --config.
+
+Usage (from the backend directory):
+    python benchmarks/bench_pipeline.py --invoices 100 --concurrency 1,4,16 --output pipeline.json
+    python benchmarks/bench_pipeline.py --invoices 100 --concurrency 1,4,16 --compare pipeline.json
+    python benchmarks/bench_pipeline.py --config PRE_EXTRACTION_ENABLED=true --gemini-latency lognormal:2,0.6
+"""
+import argparse
+import datetime
+import hashlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from fakes import FakeGeminiModel, FakeVisionClient, parse_latency
+from fixtures import invoice_lines, make_png, make_text_pdf, noisy_page
+from sqlite_standin import SQLiteStandInPool
+
+# Shortcuts that would skip stages are off, and so are the API rate limits (the fakes have no
+# quota; with the default 60 Gemini requests/minute the scheduler would be all that is measured)
+DEFAULT_CONFIG = {
+    'CACHE_ENABLED': False,
+    'PRE_EXTRACTION_ENABLED': False,
+    'LAYOUT_INDEX_ENABLED': False,
+    'GEMINI_REQUESTS_PER_MINUTE': 0,
+    'GEMINI_TOKENS_PER_MINUTE': 0,
+    'VISION_REQUESTS_PER_MINUTE': 0,
+}
+STAGES = ('save', 'queue', 'ocr', 'llm', 'store')
+
+
+def current_rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def percentiles(values, scale=1000.0):
+    """p50/p95/p99/mean/max (nearest rank), in ms for durations in seconds."""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered))) - 1))] * scale
+
+    return {'p50': round(rank(50), 2), 'p95': round(rank(95), 2), 'p99': round(rank(99), 2),
+            'mean': round(sum(ordered) / len(ordered) * scale, 2), 'max': round(ordered[-1] * scale, 2)}
+
+
+class Recorder:
+    """Thread-safe collection of stage durations and per-invoice timestamps for one level."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {stage: [] for stage in STAGES}
+        self.uploaded = {} # invoice id -> (upload start, upload end)
+        self.finished = {} # invoice id -> (finish time, ok)
+        self.upload_latencies = []
+        self.upload_failures = 0
+        self.all_done = threading.Event()
+        self.expected = None
+
+    def stage(self, name, seconds):
+        with self.lock:
+            self.stages[name].append(seconds)
+
+    def finish(self, invoice_id, ok):
+        with self.lock:
+            self.finished.setdefault(invoice_id, (time.perf_counter(), ok))
+            if self.expected is not None and len(self.finished) >= self.expected:
+                self.all_done.set()
+
+
+_recorder = None
+
+
+def instrument(module, name, stage):
+    """Replaces module.name with a wrapper that records its duration under `stage`."""
+    original = getattr(module, name)
+
+    def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            if _recorder is not None:
+                _recorder.stage(stage, time.perf_counter() - started)
+    setattr(module, name, timed)
+
+
+def build_corpus(args, directory):
+    """[(filename, bytes)] plus the OCR text the fake Vision client returns for each image."""
+    rng = random.Random(args.seed)
+    kinds, weights = zip(*((kind, float(weight)) for kind, weight in
+                           (part.split('=') for part in args.mix.split(','))))
+    width, height = (int(value) for value in args.image_size.split('x'))
+    corpus, texts = [], {}
+    for i in range(args.invoices):
+        kind = rng.choices(kinds, weights)[0]
+        pages = rng.randint(1, args.max_pages)
+        line_items = rng.randint(1, args.max_line_items)
+        lines = invoice_lines(f"BENCH-{i:05d}", line_items, seed=args.seed + i,
+                              vendor=f"Vendor {rng.randrange(args.vendors)} Pvt Ltd")
+        path = os.path.join(directory, f"invoice_{i}")
+        if kind == 'image':
+            make_png(path + '.png', noisy_page(width, height, seed=args.seed + i, ink=0.04))
+            path += '.png'
+            with open(path, 'rb') as f:
+                texts[hashlib.sha256(f.read()).hexdigest()] = "\n".join(lines)
+        elif kind == 'pdf':
+            per_page = max(1, -(-len(lines) // pages))
+            make_text_pdf(path + '.pdf', [lines[p:p + per_page] for p in range(0, len(lines), per_page)])
+            path += '.pdf'
+        elif kind == 'scanned':
+            # Rasterized by pdf_extraction and OCRed page by page; kept small, the pixels are embedded uncompressed
+            make_text_pdf(path + '.pdf', [noisy_page(width // 3, height // 3, seed=args.seed + i * 100 + p, ink=0.04)
+                                          for p in range(pages)])
+            path += '.pdf'
+        else:
+            raise ValueError(f"Unknown document kind '{kind}' in --mix (expected image, pdf, scanned)")
+        with open(path, 'rb') as f:
+            corpus.append((os.path.basename(path), f.read()))
+    return corpus, texts
+
+
+def run_level(flask_app, concurrency, corpus, args, pool, vision, gemini):
+    global _recorder
+    recorder = Recorder()
+    recorder.expected = len(corpus)
+    _recorder = recorder
+    pool_before = pool.stats()
+    vision_before, gemini_before = vision.requests, gemini.requests
+
+    peak_rss = [current_rss_kb()]
+    sampling = threading.Event()
+
+    def sample_rss():
+        while not sampling.wait(0.05):
+            peak_rss[0] = max(peak_rss[0], current_rss_kb())
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    sampler.start()
+
+    def upload(document):
+        filename, content = document
+        client = flask_app.test_client()
+        started = time.perf_counter()
+        response = client.post('/api/invoices/upload', data={'file': (io.BytesIO(content), filename), 'user_id': '1'},
+                               content_type='multipart/form-data')
+        ended = time.perf_counter()
+        with recorder.lock:
+            recorder.upload_latencies.append(ended - started)
+            if response.status_code == 202:
+                recorder.uploaded[response.get_json()['invoice_id']] = (started, ended)
+            else:
+                recorder.upload_failures += 1
+                recorder.expected -= 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(upload, corpus))
+    with recorder.lock:
+        if len(recorder.finished) >= recorder.expected:
+            recorder.all_done.set()
+    completed = recorder.all_done.wait(args.timeout)
+    sampling.set()
+    sampler.join()
+    # Workers of a timed-out level may still be busy; don't let them count towards the next one
+    _recorder = None
+
+    with recorder.lock:
+        finished = dict(recorder.finished)
+        uploaded = dict(recorder.uploaded)
+    end_to_end = [finished[i][0] - uploaded[i][0] for i in finished if i in uploaded]
+    errors = sum(1 for _, ok in finished.values() if not ok)
+    last_finish = max((t for t, _ in finished.values()), default=time.perf_counter())
+    pool_after = pool.stats()
+    processed = max(1, len(finished))
+    return {
+        'concurrency': concurrency,
+        'invoices': len(corpus),
+        'finished': len(finished),
+        'errors': errors,
+        'upload_failures': recorder.upload_failures,
+        'timed_out': not completed,
+        'elapsed_seconds': round(last_finish - started, 3),
+        'invoices_per_second': round(len(finished) / max(last_finish - started, 1e-9), 3),
+        'upload_latency_ms': percentiles(recorder.upload_latencies),
+        'end_to_end_ms': percentiles(end_to_end),
+        'stages_ms': {stage: percentiles(recorder.stages[stage]) for stage in STAGES},
+        'db_ms_per_invoice': round((pool_after['db_seconds'] - pool_before['db_seconds']) / processed * 1000, 2),
+        'db_round_trips_per_invoice': round((pool_after['round_trips'] - pool_before['round_trips']) / processed, 1),
+        'vision_requests': vision.requests - vision_before,
+        'gemini_requests': gemini.requests - gemini_before,
+        'peak_rss_mb': round(peak_rss[0] / 1024, 1),
+    }
+
+
+def print_level(level):
+    def fmt(stats):
+        return f"p50 {stats['p50']:8.1f}  p95 {stats['p95']:8.1f}  p99 {stats['p99']:8.1f} ms" if stats else "-"
+    print(f"concurrency {level['concurrency']}: {level['finished']}/{level['invoices']} invoices "
+          f"({level['errors']} errors{', TIMED OUT' if level['timed_out'] else ''}) in {level['elapsed_seconds']:.1f} s, "
+          f"{level['invoices_per_second']:.2f} invoices/s, peak RSS {level['peak_rss_mb']:.0f} MB")
+    print(f"  {'upload':<10} {fmt(level['upload_latency_ms'])}")
+    print(f"  {'end-to-end':<10} {fmt(level['end_to_end_ms'])}")
+    for stage, stats in level['stages_ms'].items():
+        print(f"  {stage:<10} {fmt(stats)}")
+    print(f"  {'db':<10} {level['db_ms_per_invoice']:.1f} ms and {level['db_round_trips_per_invoice']:.0f} round trips "
+          f"per invoice; {level['vision_requests']} Vision / {level['gemini_requests']} Gemini requests")
+
+
+def compare(results, baseline_path, threshold):
+    """Prints changes against an earlier run; returns the number of regressions."""
+    with open(baseline_path) as f:
+        baseline = {level['concurrency']: level for level in json.load(f)['levels']}
+    regressions = 0
+    print(f"\ncompared to {baseline_path} (regression threshold {threshold:.0%}):")
+    for level in results['levels']:
+        old = baseline.get(level['concurrency'])
+        if old is None or not old['end_to_end_ms'] or not level['end_to_end_ms']:
+            continue
+        checks = [
+            ('end-to-end p95', old['end_to_end_ms']['p95'], level['end_to_end_ms']['p95'], True),
+            ('upload p95', old['upload_latency_ms']['p95'], level['upload_latency_ms']['p95'], True),
+            ('invoices/s', old['invoices_per_second'], level['invoices_per_second'], False),
+            ('peak RSS MB', old['peak_rss_mb'], level['peak_rss_mb'], True),
+        ]
+        for name, before, after, lower_is_better in checks:
+            change = (after - before) / before if before else 0.0
+            regressed = change > threshold if lower_is_better else change < -threshold
+            regressions += regressed
+            print(f"  concurrency {level['concurrency']:>3} {name:<15} {before:>10.2f} -> {after:>10.2f} "
+                  f"({change:+.1%}){'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--invoices', type=int, default=60, help='Uploads per concurrency level')
+    parser.add_argument('--concurrency', default='1,4,16', help='Comma separated numbers of concurrent uploaders')
+    parser.add_argument('--workers', type=int, default=4, help='JOB_WORKER_CONCURRENCY')
+    parser.add_argument('--mix', default='image=0.5,pdf=0.35,scanned=0.15', help='Share of PNG scans, text PDFs and scanned PDFs')
+    parser.add_argument('--max-pages', type=int, default=4)
+    parser.add_argument('--max-line-items', type=int, default=40)
+    parser.add_argument('--vendors', type=int, default=50)
+    parser.add_argument('--image-size', default='1240x1754', help='PNG scan size in pixels (A4 at 150 dpi)')
+    parser.add_argument('--vision-latency', default='lognormal:0.25,0.4', help='Per Vision request, seconds')
+    parser.add_argument('--vision-failure-rate', type=float, default=0.01)
+    parser.add_argument('--gemini-latency', default='lognormal:0.8,0.5', help='Per Gemini request before token time, seconds')
+    parser.add_argument('--gemini-seconds-per-1k-tokens', type=float, default=0.1)
+    parser.add_argument('--gemini-failure-rate', type=float, default=0.01)
+    parser.add_argument('--gemini-malformed-rate', type=float, default=0.01)
+    parser.add_argument('--db-latency-ms', type=float, default=0.2, help='Simulated database round trip')
+    parser.add_argument('--config', action='append', default=[], metavar='KEY=VALUE', help='App config override (repeatable)')
+    parser.add_argument('--timeout', type=float, default=600, help='Seconds to wait for a level to finish processing')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--compare', help='An earlier --output file to compare against')
+    parser.add_argument('--regression-threshold', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    work_dir = tempfile.mkdtemp(prefix='bench-pipeline-')
+    # Read by app.py at import time
+    os.environ.update(JOB_QUEUE_BACKEND='memory', JOB_WORKERS_IN_PROCESS='true', JOB_WORKER_CONCURRENCY=str(args.workers))
+    os.environ.setdefault('GEMINI_API_KEY', 'benchmark-fake-key')
+    from app import app as flask_app
+    import db
+    from services import invoice_processor, job_queue, upload_storage, vision_service
+
+    # Simulated API failures are expected; they are counted instead of logged
+    flask_app.logger.setLevel(logging.CRITICAL)
+    logging.getLogger().setLevel(logging.CRITICAL)
+    flask_app.root_path = work_dir # Uploads are written to <root_path>/uploads
+    flask_app.config.update(DEFAULT_CONFIG)
+    for override in args.config:
+        key, _, value = override.partition('=')
+        flask_app.config[key] = json.loads(value) if value.lower() in ('true', 'false') or value.replace('.', '', 1).isdigit() else value
+
+    rng = random.Random(args.seed)
+    corpus, texts = build_corpus(args, work_dir)
+    total_mb = sum(len(content) for _, content in corpus) / 1024 / 1024
+    print(f"corpus: {len(corpus)} documents, {total_mb:.1f} MB; workers: {args.workers}; levels: {levels}")
+
+    def ocr_text_for(image_content):
+        digest = hashlib.sha256(image_content).hexdigest()
+        # Rasterized pages of scanned PDFs: a plausible invoice page, stable per page image
+        return texts.get(digest) or "\n".join(invoice_lines(f"SCAN-{digest[:6]}", 10, seed=int(digest[:8], 16)))
+
+    vision = FakeVisionClient(request_latency=parse_latency(args.vision_latency), per_image_latency=0.0,
+                              failure_rate=args.vision_failure_rate, text_for=ocr_text_for, seed=rng.randrange(1 << 30))
+    gemini = FakeGeminiModel(request_latency=parse_latency(args.gemini_latency),
+                             seconds_per_1k_tokens=args.gemini_seconds_per_1k_tokens,
+                             malformed_rate=args.gemini_malformed_rate, failure_rate=args.gemini_failure_rate,
+                             seed=rng.randrange(1 << 30))
+    vision_service.set_vision_client(vision)
+    vision_service.set_gemini_model(gemini)
+
+    instrument(upload_storage, 'commit_upload', 'save')
+    instrument(invoice_processor, '_get_ocr_text', 'ocr')
+    instrument(invoice_processor, '_extract_structured_data', 'llm')
+    instrument(invoice_processor, '_store_extraction', 'store')
+    process_invoice = invoice_processor.process_invoice
+
+    def tracked_process_invoice(invoice_id, **payload):
+        recorder = _recorder
+        if recorder is not None:
+            with recorder.lock:
+                uploaded = recorder.uploaded.get(invoice_id)
+            if uploaded:
+                recorder.stage('queue', time.perf_counter() - uploaded[1])
+        ok = False
+        try:
+            process_invoice(invoice_id=invoice_id, **payload)
+            ok = True
+        finally:
+            if recorder is not None:
+                recorder.finish(invoice_id, ok)
+    job_queue.register_handler('process_invoice', tracked_process_invoice)
+
+    results = {
+        'benchmark': 'pipeline',
+        'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'args': vars(args),
+        'config': {key: flask_app.config.get(key) for key in sorted(set(DEFAULT_CONFIG) | {o.split('=')[0] for o in args.config})},
+        'levels': [],
+    }
+    for concurrency in levels:
+        # A fresh database per level so they all start from the same table sizes
+        pool = SQLiteStandInPool(os.path.join(work_dir, f"level_{concurrency}.sqlite3"), latency_seconds=args.db_latency_ms / 1000)
+        pool.create_schema()
+        db.get_pool = lambda pool=pool: pool
+        level = run_level(flask_app, concurrency, corpus, args, pool, vision, gemini)
+        results['levels'].append(level)
+        print_level(level)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"results written to {args.output}")
+    if args.compare:
+        regressions = compare(results, args.compare, args.regression_threshold)
+        if regressions:
+            print(f"{regressions} regression(s)")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
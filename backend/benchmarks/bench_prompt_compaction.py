@@ -0,0 +1,119 @@
+"""
+Benchmark: Gemini prompt tokens and latency with OCR text compaction and chunked extraction.
+
+Builds multi-page vendor statements the way extract_text_from_pdf() returns them (pages
+separated by text_compaction.PAGE_BREAK), each page with a letterhead, a "Page i of n"
+line, column-aligned line items and a terms & conditions footer, and extracts them with
+vision_service.extract_invoice_data_with_gemini() against FakeGeminiModel
+(benchmarks/fakes.py), whose latency grows with the prompt size:
+
+    raw:        the OCR text verbatim in one prompt (GEMINI_COMPACT_TEXT off, no chunking)
+    compacted:  compacted text in one prompt
+    chunked:    compacted text, extracted in chunks over GEMINI_MAX_PROMPT_TOKENS and merged
+
+Reports estimated OCR tokens, the largest prompt, requests, latency, and whether the line
+items and total survived (compared with the fixture).
+
+Usage (from the backend directory):
+    python benchmarks/bench_prompt_compaction.py --pages 2 10 100 --max-prompt-tokens 12000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from fakes import FakeGeminiModel
+from fixtures import invoice_lines
+from services import text_compaction, vision_service
+
+LETTERHEAD = [
+    "Acme Utilities Pvt Ltd",
+    "221B Industrial Estate, Pune 411001      Tel: +91 20 5555 0100      accounts@acme.example",
+    "GSTIN: 27ABCDE1234F1Z5                    CIN: U40100MH2001PTC123456",
+    "STATEMENT OF ACCOUNT",
+]
+TERMS = [
+    "Terms & Conditions:",
+    "1. Payment is due within 30 days of the statement date. Interest at 18% p.a. is charged on overdue amounts.",
+    "2. Disputes must be raised in writing within 7 days, failing which the statement is deemed accepted.",
+    "3. Cheques to be drawn in favour of Acme Utilities Pvt Ltd. Subject to Pune jurisdiction only.",
+    "This is a computer generated statement and does not require a signature.",
+]
+
+
+def statement_text(page_count, items_per_page, seed):
+    """(ocr_text, expected line items, expected total) of a statement as extract_text_from_pdf() returns it."""
+    body = invoice_lines("STMT-0001", line_items=page_count * items_per_page, seed=seed)
+    header, items, totals = body[:7], [line for line in body if line.startswith("Service item")], body[-3:]
+    pages = []
+    for page in range(page_count):
+        lines = LETTERHEAD + [f"Page {page + 1} of {page_count}", "=" * 72]
+        if page == 0:
+            lines += header[3:]
+        lines += [body[6], "-" * 72]
+        lines += items[page * items_per_page:(page + 1) * items_per_page]
+        if page == page_count - 1:
+            lines += ["-" * 72] + totals
+        lines += ["", "_" * 72] + TERMS
+        pages.append("\n".join(lines))
+    total = float(totals[-1].rsplit(" ", 1)[-1])
+    return f"\n{text_compaction.PAGE_BREAK}\n".join(pages), len(items), total
+
+
+def run(app, text, args, mode):
+    app.config.update(
+        GEMINI_COMPACT_TEXT=mode != 'raw',
+        GEMINI_MAX_PROMPT_TOKENS=args.max_prompt_tokens if mode == 'chunked' else 10 ** 9,
+        GEMINI_CHUNK_TOKENS=args.chunk_tokens,
+    )
+    model = FakeGeminiModel(request_latency=args.request_latency_ms / 1000, line_items=True)
+    largest = [0]
+    generate = model.generate_content
+
+    def generate_content(prompt, **kwargs):
+        largest[0] = max(largest[0], vision_service.estimate_tokens(prompt))
+        return generate(prompt, **kwargs)
+
+    model.generate_content = generate_content
+    vision_service.set_gemini_model(model)
+    started = time.perf_counter()
+    result = vision_service.extract_invoice_data_with_gemini(text)
+    return result, model, largest[0], time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, nargs='+', default=[2, 10, 100])
+    parser.add_argument('--items-per-page', type=int, default=30)
+    parser.add_argument('--max-prompt-tokens', type=int, default=12000)
+    parser.add_argument('--chunk-tokens', type=int, default=6000)
+    parser.add_argument('--context-limit-tokens', type=int, default=32000, help='Only flags prompts that would not fit')
+    parser.add_argument('--request-latency-ms', type=float, default=400)
+    args = parser.parse_args()
+
+    os.environ.setdefault('GEMINI_API_KEY', 'benchmark-fake-key')
+    app = Flask(__name__)
+    app.config['GEMINI_CHUNK_CONCURRENCY'] = 4
+    with app.app_context():
+        app.logger.disabled = True
+        for page_count in args.pages:
+            text, expected_items, expected_total = statement_text(page_count, args.items_per_page, seed=page_count)
+            print(f"{page_count} pages, {expected_items} line items, ~{vision_service.estimate_tokens(text)} OCR tokens")
+            for mode in ('raw', 'compacted', 'chunked'):
+                result, model, largest, elapsed = run(app, text, args, mode)
+                items_ok = len(result['line_items']) == expected_items
+                total_ok = result['total_amount'] == expected_total
+                over = "  OVER CONTEXT LIMIT" if largest > args.context_limit_tokens else ""
+                print(f"  {mode:<10} {model.requests:>2} request(s), ~{model.prompt_characters // 4:>6} prompt tokens "
+                      f"(largest ~{largest:>6}), {elapsed * 1000:7.0f} ms, line items {len(result['line_items'])}"
+                      f"{'' if items_ok else ' (WRONG)'}, total {'ok' if total_ok else 'WRONG'}"
+                      f", vendor {result['vendor_name']!r}{over}")
+        print(f"compaction: {vision_service.get_compaction_stats()}")
+
+
+if __name__ == '__main__':
+    main()
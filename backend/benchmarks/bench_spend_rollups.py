@@ -0,0 +1,199 @@
+"""
+Benchmark: spend dashboards from GROUP BY over invoices vs. services/spend_rollups.py.
+
+Seeds a SQLite stand-in (benchmarks/sqlite_standin.py) with a large synthetic set of
+processed invoices, then compares, per dimension (vendor, month, currency, user):
+
+    group by:  SELECT ... GROUP BY over every processed invoice (what a dashboard
+               load did before), O(number of invoices)
+    rollups:   spend_rollups.get_totals(), a range over the dimension's groups
+
+It also measures what keeping the rollups up to date costs per invoice change
+(processing, reprocessing, deleting, each in its own transaction, with and without
+rollup maintenance), the time of a full rebuild(), and checks that the incrementally
+maintained rollups equal a fresh GROUP BY afterwards.
+
+Usage (from the backend directory):
+    python benchmarks/bench_spend_rollups.py --invoices 500000 --changes 2000
+"""
+import argparse
+import datetime
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from sqlite_standin import SQLiteStandInConnection
+from services import spend_rollups
+
+# SQLite subset of schema.sql
+SCHEMA = """
+CREATE TABLE invoices (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INT,
+    status VARCHAR(50) DEFAULT 'uploaded',
+    vendor_name VARCHAR(255) NULL,
+    invoice_date DATE NULL,
+    total_amount DECIMAL(15, 2) NULL,
+    currency VARCHAR(10) NULL
+);
+CREATE INDEX idx_invoices_status ON invoices(status);
+CREATE TABLE invoice_spend_rollups (
+    dimension VARCHAR(16) NOT NULL,
+    dimension_key VARCHAR(255) NOT NULL,
+    currency VARCHAR(10) NOT NULL,
+    invoice_count INT NOT NULL DEFAULT 0,
+    total_amount DECIMAL(19, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (dimension, dimension_key, currency)
+);
+"""
+
+CURRENCIES = ['INR', 'INR', 'INR', 'USD', 'EUR', None]
+
+
+def random_invoice(rng, args):
+    vendor = f"Vendor {int(rng.paretovariate(1.2)) % args.vendors}" if rng.random() > 0.02 else None
+    invoice_date = datetime.date(2023, 1, 1) + datetime.timedelta(days=rng.randrange(args.months * 30))
+    return (rng.randrange(args.users) or None, vendor, invoice_date, Decimal(rng.randint(100, 5_000_000)) / 100,
+            rng.choice(CURRENCIES))
+
+
+def group_by_totals(conn, dimension):
+    key = spend_rollups._KEY_EXPRESSIONS[dimension]
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {key}, COALESCE(currency, ''), COUNT(*), SUM(total_amount) FROM invoices "
+                   f"WHERE status = 'processed' GROUP BY {key}, COALESCE(currency, '')")
+    rows = cursor.fetchall()
+    cursor.close()
+    return {(k, c): (n, round(float(t or 0), 2)) for k, c, n, t in rows}
+
+
+def rollup_totals(conn, dimension):
+    return {(g['key'] or '', g['currency'] or ''): (g['invoice_count'], round(float(g['total_amount']), 2))
+            for g in spend_rollups.get_totals(conn, dimension)}
+
+
+def timed(fn, repeat):
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations)
+
+
+def store(conn, invoice_id, values, maintain):
+    """The invoice UPDATE of invoice_processor._store_extraction, with or without rollup maintenance."""
+    cursor = conn.cursor()
+    old = spend_rollups.lock_contribution(cursor, invoice_id) if maintain else None
+    cursor.execute("UPDATE invoices SET user_id = %s, vendor_name = %s, invoice_date = %s, total_amount = %s, currency = %s, "
+                   "status = 'processed' WHERE id = %s", (*values, invoice_id))
+    if maintain:
+        spend_rollups.apply(cursor, old, spend_rollups.lock_contribution(cursor, invoice_id))
+    conn.commit()
+    cursor.close()
+
+
+def leave_processed(conn, invoice_id, delete, maintain):
+    """invoice_processor._set_status('processing') (reprocessing) or the DELETE route."""
+    cursor = conn.cursor()
+    old = spend_rollups.lock_contribution(cursor, invoice_id) if maintain else None
+    if delete:
+        cursor.execute("DELETE FROM invoices WHERE id = %s", (invoice_id,))
+    else:
+        cursor.execute("UPDATE invoices SET status = 'processing' WHERE id = %s", (invoice_id,))
+    if maintain:
+        spend_rollups.apply(cursor, old, None)
+    conn.commit()
+    cursor.close()
+
+
+def run_changes(conn, rng, args, maintain):
+    """Processes new invoices, reprocesses and deletes existing ones. Returns per-change latencies."""
+    latencies = []
+    max_id = conn.raw.execute("SELECT MAX(id) FROM invoices").fetchone()[0]
+    for _ in range(args.changes):
+        action = rng.random()
+        started = time.perf_counter()
+        if action < 0.6:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO invoices (status) VALUES ('processing')")
+            invoice_id = cursor.lastrowid
+            cursor.close()
+            conn.commit()
+            started = time.perf_counter()
+            store(conn, invoice_id, random_invoice(rng, args), maintain)
+        elif action < 0.9:
+            invoice_id = rng.randint(1, max_id)
+            leave_processed(conn, invoice_id, delete=False, maintain=maintain)
+            store(conn, invoice_id, random_invoice(rng, args), maintain)
+        else:
+            leave_processed(conn, rng.randint(1, max_id), delete=True, maintain=maintain)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def seed(args):
+    conn = SQLiteStandInConnection()
+    conn.raw.executescript(SCHEMA)
+    rng = random.Random(args.seed)
+    rows = ((*random_invoice(rng, args), 'processed') for _ in range(args.invoices))
+    conn.raw.executemany("INSERT INTO invoices (user_id, vendor_name, invoice_date, total_amount, currency, status) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", rows)
+    conn.raw.commit()
+    return conn
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--invoices', type=int, default=500_000)
+    parser.add_argument('--vendors', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--months', type=int, default=36)
+    parser.add_argument('--changes', type=int, default=2000, help='Invoice changes for the maintenance cost')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    sqlite3.register_adapter(Decimal, str)
+    app = Flask(__name__)
+    app.logger.setLevel(logging.ERROR)
+    with app.app_context():
+        started = time.perf_counter()
+        conn = seed(args)
+        print(f"seeded {args.invoices} invoices in {time.perf_counter() - started:.1f} s")
+
+        started = time.perf_counter()
+        rollup_rows = spend_rollups.rebuild(conn)
+        print(f"rebuild(): {rollup_rows} rollup rows in {time.perf_counter() - started:.2f} s")
+
+        for dimension in spend_rollups.DIMENSIONS:
+            scan = timed(lambda: group_by_totals(conn, dimension), args.repeat)
+            rollup = timed(lambda: spend_rollups.get_totals(conn, dimension), args.repeat)
+            groups = len(spend_rollups.get_totals(conn, dimension))
+            print(f"  by {dimension:<8} {groups:>6} groups: group by {scan * 1000:8.1f} ms, "
+                  f"rollups {rollup * 1000:6.2f} ms ({scan / rollup:,.0f}x)")
+
+        rng = random.Random(args.seed + 1)
+        plain = run_changes(conn, rng, args, maintain=False)
+        spend_rollups.rebuild(conn)
+        maintained = run_changes(conn, rng, args, maintain=True)
+        print(f"per invoice change ({args.changes} processed / reprocessed / deleted): "
+              f"{statistics.mean(plain) * 1e6:.0f} us without rollups, {statistics.mean(maintained) * 1e6:.0f} us with")
+
+        mismatches = [dimension for dimension in spend_rollups.DIMENSIONS
+                      if group_by_totals(conn, dimension) != rollup_totals(conn, dimension)]
+        print("incremental rollups match a fresh GROUP BY" if not mismatches
+              else f"MISMATCH after incremental updates in: {', '.join(mismatches)}")
+
+
+if __name__ == '__main__':
+    main()
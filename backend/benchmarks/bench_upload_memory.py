@@ -0,0 +1,160 @@
+"""
+Benchmark: memory use of concurrent large uploads.
+
+Compares the old ingest path (werkzeug spools the part to a temporary file, the
+route copies it into uploads/ with file.save(), then the whole file is read into
+memory to hash it and hand it to OCR) with the streaming path from
+services/upload_storage.py (part streamed into uploads/ and hashed while the body
+is parsed, atomic rename, lazy mmap for the OCR step).
+
+Each mode runs in its own server subprocess (werkzeug, threaded) so peak RSS is
+measured independently; the client streams the request bodies from disk.
+
+Usage (from the backend directory):
+    python benchmarks/bench_upload_memory.py --uploads 16 --size-mb 40
+"""
+import argparse
+import hashlib
+import http.client
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BOUNDARY = 'benchmark-boundary-7d9f3c'
+
+
+def current_rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def serve(mode, port, root):
+    from flask import Flask, jsonify, request
+    from werkzeug.serving import make_server
+
+    from services import upload_storage
+
+    app = Flask(__name__, root_path=root)
+    app.config['MAX_UPLOAD_BYTES'] = 0
+    if mode == 'streaming':
+        app.request_class = upload_storage.UploadRequest
+    baseline_rss_kb = current_rss_kb()
+    counter = iter(range(1_000_000))
+
+    @app.route('/upload', methods=['POST'])
+    def upload():
+        file = request.files['file']
+        file_path = os.path.join(root, 'uploads', f"{next(counter)}_{file.filename}")
+        if mode == 'legacy':
+            file.save(file_path)
+            with open(file_path, 'rb') as f_content:
+                image_content = f_content.read()
+            file_hash = hashlib.sha256(image_content).hexdigest()
+            header = image_content[:64 * 1024] # What an image decoder reads first
+        else:
+            stored = upload_storage.commit_upload(file, file_path)
+            file_hash = stored.sha256
+            with upload_storage.mapped_file(file_path) as image_content:
+                header = image_content[:64 * 1024]
+        return jsonify({'sha256': file_hash, 'header_bytes': len(header)})
+
+    @app.route('/stats')
+    def stats():
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return jsonify({'baseline_rss_kb': baseline_rss_kb, 'peak_rss_kb': peak_kb})
+
+    os.makedirs(os.path.join(root, 'uploads'), exist_ok=True)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    print('ready', flush=True)
+    server.serve_forever()
+
+
+def post_file(port, path):
+    preamble = (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="scan.png"\r\n'
+                f'Content-Type: image/png\r\n\r\n').encode()
+    epilogue = f'\r\n--{BOUNDARY}--\r\n'.encode()
+    size = os.path.getsize(path)
+
+    def body():
+        yield preamble
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(256 * 1024), b''):
+                yield chunk
+        yield epilogue
+
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+    conn.request('POST', '/upload', body=body(), headers={
+        'Content-Type': f'multipart/form-data; boundary={BOUNDARY}',
+        'Content-Length': str(len(preamble) + size + len(epilogue)),
+    })
+    response = conn.getresponse()
+    payload = json.loads(response.read())
+    conn.close()
+    return payload
+
+
+def get_stats(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    conn.request('GET', '/stats')
+    stats = json.loads(conn.getresponse().read())
+    conn.close()
+    return stats
+
+
+def run_mode(mode, port, source_path, uploads, concurrency):
+    with tempfile.TemporaryDirectory() as root:
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', mode, '--port', str(port), '--root', root],
+                                  stdout=subprocess.PIPE, text=True)
+        try:
+            server.stdout.readline() # 'ready'
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = list(executor.map(lambda _: post_file(port, source_path), range(uploads)))
+            elapsed = time.perf_counter() - started
+            stats = get_stats(port)
+        finally:
+            server.terminate()
+            server.wait()
+    assert len({result['sha256'] for result in results}) == 1
+    size_mb = os.path.getsize(source_path) / 1024 / 1024
+    print(f"{mode:>10}: {uploads} x {size_mb:.0f} MB ({concurrency} concurrent) in {elapsed:.2f} s, "
+          f"peak RSS {stats['peak_rss_kb'] / 1024:.0f} MB "
+          f"(+{(stats['peak_rss_kb'] - stats['baseline_rss_kb']) / 1024:.0f} MB over idle)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--uploads', type=int, default=16)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--size-mb', type=int, default=40)
+    parser.add_argument('--port', type=int, default=5071)
+    parser.add_argument('--serve', choices=['legacy', 'streaming'], help=argparse.SUPPRESS)
+    parser.add_argument('--root', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.root)
+        return
+
+    with tempfile.NamedTemporaryFile(suffix='.png') as source:
+        for _ in range(args.size_mb):
+            source.write(os.urandom(1024 * 1024))
+        source.flush()
+        for offset, mode in enumerate(('legacy', 'streaming')):
+            run_mode(mode, args.port + offset, source.name, args.uploads, args.concurrency)
+
+
+if __name__ == '__main__':
+    main()
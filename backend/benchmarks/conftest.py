@@ -0,0 +1,66 @@
+"""
+Fixtures for the tests kept next to the benchmarks. They use the same local fakes
+(fakes.py, fixtures.py) and the SQLite stand-in for MySQL (sqlite_standin.py), so
+they run without Google credentials or a database server.
+
+Run from the backend directory:
+    python -m pytest -q benchmarks
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+import db
+from sqlite_standin import SQLiteStandInPool
+from services import api_scheduler, job_queue, ocr_backends, vision_service
+
+# The fakes answer instantly; caches, pre-extraction and layouts would hide the calls under test
+TEST_CONFIG = {
+    'CACHE_ENABLED': False,
+    'PRE_EXTRACTION_ENABLED': False,
+    'LAYOUT_INDEX_ENABLED': False,
+    'IMAGE_PREPROCESS_ENABLED': False,
+    'RESPONSE_CACHE_ENABLED': False,
+    'GEMINI_REQUESTS_PER_MINUTE': 0,
+    'GEMINI_TOKENS_PER_MINUTE': 0,
+    'VISION_REQUESTS_PER_MINUTE': 0,
+    'API_MAX_ATTEMPTS': 1,
+}
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """A bare Flask app (no blueprints) with an application context pushed."""
+    monkeypatch.setenv('GEMINI_API_KEY', 'test-fake-key')
+    flask_app = Flask(__name__, root_path=str(tmp_path))
+    flask_app.config.update(TEST_CONFIG)
+    db.init_app(flask_app)
+    with flask_app.app_context():
+        yield flask_app
+    vision_service.set_vision_client(None)
+    vision_service.set_gemini_model(None)
+    ocr_backends.set_backend(None)
+    for api in ('gemini', 'vision'):
+        api_scheduler.set_scheduler(api, None)
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """schema.sql on the SQLite stand-in, installed as db's pool. Returns the pool."""
+    pool = SQLiteStandInPool(str(tmp_path / 'invoices.sqlite3'))
+    pool.create_schema()
+    monkeypatch.setattr(db, 'get_pool', lambda: pool)
+    return pool
+
+
+@pytest.fixture
+def enqueued(monkeypatch):
+    """Records job_queue.enqueue() calls as (job_type, payload) instead of running them."""
+    jobs = []
+    monkeypatch.setattr(job_queue, 'enqueue', lambda job_type, payload: jobs.append((job_type, payload)))
+    return jobs
@@ -0,0 +1,192 @@
+"""
+Local fakes of the external APIs, for benchmarks and tests that must not hit Google.
+
+FakeVisionClient mimics the parts of google.cloud.vision.ImageAnnotatorClient the app
+uses (text_detection and batch_annotate_images) with a configurable latency and
+failure rate. Install it with vision_service.set_vision_client(FakeVisionClient()).
+FakeGeminiModel does the same for the Gemini model (vision_service.set_gemini_model()).
+FakeQuotaAPI is a generic endpoint with request/token quotas that answers 429s the way
+Google's APIs do, for exercising services/api_scheduler.py.
+
+Request latencies are either a fixed number of seconds or a distribution from
+parse_latency() ('fixed:0.3', 'uniform:0.1,0.5', 'lognormal:0.3,0.5' = median, sigma),
+so benchmarks can reproduce the long tail of the real APIs.
+"""
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+
+def parse_latency(spec):
+    """A latency distribution from 'fixed:S', 'uniform:LOW,HIGH' or 'lognormal:MEDIAN,SIGMA' (seconds), or a plain number."""
+    kind, _, values = str(spec).partition(':')
+    if not values:
+        return float(kind)
+    params = [float(value) for value in values.split(',')]
+    if kind == 'fixed':
+        return params[0]
+    if kind == 'uniform':
+        low, high = params
+        return lambda rng: rng.uniform(low, high)
+    if kind == 'lognormal':
+        median, sigma = params
+        return lambda rng: median * math.exp(rng.gauss(0, sigma))
+    raise ValueError(f"Unknown latency distribution '{kind}' (expected fixed, uniform or lognormal)")
+
+
+def _sample(latency, rng, lock):
+    if not callable(latency):
+        return latency
+    with lock:
+        return latency(rng)
+
+
+def _text_response(text=None, error_message=''):
+    annotations = [SimpleNamespace(description=text)] if text else []
+    return SimpleNamespace(error=SimpleNamespace(message=error_message), text_annotations=annotations)
+
+
+def default_fake_text(image_content):
+    return f"FAKE OCR TEXT {hashlib.sha256(image_content).hexdigest()[:16]}\nTotal: 100.00"
+
+
+class FakeVisionClient:
+    def __init__(self, request_latency=0.05, per_image_latency=0.005, failure_rate=0.0,
+                 text_for=default_fake_text, seed=0):
+        self.request_latency = request_latency
+        self.per_image_latency = per_image_latency
+        self.failure_rate = failure_rate
+        self.text_for = text_for
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.images = 0
+
+    def _annotate(self, image_content):
+        with self._lock:
+            self.images += 1
+            failed = self._random.random() < self.failure_rate
+        if failed:
+            return _text_response(error_message='Simulated Vision failure')
+        return _text_response(self.text_for(image_content))
+
+    def text_detection(self, image, retry=None, timeout=None, **kwargs):
+        with self._lock:
+            self.requests += 1
+        time.sleep(_sample(self.request_latency, self._random, self._lock) + self.per_image_latency)
+        return self._annotate(image.content)
+
+    def batch_annotate_images(self, requests=None, retry=None, timeout=None, **kwargs):
+        with self._lock:
+            self.requests += 1
+        time.sleep(_sample(self.request_latency, self._random, self._lock) + self.per_image_latency * len(requests))
+        return SimpleNamespace(responses=[self._annotate(request.image.content) for request in requests])
+
+
+class FakeGeminiModel:
+    """
+    Mimics genai.GenerativeModel.generate_content() for the invoice prompts. Single-document
+    prompts get a JSON object back; multi-document prompts get a JSON array with one object
+    per BEGIN DOCUMENT marker. Latency grows with the prompt size, like the real API.
+    With line_items=True, "Service item" rows (fixtures.invoice_lines) are returned as line items.
+    """
+    _document_pattern = re.compile(r'---BEGIN DOCUMENT (\S+)---(.*?)---END DOCUMENT \1---', re.DOTALL)
+    _ocr_pattern = re.compile(r'---BEGIN OCR TEXT---(.*?)---END OCR TEXT---', re.DOTALL)
+    _line_item_pattern = re.compile(r'^\s*(Service item \d+)\s+(\d+)\s+(\d+\.\d{2})\s+(\d+\.\d{2})\s*$', re.MULTILINE)
+
+    def __init__(self, request_latency=0.5, seconds_per_1k_tokens=0.2, malformed_rate=0.0, failure_rate=0.0, seed=0,
+                 line_items=False):
+        self.request_latency = request_latency
+        self.line_items = line_items
+        self.seconds_per_1k_tokens = seconds_per_1k_tokens
+        self.malformed_rate = malformed_rate
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_characters = 0
+
+    def extract(self, ocr_text):
+        amount = r'Total:?\s*(?:INR|Rs\.?|₹|\$)?\s*([\d,]+\.\d{2})'
+        total = (re.search(r'Grand\s+' + amount, ocr_text, re.IGNORECASE)
+                 or re.search(amount, ocr_text, re.IGNORECASE))
+        number = re.search(r'Invoice\s*(?:No|Number|#)[:.\s]*([A-Z0-9/-]+)', ocr_text, re.IGNORECASE)
+        first_line = next((line.strip() for line in ocr_text.splitlines() if line.strip()), None)
+        return {
+            'vendor_name': first_line,
+            'invoice_number': number.group(1) if number else None,
+            'invoice_date': None,
+            'total_amount': float(total.group(1).replace(',', '')) if total else None,
+            'detected_currency': 'INR',
+            'line_items': [
+                {'description': description, 'quantity': int(quantity), 'unit_price': float(unit_price), 'item_total': float(item_total)}
+                for description, quantity, unit_price, item_total in self._line_item_pattern.findall(ocr_text)
+            ] if self.line_items else [],
+        }
+
+    def generate_content(self, prompt, generation_config=None, request_options=None, **kwargs):
+        with self._lock:
+            self.requests += 1
+            self.prompt_characters += len(prompt)
+            failed = self._random.random() < self.failure_rate
+            malformed = self._random.random() < self.malformed_rate
+        time.sleep(_sample(self.request_latency, self._random, self._lock)
+                   + len(prompt) / 4 / 1000 * self.seconds_per_1k_tokens)
+        if failed:
+            raise RuntimeError('429 Resource has been exhausted (simulated)')
+
+        documents = self._document_pattern.findall(prompt)
+        if documents:
+            payload = [{'document_id': document_id, **self.extract(text)} for document_id, text in documents]
+        else:
+            # Few-shot prompts carry an example's OCR text first; the document is the last block
+            blocks = self._ocr_pattern.findall(prompt)
+            payload = self.extract(blocks[-1] if blocks else '')
+        text = json.dumps(payload)
+        if malformed:
+            text = text[:len(text) // 2]
+        return SimpleNamespace(text=text)
+
+
+class ResourceExhausted(Exception):
+    """Stand-in for google.api_core.exceptions.ResourceExhausted (HTTP 429)."""
+    code = 429
+
+
+class FakeQuotaAPI:
+    """
+    An endpoint with a sliding-window quota on requests and tokens, like Gemini's per-minute
+    limits but with a configurable (short) window so benchmarks finish quickly. Calls over
+    quota raise ResourceExhausted; accepted calls take `latency` seconds.
+    """
+
+    def __init__(self, requests_per_window, tokens_per_window=0, window_seconds=1.0, latency=0.05):
+        self.requests_per_window = requests_per_window
+        self.tokens_per_window = tokens_per_window
+        self.window_seconds = window_seconds
+        self.latency = latency
+        self._recent = deque() # (accepted_at, tokens)
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+
+    def call(self, tokens=0):
+        with self._lock:
+            now = time.monotonic()
+            while self._recent and self._recent[0][0] <= now - self.window_seconds:
+                self._recent.popleft()
+            window_tokens = sum(t for _, t in self._recent)
+            if len(self._recent) >= self.requests_per_window or (
+                    self.tokens_per_window and window_tokens + tokens > self.tokens_per_window):
+                self.rejected += 1
+                raise ResourceExhausted('429 Quota exceeded (simulated)')
+            self._recent.append((now, tokens))
+            self.accepted += 1
+        time.sleep(self.latency)
+        return 'ok'
@@ -0,0 +1,266 @@
+"""
+Synthetic invoice fixtures for the offline benchmarks.
+
+make_text_pdf() writes a minimal but valid PDF (Helvetica text, no external
+dependencies) so benchmarks can generate documents of any page count. A page
+can also be a ScannedPage, which embeds an uncompressed grayscale image and no
+text layer, like a scanner would produce. make_png() writes such a page as a
+grayscale PNG, for image uploads.
+"""
+import random
+import struct
+import zlib
+from collections import namedtuple
+
+# An image-only page: `pixels` is width * height bytes of 8-bit grayscale
+ScannedPage = namedtuple('ScannedPage', ['width', 'height', 'pixels'])
+
+
+def scanned_page(width=200, height=280, seed=0):
+    rng = random.Random(seed)
+    return ScannedPage(width, height, bytes(rng.choice((0, 255, 255, 255)) for _ in range(width * height)))
+
+
+def noisy_page(width, height, seed=0, ink=0.1):
+    """A ScannedPage with roughly `ink` of its pixels black; fast enough for full-size scans."""
+    rng = random.Random(seed)
+    table = bytes(0 if value < 256 * ink else 255 for value in range(256))
+    return ScannedPage(width, height, rng.randbytes(width * height).translate(table))
+
+
+def make_png(path, page):
+    """Writes a ScannedPage as an 8-bit grayscale PNG."""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    rows = b"".join(b"\x00" + page.pixels[y * page.width:(y + 1) * page.width] for y in range(page.height))
+    with open(path, 'wb') as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', page.width, page.height, 8, 0, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(rows, 6)))
+        f.write(chunk(b'IEND', b''))
+    return path
+
+
+def _escape_pdf_text(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def make_text_pdf(path, pages):
+    """Writes a PDF with one page per entry of `pages` (a list of text lines, or a ScannedPage)."""
+    objects = []  # object bodies; object number = index + 1
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    font_id = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_id = add(None)  # filled in once the page ids are known
+    page_ids = []
+    for page in pages:
+        if isinstance(page, ScannedPage):
+            image_id = add(
+                b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceGray /BitsPerComponent 8 /Length %d >>\nstream\n"
+                % (page.width, page.height, len(page.pixels)) + page.pixels + b"\nendstream"
+            )
+            stream = b"q 595 0 0 842 0 0 cm /Im1 Do Q"
+            resources = b"<< /XObject << /Im1 %d 0 R >> >>" % image_id
+        else:
+            commands = ["BT", "/F1 10 Tf", "12 TL", "50 800 Td"]
+            for line in page:
+                commands.append(f"({_escape_pdf_text(line)}) Tj T*")
+            commands.append("ET")
+            stream = "\n".join(commands).encode('latin-1', 'replace')
+            resources = b"<< /Font << /F1 %d 0 R >> >>" % font_id
+        content_id = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] /Resources %s /Contents %d 0 R >>"
+            % (pages_id, resources, content_id)
+        ))
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+    catalog_id = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog_id, xref_offset)
+    with open(path, 'wb') as f:
+        f.write(output)
+    return path
+
+
+def invoice_lines(invoice_number, line_items, seed=0, vendor="Acme Utilities Pvt Ltd"):
+    """Text lines of a synthetic invoice: header, `line_items` item rows and a totals section."""
+    rng = random.Random(seed)
+    lines = [
+        vendor,
+        "221B Industrial Estate, Pune 411001",
+        "GSTIN: 27ABCDE1234F1Z5",
+        f"Invoice No: {invoice_number}",
+        f"Invoice Date: 2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "",
+        "Description                      Qty     Rate      Amount",
+    ]
+    total = 0.0
+    for idx in range(line_items):
+        quantity = rng.randint(1, 9)
+        rate = round(rng.uniform(5, 500), 2)
+        amount = round(quantity * rate, 2)
+        total += amount
+        lines.append(f"Service item {idx + 1:<22} {quantity:>3} {rate:>9.2f} {amount:>11.2f}")
+    lines += [
+        "",
+        f"Subtotal: {total:.2f}",
+        f"GST 18%: {total * 0.18:.2f}",
+        f"Grand Total: INR {total * 1.18:.2f}",
+    ]
+    return lines
+
+
+def statement_pages(page_count, lines_per_page=60, seed=0):
+    """Pages of a long vendor statement, with the totals section on the last page."""
+    lines = invoice_lines("STMT-0001", line_items=page_count * lines_per_page - 12, seed=seed)
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)]
+    return pages[:page_count - 1] + [sum(pages[page_count - 1:], [])]
+
+
+# Vendor templates for the fixed-layout vendors in receipt_corpus(), in the
+# VENDOR_TEMPLATES_PATH JSON format (see vendor_templates.example.json)
+FIXTURE_VENDOR_TEMPLATES = [
+    {
+        "vendor_name": "Acme Utilities Pvt Ltd",
+        "tax_ids": ["27ABCDE1234F1Z5"],
+        "currency": "INR",
+        "fields": {
+            "invoice_number": r"^Invoice No:\s*(\S+)",
+            "invoice_date": r"^Invoice Date:\s*(\d{4}-\d{2}-\d{2})",
+            "total_amount": r"^Grand Total:\s*INR\s*([\d,]+\.\d{2})(?![\d.,])"
+        },
+        "line_item": r"^(?P<description>Service item \d+)\s+(?P<quantity>\d+)\s+(?P<unit_price>\d+\.\d{2})\s+(?P<item_total>\d+\.\d{2})$"
+    },
+    {
+        "vendor_name": "CityMart Supermarket",
+        "fingerprints": ["CITYMART SUPERMARKET"],
+        "tax_ids": ["29AAACC1234K1Z2"],
+        "currency": "INR",
+        "date_formats": ["%d/%m/%Y"],
+        "fields": {
+            "invoice_number": r"Bill No\.\s*(\S+)",
+            "invoice_date": r"Bill No\.\s*\S+\s+Date\s+(\d{2}/\d{2}/\d{4})",
+            "total_amount": r"^NET AMOUNT\s+Rs\.\s*([\d,]+\.\d{2})(?![\d.,])"
+        },
+        "line_item": r"^(?P<description>[A-Za-z][A-Za-z0-9 .]*?)\s+(?P<quantity>\d+)\s+(?P<unit_price>\d+\.\d{2})\s+(?P<item_total>[\d,]+\.\d{2})$"
+    },
+    {
+        "vendor_name": "QuickCab Mobility",
+        "fingerprints": ["QuickCab", "QuickCab Mobility"],
+        "currency": "INR",
+        "fields": {
+            "invoice_number": r"^Receipt #\s*(\S+)",
+            "invoice_date": r"^(\d{1,2} [A-Z][a-z]{2} \d{4}),",
+            "total_amount": r"^Total paid\s*₹\s*([\d,]+\.\d{2})(?![\d.,])"
+        }
+    }
+]
+
+_MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+def _money(value):
+    return f"{value:,.2f}"
+
+
+def _acme_receipt(rng, i):
+    lines = invoice_lines(f"ACME-{i:05d}", rng.randint(1, 6), seed=i)
+    rows = [line.rsplit(None, 3) for line in lines if line.startswith("Service item")]
+    truth = {
+        'vendor_name': "Acme Utilities Pvt Ltd",
+        'invoice_number': f"ACME-{i:05d}",
+        'invoice_date': lines[4].split(': ')[1],
+        'total_amount': float(lines[-1].split('INR ')[1]),
+        'detected_currency': 'INR',
+        'line_items': [{'description': description, 'quantity': float(quantity), 'unit_price': float(rate), 'item_total': float(amount)}
+                       for description, quantity, rate, amount in rows],
+    }
+    return "\n".join(lines), truth
+
+
+def _citymart_receipt(rng, i):
+    year, month, day = 2024, rng.randint(1, 12), rng.randint(1, 28)
+    items, line_items, total = [], [], 0.0
+    for _ in range(rng.randint(2, 12)):
+        quantity, rate = rng.randint(1, 4), round(rng.uniform(10, 400), 2)
+        total += quantity * rate
+        description = rng.choice(['Milk 1L', 'Bread', 'Rice 5kg', 'Dal 1kg', 'Soap', 'Tea 250g'])
+        items.append(f"{description:<18}{quantity:>3} {rate:>7.2f} {quantity * rate:>8.2f}")
+        line_items.append({'description': description, 'quantity': float(quantity), 'unit_price': rate,
+                           'item_total': round(quantity * rate, 2)})
+    lines = ["CITYMART SUPERMARKET", "Store #042  MG Road, Bengaluru", "GSTIN 29AAACC1234K1Z2",
+             f"Bill No. CM/042/{i:05d}     Date {day:02d}/{month:02d}/{year} 18:{rng.randint(10, 59)}",
+             "ITEM              QTY   RATE   AMT", *items, f"TOTAL ITEMS: {len(items)}",
+             f"NET AMOUNT  Rs. {_money(total)}", "Thank you! Visit again"]
+    truth = {'vendor_name': "CityMart Supermarket", 'invoice_number': f"CM/042/{i:05d}",
+             'invoice_date': f"{year}-{month:02d}-{day:02d}", 'total_amount': round(total, 2), 'detected_currency': 'INR',
+             'line_items': line_items}
+    return "\n".join(lines), truth
+
+
+def _quickcab_receipt(rng, i):
+    day, month = rng.randint(1, 28), rng.randint(1, 12)
+    fare, distance = round(rng.uniform(50, 200), 2), round(rng.uniform(50, 900), 2)
+    taxes = round((fare + distance) * 0.05, 2)
+    total = round(fare + distance + taxes, 2)
+    lines = ["QuickCab", "Trip receipt", f"Receipt #QC-{80000 + i}", f"{day} {_MONTHS[month - 1]} 2024, 9:41 PM",
+             f"Base fare  ₹{fare:.2f}", f"Distance   ₹{distance:.2f}", f"Taxes      ₹{taxes:.2f}", f"Total paid ₹{_money(total)}"]
+    truth = {'vendor_name': "QuickCab Mobility", 'invoice_number': f"QC-{80000 + i}",
+             'invoice_date': f"2024-{month:02d}-{day:02d}", 'total_amount': total, 'detected_currency': 'INR', 'line_items': []}
+    return "\n".join(lines), truth
+
+
+def _unknown_vendor_receipt(rng, i):
+    day, month = rng.randint(1, 28), rng.randint(1, 12)
+    total = round(rng.uniform(100, 5000), 2)
+    vendor = rng.choice(["Sharma Hardware Stores", "Cafe Brew House", "Lakeview Dental Clinic"])
+    lines = ["TAX INVOICE", vendor, "Near Bus Stand, Nashik", f"Invoice Number: SH-{i}", f"Date: {day:02d}-{month:02d}-2024",
+             "Description        Amount", f"Goods/services     {total / 1.18:.2f}", f"CGST+SGST          {total - total / 1.18:.2f}",
+             f"Amount Payable: ₹ {_money(total)}"]
+    truth = {'vendor_name': vendor, 'invoice_number': f"SH-{i}", 'invoice_date': f"2024-{month:02d}-{day:02d}",
+             'total_amount': total, 'detected_currency': 'INR',
+             'line_items': [{'description': "Goods/services", 'quantity': None, 'unit_price': None, 'item_total': round(total / 1.18, 2)}]}
+    return "\n".join(lines), truth
+
+
+def receipt_corpus(count, seed=0, unknown_share=0.3):
+    """
+    (ocr_text, expected core fields and line items) pairs: receipts from the three vendors covered by
+    FIXTURE_VENDOR_TEMPLATES, plus `unknown_share` of receipts from vendors without a template.
+    """
+    rng = random.Random(seed)
+    known = [_acme_receipt, _citymart_receipt, _quickcab_receipt]
+    corpus = []
+    for i in range(count):
+        make = _unknown_vendor_receipt if rng.random() < unknown_share else rng.choice(known)
+        corpus.append(make(rng, i))
+    return corpus
+
+
+_OCR_CONFUSIONS = {'0': 'O', 'O': '0', '1': 'l', 'l': '1', '5': 'S', 'S': '5', '8': 'B', ':': ';', '.': ',', ',': '.'}
+
+
+def ocr_noise(text, rate, seed=0):
+    """Applies typical OCR character confusions (0/O, 1/l, ./, ...) to about `rate` of the lines."""
+    rng = random.Random(seed)
+    lines = text.split("\n")
+    for i, line in enumerate(lines):
+        candidates = [j for j, char in enumerate(line) if char in _OCR_CONFUSIONS]
+        if candidates and rng.random() < rate:
+            j = rng.choice(candidates)
+            lines[i] = line[:j] + _OCR_CONFUSIONS[line[j]] + line[j + 1:]
+    return "\n".join(lines)
@@ -0,0 +1,188 @@
+"""
+A SQLite stand-in for the MySQL connection used by the app, for offline benchmarks.
+
+Translates the mysql-connector '%s' paramstyle to SQLite's '?' (and the few MySQL-only
+constructs the app uses, see translate()), counts every execute() as one server round
+trip and can add a simulated network latency to each of them so that round-trip
+savings show up in wall-clock numbers. Time spent in the database is summed up in
+`db_seconds`.
+
+For benchmarks that run the whole app, sqlite_schema() translates schema.sql and
+SQLiteStandInPool hands out one connection per thread to a shared database file, in
+place of db.ConnectionPool.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from decimal import Decimal
+
+
+def translate(sql):
+    """The few MySQL constructs the app uses that SQLite spells differently."""
+    sql = sql.replace('%s', '?').replace(' FOR UPDATE', '')
+    sql = re.sub(r"DATE_FORMAT\((\w+), '([^']*)'\)", r"strftime('\2', \1)", sql)
+    sql = sql.replace('JSON_OBJECTAGG(', 'json_group_object(')
+    if 'ON DUPLICATE KEY UPDATE' in sql:
+        sql = sql.replace('ON DUPLICATE KEY UPDATE', 'ON CONFLICT DO UPDATE SET')
+        sql = re.sub(r'VALUES\((\w+)\)', r'excluded.\1', sql)
+    return sql
+
+
+class CountingCursor:
+    def __init__(self, connection, dictionary=False):
+        self._connection = connection
+        self._cursor = connection.raw.cursor()
+        self._dictionary = dictionary
+
+    def _round_trip(self):
+        self._connection.round_trips += 1
+        if self._connection.latency_seconds:
+            time.sleep(self._connection.latency_seconds)
+
+    def execute(self, sql, params=()):
+        started = time.perf_counter()
+        self._round_trip()
+        if sql.startswith('SET SESSION'):
+            return # MySQL session variables (e.g. net_write_timeout) have no SQLite equivalent
+        try:
+            self._cursor.execute(translate(sql), tuple(params or ()))
+        finally:
+            self._connection.db_seconds += time.perf_counter() - started
+
+    def executemany(self, sql, seq_of_params):
+        # mysql-connector rewrites INSERT executemany() into a single multi-row statement
+        started = time.perf_counter()
+        self._round_trip()
+        try:
+            self._cursor.executemany(translate(sql), [tuple(p) for p in seq_of_params])
+        finally:
+            self._connection.db_seconds += time.perf_counter() - started
+
+    def _convert(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return dict(zip([d[0] for d in self._cursor.description], row))
+
+    def fetchone(self):
+        return self._convert(self._cursor.fetchone())
+
+    def fetchall(self):
+        return [self._convert(row) for row in self._cursor.fetchall()]
+
+    def fetchmany(self, size):
+        return [self._convert(row) for row in self._cursor.fetchmany(size)]
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteStandInConnection:
+    def __init__(self, path=':memory:', latency_seconds=0.0, timeout=5.0):
+        # PARSE_DECLTYPES returns TIMESTAMP/DATE columns as datetime/date objects, like mysql-connector
+        self.raw = sqlite3.connect(path, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES, timeout=timeout)
+        self.latency_seconds = latency_seconds
+        self.round_trips = 0
+        self.db_seconds = 0.0
+
+    def cursor(self, dictionary=False, **kwargs):
+        return CountingCursor(self, dictionary=dictionary)
+
+    def commit(self):
+        started = time.perf_counter()
+        self.round_trips += 1
+        if self.raw.in_transaction:
+            self.raw.commit()
+        self.db_seconds += time.perf_counter() - started
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        self.raw.close()
+
+
+INVOICE_FIELDS_DDL = """
+CREATE TABLE IF NOT EXISTS invoice_fields (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    invoice_id INTEGER NOT NULL,
+    field_name VARCHAR(255) NOT NULL,
+    field_value TEXT NULL,
+    confidence FLOAT NULL,
+    coordinates VARCHAR(255) NULL
+)
+"""
+
+
+def sqlite_schema(schema_sql):
+    """schema.sql translated for SQLite: auto-increment keys, no ON UPDATE / inline or FULLTEXT indexes."""
+    schema_sql = re.sub(r'--[^\n]*', '', schema_sql)
+    statements = []
+    for statement in schema_sql.split(';'):
+        statement = statement.strip()
+        if not statement or 'FULLTEXT' in statement:
+            continue
+        statement = re.sub(r'\b(?:BIG)?INT AUTO_INCREMENT PRIMARY KEY', 'INTEGER PRIMARY KEY AUTOINCREMENT', statement)
+        statement = re.sub(r'\s*ON UPDATE CURRENT_TIMESTAMP(\(\d\))?', '', statement)
+        statement = re.sub(r'(TIMESTAMP|CURRENT_TIMESTAMP)\(\d\)', r'\1', statement)
+        statement = re.sub(r',\s*INDEX \w+ \([^)]*\)', '', statement)
+        statements.append(statement)
+    return ";\n".join(statements) + ";"
+
+
+class SQLiteStandInPool:
+    """
+    Stands in for db.ConnectionPool: one connection per thread to a shared SQLite file (WAL mode,
+    so readers don't block the writer). Like the real pool, release() rolls back what wasn't committed.
+    """
+
+    def __init__(self, path, latency_seconds=0.0, timeout=30.0):
+        self.path = path
+        self.latency_seconds = latency_seconds
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        sqlite3.register_adapter(Decimal, str) # mysql-connector accepts Decimal parameters
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.close()
+
+    def create_schema(self, schema_path=None):
+        schema_path = schema_path or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'schema.sql')
+        with open(schema_path) as f:
+            schema = sqlite_schema(f.read())
+        conn = sqlite3.connect(self.path)
+        conn.executescript(schema)
+        conn.close()
+
+    def acquire(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = SQLiteStandInConnection(self.path, latency_seconds=self.latency_seconds, timeout=self.timeout)
+            conn.raw.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def release(self, conn):
+        conn.rollback()
+
+    def discard(self, conn):
+        conn.rollback() # Connections are per thread and stay open
+
+    def stats(self):
+        with self._lock:
+            return {'connections': len(self._connections),
+                    'round_trips': sum(conn.round_trips for conn in self._connections),
+                    'db_seconds': sum(conn.db_seconds for conn in self._connections)}
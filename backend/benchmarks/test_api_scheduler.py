@@ -0,0 +1,253 @@
+"""
+services/api_scheduler.py: token buckets, retries with exponential backoff and full jitter,
+the shared pause after a 429, priority lanes and the in-flight cap. Time is simulated
+(clock / sleep arguments) except in the FakeQuotaAPI test at the end.
+"""
+import threading
+import time
+
+import pytest
+
+from fakes import FakeQuotaAPI, ResourceExhausted
+from services import api_scheduler
+from services.api_scheduler import APIScheduler, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class ServiceUnavailable(Exception):
+    code = 503
+
+
+class Failing:
+    """Raises each of `errors` in turn, then returns 'ok'."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+def make_scheduler(clock, **options):
+    return APIScheduler('test', clock=clock, sleep=clock.sleep, **options)
+
+
+def test_token_bucket_starts_full_and_refills_at_its_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(per_minute=60, capacity=10, clock=clock)
+    assert bucket.wait_time(10) == 0
+    bucket.take(10)
+    assert bucket.wait_time(1) == pytest.approx(1.0) # 1 unit per second
+    clock.now += 4
+    assert bucket.wait_time(4) == 0
+    assert bucket.wait_time(5) == pytest.approx(1.0)
+    clock.now += 3600
+    assert bucket.level <= bucket.capacity and bucket.wait_time(10) == 0
+
+
+def test_token_bucket_admits_an_oversized_take_when_full_and_goes_into_debt():
+    clock = FakeClock()
+    bucket = TokenBucket(per_minute=60, capacity=10, clock=clock)
+    assert bucket.wait_time(25) == 0 # Capped at the capacity, or it could never be admitted
+    bucket.take(25)
+    assert bucket.level == pytest.approx(-15)
+    assert bucket.wait_time(1) == pytest.approx(16.0)
+
+
+def test_requests_per_minute_spaces_out_calls(app):
+    clock = FakeClock()
+    # 120/minute with a 1 second burst: 2 calls at once, then one every 0.5 s
+    scheduler = make_scheduler(clock, requests_per_minute=120, burst_seconds=1)
+    assert scheduler._admission_wait(1, 0) == 0
+    scheduler.call(lambda: None)
+    scheduler.call(lambda: None)
+    assert scheduler._admission_wait(1, 0) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert scheduler._admission_wait(1, 0) == 0
+
+
+def test_tokens_per_minute_counts_the_tokens_of_each_call(app):
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, tokens_per_minute=6000, burst_seconds=1) # 100 tokens per second
+    scheduler.call(lambda: None, tokens=100)
+    assert scheduler._admission_wait(1, 50) == pytest.approx(0.5)
+    assert scheduler._admission_wait(1, 0) == 0 # Calls without a token estimate aren't held back
+
+
+def test_retryable_errors_are_retried_with_capped_exponential_backoff(app, monkeypatch):
+    monkeypatch.setattr(api_scheduler.random, 'uniform', lambda low, high: high) # Top of each jitter range
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, max_attempts=5, backoff_base_seconds=1.0, backoff_max_seconds=5.0)
+    fn = Failing(*[ServiceUnavailable('503')] * 4)
+
+    assert scheduler.call(fn) == 'ok'
+
+    assert fn.calls == 5
+    assert clock.sleeps == [1.0, 2.0, 4.0, 5.0]
+    stats = scheduler.stats()
+    assert (stats['calls'], stats['retries'], stats['failures']) == (5, 4, 0)
+
+
+def test_backoff_is_fully_jittered(app):
+    scheduler = APIScheduler('test', backoff_base_seconds=1.0, backoff_max_seconds=30.0)
+    delays = [scheduler._backoff(4) for _ in range(200)]
+    assert all(0 <= delay <= 8.0 for delay in delays)
+    assert min(delays) < 2.0 and max(delays) > 6.0
+
+
+def test_gives_up_after_max_attempts(app):
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, max_attempts=3)
+    fn = Failing(*[ServiceUnavailable('503')] * 10)
+
+    with pytest.raises(ServiceUnavailable):
+        scheduler.call(fn)
+
+    assert fn.calls == 3
+    assert scheduler.stats()['failures'] == 1
+
+
+def test_non_retryable_errors_are_raised_at_once(app):
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, max_attempts=5)
+    fn = Failing(ValueError('bad request'))
+
+    with pytest.raises(ValueError):
+        scheduler.call(fn)
+
+    assert fn.calls == 1 and clock.sleeps == []
+
+
+def test_retry_deadline_stops_retries(app, monkeypatch):
+    monkeypatch.setattr(api_scheduler.random, 'uniform', lambda low, high: high)
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, max_attempts=10, backoff_base_seconds=1.0, retry_deadline_seconds=5)
+    fn = Failing(*[ServiceUnavailable('503')] * 10)
+
+    with pytest.raises(ServiceUnavailable):
+        scheduler.call(fn)
+
+    assert clock.sleeps == [1.0, 2.0] # The next 4 s backoff would end past the deadline
+
+
+def test_a_429_pauses_every_caller(app, monkeypatch):
+    monkeypatch.setattr(api_scheduler.random, 'uniform', lambda low, high: high)
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, backoff_base_seconds=2.0)
+
+    assert scheduler.call(Failing(ResourceExhausted('429'))) == 'ok'
+
+    assert scheduler.stats()['rate_limited'] == 1
+    assert scheduler._paused_until == pytest.approx(clock.now) # Paused for the backoff the caller slept
+    clock.now -= 1
+    assert scheduler._admission_wait(1, 0) == pytest.approx(1.0)
+
+
+def test_error_classification():
+    assert api_scheduler.is_rate_limited(ResourceExhausted('429'))
+    assert api_scheduler.is_retryable(ResourceExhausted('429'))
+    assert api_scheduler.is_retryable(ServiceUnavailable('503'))
+    assert not api_scheduler.is_retryable(ValueError('400'))
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def test_interactive_calls_are_admitted_before_waiting_bulk_calls(app):
+    scheduler = APIScheduler('test', max_in_flight=1)
+    release = threading.Event()
+    order = []
+
+    def call(lane_name, label, fn=None):
+        with app.app_context(), api_scheduler.lane(lane_name):
+            scheduler.call(fn or (lambda: order.append(label)))
+
+    blocker = threading.Thread(target=call, args=(api_scheduler.BULK, 'blocker', release.wait))
+    blocker.start()
+    wait_until(lambda: scheduler.stats()['in_flight'] == 1)
+    threads = []
+    for lane_name, label in [(api_scheduler.BULK, 'bulk 1'), (api_scheduler.BULK, 'bulk 2'), (api_scheduler.INTERACTIVE, 'interactive')]:
+        threads.append(threading.Thread(target=call, args=(lane_name, label)))
+        threads[-1].start()
+        wait_until(lambda count=len(threads): scheduler.stats()['queued'] == count)
+    release.set()
+    for thread in [blocker] + threads:
+        thread.join(5)
+
+    assert order == ['interactive', 'bulk 1', 'bulk 2']
+    assert scheduler.stats()['admitted'] == {api_scheduler.INTERACTIVE: 1, api_scheduler.BULK: 3}
+
+
+def test_unknown_lane_is_rejected():
+    with pytest.raises(ValueError):
+        with api_scheduler.lane('urgent'):
+            pass
+
+
+def test_calls_in_flight_never_exceed_the_cap(app):
+    scheduler = APIScheduler('test', max_in_flight=3)
+    lock = threading.Lock()
+    active, peak = [0], [0]
+
+    def fn():
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.005)
+        with lock:
+            active[0] -= 1
+
+    def worker():
+        with app.app_context():
+            for _ in range(5):
+                scheduler.call(fn)
+
+    threads = [threading.Thread(target=worker) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert peak[0] == 3
+    assert scheduler.stats()['calls'] == 50
+
+
+def test_every_call_gets_through_a_quota_limited_api(app):
+    api = FakeQuotaAPI(requests_per_window=5, window_seconds=0.2, latency=0)
+    scheduler = APIScheduler('test', max_in_flight=4, max_attempts=50, backoff_base_seconds=0.01, backoff_max_seconds=0.1)
+    results = []
+
+    def worker():
+        with app.app_context():
+            for _ in range(5):
+                results.append(scheduler.call(api.call))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert results == ['ok'] * 20
+    assert api.accepted == 20
+    assert scheduler.stats()['rate_limited'] == api.rejected > 0
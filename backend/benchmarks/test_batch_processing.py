@@ -0,0 +1,211 @@
+"""
+Batch uploads (services/invoice_processor.process_batch / extract_batch): images are split into
+Vision batch_annotate_images groups and multi-document Gemini prompts, and the results are
+merged back to the right invoices. Runs against FakeVisionClient / FakeGeminiModel.
+"""
+import json
+
+import pytest
+
+import db
+from fakes import FakeGeminiModel, FakeVisionClient, default_fake_text
+from fixtures import invoice_lines, make_png, make_text_pdf, scanned_page
+from services import api_scheduler, invoice_processor, vision_service
+
+
+def add_batch(pool, paths):
+    """Inserts a batch with one 'uploaded' invoice per file. Returns (batch_id, [invoice_id, ...])."""
+    conn = pool.acquire().raw
+    batch_id = conn.execute("INSERT INTO invoice_batches (total_items) VALUES (?)", (len(paths),)).lastrowid
+    invoice_ids = [conn.execute("INSERT INTO invoices (batch_id, file_name, original_file_path, status) VALUES (?, ?, ?, 'uploaded')",
+                                (batch_id, path.name, str(path))).lastrowid
+                   for path in paths]
+    conn.commit()
+    return batch_id, invoice_ids
+
+
+def make_images(tmp_path, count):
+    return [make_png(tmp_path / f"receipt_{i}.png", scanned_page(40, 40, seed=i)) for i in range(count)]
+
+
+def statuses(pool):
+    return dict(pool.acquire().raw.execute("SELECT id, status FROM invoices").fetchall())
+
+
+def events(pool, status):
+    return [row[0] for row in pool.acquire().raw.execute(
+        "SELECT invoice_id FROM invoice_events WHERE status = ? ORDER BY invoice_id", (status,))]
+
+
+def test_process_batch_groups_images_and_fans_out_in_order(app, database, enqueued, tmp_path):
+    app.config.update(VISION_BATCH_SIZE=8, GEMINI_BATCH_MAX_DOCS=8)
+    client = FakeVisionClient(request_latency=0, per_image_latency=0)
+    vision_service.set_vision_client(client)
+    images = make_images(tmp_path, 20)
+    batch_id, invoice_ids = add_batch(database, images)
+
+    invoice_processor.process_batch(batch_id)
+
+    assert client.requests == 3 # 8 + 8 + 4 images
+    assert client.images == 20
+    assert [job_type for job_type, _ in enqueued] == ['extract_batch'] * 3
+    items = [item for _, payload in enqueued for item in payload['items']]
+    assert [item['invoice_id'] for item in items] == invoice_ids
+    for item, path in zip(items, images):
+        assert item['ocr_text'] == default_fake_text(path.read_bytes())
+    assert set(statuses(database).values()) == {'processing'}
+    assert events(database, 'processing') == invoice_ids
+
+
+def test_process_batch_caps_groups_at_the_vision_limit(app, database, enqueued, tmp_path):
+    app.config.update(VISION_BATCH_SIZE=100)
+    client = FakeVisionClient(request_latency=0, per_image_latency=0)
+    vision_service.set_vision_client(client)
+    batch_id, _ = add_batch(database, make_images(tmp_path, 17))
+
+    invoice_processor.process_batch(batch_id)
+
+    assert client.requests == 2 # 16 + 1
+
+
+def test_process_batch_queues_pdfs_on_their_own(app, database, enqueued, tmp_path):
+    vision_service.set_vision_client(FakeVisionClient(request_latency=0, per_image_latency=0))
+    pdf = make_text_pdf(tmp_path / "statement.pdf", [invoice_lines("INV-PDF", 3)])
+    batch_id, (pdf_id, image_id) = add_batch(database, [pdf, *make_images(tmp_path, 1)])
+
+    invoice_processor.process_batch(batch_id)
+
+    assert enqueued[0] == ('process_invoice', {'invoice_id': pdf_id, 'file_path': str(pdf), 'mime_type': 'application/pdf',
+                                               'lane': api_scheduler.BULK})
+    assert [item['invoice_id'] for item in enqueued[1][1]['items']] == [image_id]
+    assert statuses(database) == {pdf_id: 'uploaded', image_id: 'processing'}
+
+
+def test_process_batch_without_gemini_batching_queues_each_invoice(app, database, enqueued, tmp_path):
+    app.config.update(GEMINI_BATCH_ENABLED=False)
+    vision_service.set_vision_client(FakeVisionClient(request_latency=0, per_image_latency=0))
+    images = make_images(tmp_path, 3)
+    batch_id, invoice_ids = add_batch(database, images)
+
+    invoice_processor.process_batch(batch_id)
+
+    assert [(job_type, payload['invoice_id'], payload['ocr_text']) for job_type, payload in enqueued] == [
+        ('process_invoice', invoice_id, default_fake_text(path.read_bytes())) for invoice_id, path in zip(invoice_ids, images)]
+
+
+def test_failed_images_continue_with_empty_text(app, database, enqueued, tmp_path):
+    vision_service.set_vision_client(FakeVisionClient(request_latency=0, per_image_latency=0, failure_rate=1.0))
+    batch_id, invoice_ids = add_batch(database, make_images(tmp_path, 3))
+
+    invoice_processor.process_batch(batch_id)
+
+    assert enqueued[0][1]['items'] == [{'invoice_id': invoice_id, 'ocr_text': ""} for invoice_id in invoice_ids]
+
+
+def test_process_batch_failure_sets_images_not_handed_on_to_error(app, database, monkeypatch, tmp_path):
+    app.config.update(GEMINI_BATCH_MAX_DOCS=4)
+    vision_service.set_vision_client(FakeVisionClient(request_latency=0, per_image_latency=0))
+    batch_id, invoice_ids = add_batch(database, make_images(tmp_path, 10))
+    queued = []
+
+    def enqueue(job_type, payload):
+        if queued:
+            raise RuntimeError("queue unavailable")
+        queued.append(payload)
+    monkeypatch.setattr(invoice_processor.job_queue, 'enqueue', enqueue)
+
+    with pytest.raises(RuntimeError):
+        invoice_processor.process_batch(batch_id)
+
+    # The first extract_batch job owns its 4 invoices; the other 6 would stay 'processing' forever
+    assert [item['invoice_id'] for item in queued[0]['items']] == invoice_ids[:4]
+    assert statuses(database) == {**{i: 'processing' for i in invoice_ids[:4]}, **{i: 'error' for i in invoice_ids[4:]}}
+    assert events(database, 'error') == invoice_ids[4:]
+
+
+def test_batch_error_events_only_cover_invoices_that_moved(app, database, tmp_path):
+    _, invoice_ids = add_batch(database, make_images(tmp_path, 3))
+    conn = database.acquire().raw
+    conn.execute("UPDATE invoices SET status = 'processing'")
+    conn.execute("UPDATE invoices SET status = 'processed' WHERE id = ?", (invoice_ids[0],))
+    conn.commit()
+
+    invoice_processor._set_batch_images_error(db.get_db(), invoice_ids)
+
+    assert statuses(database) == {invoice_ids[0]: 'processed', invoice_ids[1]: 'error', invoice_ids[2]: 'error'}
+    assert events(database, 'error') == invoice_ids[1:]
+
+
+class DroppingGeminiModel(FakeGeminiModel):
+    """Leaves the last document out of every multi-document response."""
+
+    def generate_content(self, prompt, **kwargs):
+        response = super().generate_content(prompt, **kwargs)
+        payload = json.loads(response.text)
+        if isinstance(payload, list):
+            response.text = json.dumps(payload[:-1])
+        return response
+
+
+def documents(count):
+    return [(str(i), "\n".join(invoice_lines(f"INV-{i:04d}", 3, seed=i))) for i in range(count)]
+
+
+def test_extract_invoice_data_batch_packs_documents_and_maps_results_back(app):
+    app.config.update(GEMINI_BATCH_MAX_DOCS=3, GEMINI_BATCH_TOKEN_BUDGET=100000)
+    model = FakeGeminiModel(request_latency=0, seconds_per_1k_tokens=0)
+    vision_service.set_gemini_model(model)
+
+    results, stats = vision_service.extract_invoice_data_batch(documents(7))
+
+    assert model.requests == 3 # 3 + 3 documents in packs; the last one alone
+    assert {document_id: data['invoice_number'] for document_id, data in results.items()} == {
+        str(i): f"INV-{i:04d}" for i in range(7)}
+    assert stats['documents'] == 7
+    assert stats['fallback_documents'] == 1
+
+
+def test_extract_invoice_data_batch_falls_back_for_missing_documents(app):
+    app.config.update(GEMINI_BATCH_MAX_DOCS=4, GEMINI_BATCH_TOKEN_BUDGET=100000)
+    model = DroppingGeminiModel(request_latency=0, seconds_per_1k_tokens=0)
+    vision_service.set_gemini_model(model)
+    docs = documents(8)
+
+    results, stats = vision_service.extract_invoice_data_batch(docs)
+
+    assert model.requests == 4 # 2 packs + 1 per dropped document
+    assert {document_id: data['invoice_number'] for document_id, data in results.items()} == {
+        str(i): f"INV-{i:04d}" for i in range(8)}
+    assert stats['fallback_documents'] == 2
+    # A document that fell back from a pack is counted once
+    assert stats['estimated_ocr_tokens_after_compaction'] == sum(
+        vision_service.estimate_tokens(vision_service.compact_for_prompt(text)) for _, text in docs)
+
+
+def test_extract_batch_stores_each_invoice(app, database, tmp_path):
+    app.config.update(GEMINI_BATCH_MAX_DOCS=8)
+    vision_service.set_gemini_model(FakeGeminiModel(request_latency=0, seconds_per_1k_tokens=0))
+    _, invoice_ids = add_batch(database, [tmp_path / f"receipt_{i}.png" for i in range(3)])
+    texts = ["\n".join(invoice_lines(f"INV-{i}", 2, seed=i)) for i in range(2)] + [""]
+
+    invoice_processor.extract_batch([{'invoice_id': invoice_id, 'ocr_text': text} for invoice_id, text in zip(invoice_ids, texts)])
+    db.close_db()
+
+    rows = database.acquire().raw.execute("SELECT id, status, vendor_name, invoice_number FROM invoices ORDER BY id").fetchall()
+    assert rows[:2] == [(invoice_ids[0], 'processed', 'Acme Utilities Pvt Ltd', 'INV-0'),
+                        (invoice_ids[1], 'processed', 'Acme Utilities Pvt Ltd', 'INV-1')]
+    assert rows[2][1] == 'processed' # No OCR text: stored without a Gemini call
+    assert events(database, 'processed') == invoice_ids
+
+
+def test_savings_count_packed_documents_only(app):
+    app.config.update(GEMINI_BATCH_MAX_DOCS=8, GEMINI_BATCH_TOKEN_BUDGET=100000, GEMINI_MAX_PROMPT_TOKENS=1000)
+    vision_service.set_gemini_model(FakeGeminiModel(request_latency=0, seconds_per_1k_tokens=0))
+    long_documents = [(f"long{i}", "\n".join(invoice_lines(f"INV-L{i}", 200, seed=i))) for i in range(2)]
+
+    results, stats = vision_service.extract_invoice_data_batch(documents(8) + long_documents)
+
+    assert len(results) == 10
+    assert (stats['pack_requests'], stats['fallback_requests'], stats['oversized_documents']) == (1, 0, 2)
+    instruction_tokens = vision_service.estimate_tokens(vision_service._build_prompt(""))
+    assert stats['estimated_tokens_saved'] == 7 * instruction_tokens # 8 documents in 1 request
@@ -0,0 +1,114 @@
+"""
+services/layout_index.py: a layout's learned template only replaces Gemini once it can also
+read the layout's line item rows, and what it extracts is never cached as a Gemini result.
+Runs against FakeGeminiModel(line_items=True) and the SQLite stand-in.
+"""
+import re
+
+import pytest
+
+from fakes import FakeGeminiModel
+from fixtures import invoice_lines
+from services import invoice_processor, layout_index, result_cache, vision_service
+
+
+class DatedGeminiModel(FakeGeminiModel):
+    """Also reads the 'Invoice Date:' line, so the fake's results teach a complete template."""
+
+    def __init__(self):
+        super().__init__(request_latency=0, seconds_per_1k_tokens=0, line_items=True)
+
+    def extract(self, ocr_text):
+        date = re.search(r'Invoice Date: (\S+)', ocr_text)
+        return {**super().extract(ocr_text), 'invoice_date': date.group(1) if date else None}
+
+
+@pytest.fixture
+def index(app, database, monkeypatch):
+    """A fresh process-wide index (bootstrapped from the empty database) with learned templates enabled."""
+    app.config.update(LAYOUT_INDEX_ENABLED=True, LAYOUT_MIN_SAMPLES=3)
+    monkeypatch.setattr(layout_index, '_index', None)
+    return layout_index.get_index()
+
+
+def invoice(i, items=3):
+    return "\n".join(invoice_lines(f"INV-{i:04d}", items + i % 3, seed=i))
+
+
+def test_learned_template_keeps_line_items(app, index):
+    model = DatedGeminiModel()
+    vision_service.set_gemini_model(model)
+    for i in range(3):
+        assert layout_index.extract(invoice(i))[1] is False
+
+    text = invoice(7, items=5)
+    structured_data, learned = layout_index.extract(text)
+
+    assert learned and model.requests == 3
+    expected = vision_service._structure_extracted_data(model.extract(text), text)
+    assert len(structured_data['line_items']) == 6
+    assert structured_data['line_items'] == expected['line_items']
+    assert structured_data['invoice_number'] == "INV-0007"
+
+
+def test_layout_without_a_learned_row_goes_to_gemini(app, index):
+    # Gemini returning no line items for documents that have rows teaches nothing the template could read
+    model = DatedGeminiModel()
+    vision_service.set_gemini_model(model)
+    for i in range(3):
+        text = invoice(i)
+        index.add_sample(text, {**model.extract(text), 'line_items': [{'description': "Consulting", 'item_total': 1.0}]})
+
+    assert layout_index.extract(invoice(7))[1] is False
+    assert model.requests == 1
+
+
+def test_damaged_row_goes_to_gemini(app, index):
+    model = DatedGeminiModel()
+    vision_service.set_gemini_model(model)
+    for i in range(3):
+        layout_index.extract(invoice(i))
+    lines = invoice(7).splitlines()
+    lines[8] = lines[8].replace(".", ",", 1) # '105.00' read as '105,00'
+
+    assert layout_index.extract("\n".join(lines))[1] is False
+    assert model.requests == 4
+
+
+def test_learned_results_are_not_cached(app, index, monkeypatch):
+    app.config.update(CACHE_ENABLED=True)
+    monkeypatch.setattr(result_cache, '_cache', None)
+    vision_service.set_gemini_model(DatedGeminiModel())
+    texts = [invoice(i) for i in range(4)]
+
+    for text in texts:
+        invoice_processor._extract_structured_data(text)
+
+    cache = result_cache.get_cache()
+    cached = [cache.get(result_cache.EXTRACTION_NAMESPACE, result_cache.extraction_key(text, vision_service.PROMPT_VERSION))
+              for text in texts]
+    assert [entry is not None for entry in cached] == [True, True, True, False]
+
+
+def test_bootstrap_learns_rows_from_stored_line_items(app, database, monkeypatch):
+    app.config.update(LAYOUT_INDEX_ENABLED=True, LAYOUT_MIN_SAMPLES=3)
+    model = DatedGeminiModel()
+    conn = database.acquire().raw
+    for i in range(3):
+        text = invoice(i)
+        data = vision_service._structure_extracted_data(model.extract(text), text)
+        invoice_id = conn.execute(
+            """INSERT INTO invoices (file_name, status, raw_text, vendor_name, invoice_number, invoice_date, total_amount)
+               VALUES (?, 'processed', ?, ?, ?, ?, ?)""",
+            (f"{i}.pdf", text, data['vendor_name'], data['invoice_number'], data['invoice_date'], data['total_amount'])).lastrowid
+        conn.executemany(
+            "INSERT INTO invoice_line_items (invoice_id, line_index, description, quantity, unit_price, item_total) VALUES (?, ?, ?, ?, ?, ?)",
+            [(invoice_id, n, item['description'], item['quantity'], item['unit_price'], item['item_total'])
+             for n, item in enumerate(data['line_items'])])
+    conn.commit()
+    monkeypatch.setattr(layout_index, '_index', None)
+
+    structured_data, learned = layout_index.extract(invoice(7))
+
+    assert learned
+    assert [item['description'] for item in structured_data['line_items']] == [f"Service item {n}" for n in range(1, 5)]
@@ -0,0 +1,157 @@
+"""
+OCR backend selection (services/ocr_backends.py) and the hybrid PDF path: only image-only
+pages are rasterized and OCRed, and their text is merged back in page order.
+"""
+import sys
+
+import pytest
+
+from fakes import FakeVisionClient, default_fake_text
+from fixtures import invoice_lines, make_png, make_text_pdf, scanned_page
+from services import ocr_backends, pdf_extraction, text_compaction, vision_service
+
+
+class RecordingBackend(ocr_backends.OCRBackend):
+    """Answers 'SCANNED PAGE <n>' for the n-th image it is given; fails the pages listed in `fail`."""
+    name = 'recording'
+
+    def __init__(self, fail=()):
+        self.calls = 0
+        self.fail = set(fail)
+
+    def image_to_text(self, image_content):
+        self.calls += 1
+        assert bytes(image_content[:8]) == b"\x89PNG\r\n\x1a\n"
+        if self.calls in self.fail:
+            raise RuntimeError("unreadable page")
+        return f"SCANNED PAGE {self.calls}"
+
+
+@pytest.fixture
+def hybrid_pdf(app, tmp_path):
+    """Text page, scanned page, text page, scanned page."""
+    app.config['PDF_OCR_CONCURRENCY'] = 1 # RecordingBackend numbers pages in call order
+    return str(make_text_pdf(tmp_path / "hybrid.pdf", [
+        invoice_lines("INV-1", 3), scanned_page(seed=1), ["Continued from page 2", "Subtotal: 10.00"], scanned_page(seed=2)]))
+
+
+@pytest.mark.parametrize('name, backend_class', [
+    ('vision', ocr_backends.VisionOCRBackend),
+    ('tesseract', ocr_backends.TesseractOCRBackend),
+])
+def test_backend_is_chosen_by_config(app, name, backend_class):
+    app.config['OCR_BACKEND'] = name
+    assert type(ocr_backends.get_backend()) is backend_class
+
+
+def test_unknown_backend_is_rejected(app):
+    app.config['OCR_BACKEND'] = 'abbyy'
+    with pytest.raises(ValueError, match='abbyy'):
+        ocr_backends.get_backend()
+
+
+def test_set_backend_overrides_config_until_reset(app):
+    backend = RecordingBackend()
+    ocr_backends.set_backend(backend)
+    assert ocr_backends.get_backend() is backend
+    ocr_backends.set_backend(None)
+    assert type(ocr_backends.get_backend()) is ocr_backends.VisionOCRBackend
+
+
+def test_tesseract_without_its_packages_is_a_clear_error(app, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'pytesseract', None)
+    with pytest.raises(ValueError, match='pytesseract'):
+        ocr_backends.TesseractOCRBackend().image_to_text(b"")
+
+
+def test_vision_backend_reads_the_fake_client(app):
+    client = FakeVisionClient(request_latency=0, per_image_latency=0)
+    vision_service.set_vision_client(client)
+    assert ocr_backends.VisionOCRBackend().image_to_text(b"image") == default_fake_text(b"image")
+    assert client.requests == 1
+
+
+def test_vision_backend_raises_on_an_error_response(app):
+    vision_service.set_vision_client(FakeVisionClient(request_latency=0, per_image_latency=0, failure_rate=1.0))
+    with pytest.raises(Exception, match='Simulated Vision failure'):
+        ocr_backends.VisionOCRBackend().image_to_text(b"image")
+
+
+def test_vision_batch_returns_one_entry_per_image(app):
+    client = FakeVisionClient(request_latency=0, per_image_latency=0, failure_rate=0.5, seed=3)
+    vision_service.set_vision_client(client)
+    contents = [b"image %d" % i for i in range(10)]
+
+    results = ocr_backends.VisionOCRBackend().images_to_text(contents)
+
+    assert client.requests == 1
+    assert len(results) == len(contents)
+    assert any(isinstance(result, Exception) for result in results)
+    for content, result in zip(contents, results):
+        assert isinstance(result, Exception) or result == default_fake_text(content)
+
+
+def test_default_images_to_text_keeps_going_after_a_failure(app):
+    results = RecordingBackend(fail={2}).images_to_text([b"\x89PNG\r\n\x1a\n"] * 3)
+    assert results[0] == "SCANNED PAGE 1" and results[2] == "SCANNED PAGE 3"
+    assert isinstance(results[1], RuntimeError)
+
+
+def test_image_uploads_use_the_configured_backend(app, tmp_path):
+    backend = RecordingBackend()
+    ocr_backends.set_backend(backend)
+    path = make_png(tmp_path / "receipt.png", scanned_page(40, 40))
+    assert vision_service.get_ocr_text_from_image(file_path=str(path), mime_type='image/png') == "SCANNED PAGE 1"
+
+
+def test_only_scanned_pages_are_ocred_and_merged_in_page_order(app, hybrid_pdf):
+    backend = RecordingBackend()
+    ocr_backends.set_backend(backend)
+
+    text = vision_service.get_ocr_text_from_image(file_path=hybrid_pdf, mime_type='application/pdf')
+
+    assert backend.calls == 2
+    pages = text.split(f"\n{text_compaction.PAGE_BREAK}\n")
+    assert [page.splitlines()[0] for page in pages] == [
+        "Acme Utilities Pvt Ltd", "SCANNED PAGE 1", "Continued from page 2", "SCANNED PAGE 2"]
+
+
+def test_text_pdfs_never_call_the_backend(app, tmp_path):
+    backend = RecordingBackend()
+    ocr_backends.set_backend(backend)
+    path = make_text_pdf(tmp_path / "text.pdf", [invoice_lines("INV-1", 40)[:30], invoice_lines("INV-1", 40)[30:]])
+
+    text = vision_service.get_ocr_text_from_image(file_path=str(path), mime_type='application/pdf')
+
+    assert backend.calls == 0
+    assert "Invoice No: INV-1" in text
+
+
+def test_scanned_page_ocr_can_be_turned_off(app, hybrid_pdf):
+    app.config['PDF_OCR_SCANNED_PAGES'] = False
+    backend = RecordingBackend()
+    ocr_backends.set_backend(backend)
+
+    text = vision_service.get_ocr_text_from_image(file_path=hybrid_pdf, mime_type='application/pdf')
+
+    assert backend.calls == 0
+    assert "SCANNED PAGE" not in text and "Continued from page 2" in text
+
+
+def test_a_failed_page_keeps_the_text_of_the_others(app, hybrid_pdf):
+    ocr_backends.set_backend(RecordingBackend(fail={1}))
+
+    text = vision_service.get_ocr_text_from_image(file_path=hybrid_pdf, mime_type='application/pdf')
+
+    assert "SCANNED PAGE 1" not in text
+    assert "Continued from page 2" in text and "SCANNED PAGE 2" in text
+
+
+def test_short_text_pages_without_images_are_not_rasterized(tmp_path):
+    path = make_text_pdf(tmp_path / "short.pdf", [["Page 1"], scanned_page()])
+    ocred = []
+
+    pages = list(pdf_extraction.iter_page_texts(str(path), ocr_page=lambda png: ocred.append(png) or "OCR", min_text_chars=20))
+
+    assert pages == [(1, "Page 1"), (2, "OCR")]
+    assert len(ocred) == 1
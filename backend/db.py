@@ -1,18 +1,182 @@
 import mysql.connector
 from mysql.connector import Error
+from mysql.connector.errors import PoolError
 from flask import current_app, g
+from collections import deque
 import os
+import threading
+import time
+
+
+class ConnectionPool:
+    """
+    A small MySQL connection pool with overflow, health-check-on-checkout and recycling.
+
+    Up to `pool_size` idle connections are kept around between requests. When all of
+    them are in use, up to `max_overflow` extra connections may be opened; those are
+    closed instead of being returned to the pool. Connections older than
+    `recycle_seconds` are replaced on checkout, and (if `pre_ping` is set) every
+    checked-out connection is pinged first so a stale one is never handed to a route.
+    """
+
+    def __init__(self, connect_kwargs, pool_size=5, max_overflow=10, recycle_seconds=3600,
+                 pre_ping=True, checkout_timeout=30, logger=None):
+        self.connect_kwargs = connect_kwargs
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.recycle_seconds = recycle_seconds
+        self.pre_ping = pre_ping
+        self.checkout_timeout = checkout_timeout
+        self.logger = logger
+        self._idle = deque() # (connection, created_at) pairs, most recently returned on the right
+        self._created_at = {} # id(connection) -> creation time, for connections that are checked out
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            'checkouts': 0,
+            'connections_created': 0,
+            'connections_recycled': 0,
+            'failed_health_checks': 0,
+            'checkout_timeouts': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+
+    def _new_connection(self):
+        conn = mysql.connector.connect(**self.connect_kwargs)
+        with self._cond:
+            self._stats['connections_created'] += 1
+        if self.logger:
+            self.logger.info(f"Opened new pooled MySQL connection to database: {self.connect_kwargs.get('database')}")
+        return conn, time.monotonic()
+
+    def _is_healthy(self, conn):
+        try:
+            conn.ping(reconnect=False, attempts=1)
+            return True
+        except Error:
+            return False
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.close()
+        except Error:
+            pass
+
+    def acquire(self):
+        wait_started = time.monotonic()
+        with self._cond:
+            # Block while every allowed connection (pool + overflow) is checked out
+            while self._in_use >= self.pool_size + self.max_overflow:
+                remaining = self.checkout_timeout - (time.monotonic() - wait_started)
+                if remaining <= 0:
+                    self._stats['checkout_timeouts'] += 1
+                    raise PoolError(f"Timed out after {self.checkout_timeout}s waiting for a MySQL connection")
+                self._cond.wait(remaining)
+            self._in_use += 1
+            idle_entry = self._idle.pop() if self._idle else None
+            waited = time.monotonic() - wait_started
+            self._stats['checkouts'] += 1
+            self._stats['wait_time_total'] += waited
+            self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+
+        # Connection setup and health checks happen outside the lock
+        try:
+            conn, created_at = idle_entry if idle_entry else self._new_connection()
+            if idle_entry and time.monotonic() - created_at > self.recycle_seconds:
+                with self._cond:
+                    self._stats['connections_recycled'] += 1
+                self._discard(conn)
+                conn, created_at = self._new_connection()
+            elif idle_entry and self.pre_ping and not self._is_healthy(conn):
+                with self._cond:
+                    self._stats['failed_health_checks'] += 1
+                self._discard(conn)
+                conn, created_at = self._new_connection()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        self._created_at[id(conn)] = created_at
+        return conn
+
+    def release(self, conn):
+        created_at = self._created_at.pop(id(conn), time.monotonic())
+        reusable = True
+        try:
+            conn.rollback() # Never hand an open transaction to the next request
+        except Error:
+            reusable = False
+        with self._cond:
+            self._in_use -= 1
+            if reusable and len(self._idle) < self.pool_size:
+                self._idle.append((conn, created_at))
+                conn = None
+            self._cond.notify()
+        if conn is not None: # Overflow or broken connection
+            self._discard(conn)
+
+    def discard(self, conn):
+        """Closes a checked-out connection instead of returning it (e.g. one with unread results)."""
+        self._created_at.pop(id(conn), None)
+        with self._cond:
+            self._in_use -= 1
+            self._cond.notify()
+        self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'pool_size': self.pool_size,
+                'max_overflow': self.max_overflow,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'wait_time_avg': stats['wait_time_total'] / stats['checkouts'] if stats['checkouts'] else 0.0,
+            })
+        return stats
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns this process's connection pool, (re)creating it after a fork so connections are never shared."""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                config = current_app.config
+                _pool = ConnectionPool(
+                    connect_kwargs={
+                        'host': config['MYSQL_HOST'],
+                        'user': config['MYSQL_USER'],
+                        'password': config['MYSQL_PASSWORD'],
+                        'database': config['MYSQL_DB'],
+                    },
+                    pool_size=config.get('MYSQL_POOL_SIZE', 5),
+                    max_overflow=config.get('MYSQL_POOL_MAX_OVERFLOW', 10),
+                    recycle_seconds=config.get('MYSQL_POOL_RECYCLE_SECONDS', 3600),
+                    pre_ping=config.get('MYSQL_POOL_PRE_PING', True),
+                    checkout_timeout=config.get('MYSQL_POOL_TIMEOUT', 30),
+                    logger=current_app.logger
+                )
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def get_pool_stats():
+    return _pool.stats() if _pool is not None and _pool_pid == os.getpid() else None
+
 
 def get_db():
     if 'db' not in g:
         try:
-            g.db = mysql.connector.connect(
-                host=current_app.config['MYSQL_HOST'],
-                user=current_app.config['MYSQL_USER'],
-                password=current_app.config['MYSQL_PASSWORD'],
-                database=current_app.config['MYSQL_DB']
-            )
-            current_app.logger.info(f"Successfully connected to MySQL database: {current_app.config['MYSQL_DB']}")
+            g.db = get_pool().acquire()
         except Error as e:
             current_app.logger.error(f"Error connecting to MySQL Database: {e}")
             g.db = None # Ensure db is None if connection fails
@@ -23,8 +187,40 @@ def get_db():
 def close_db(e=None):
     db = g.pop('db', None)
     if db is not None:
-        db.close()
-        current_app.logger.info("MySQL connection closed.")
+        # Return the connection to the pool instead of closing it
+        get_pool().release(db)
+
+def discard_db():
+    """Like close_db(), but the connection is closed rather than pooled; for a streamed result abandoned halfway."""
+    db = g.pop('db', None)
+    if db is not None:
+        get_pool().discard(db)
+
+def bulk_insert(cursor, table, columns, rows, max_statement_bytes=1024 * 1024, max_rows_per_statement=1000):
+    """
+    Inserts `rows` (a list of tuples) with multi-row INSERT statements instead of one
+    round trip per row. Rows are chunked so each statement stays well below the
+    server's max_allowed_packet. Returns the number of statements executed.
+    """
+    if not rows:
+        return 0
+    column_list = ", ".join(columns)
+    row_placeholder = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    statement_prefix = f"INSERT INTO {table} ({column_list}) VALUES "
+
+    statements = 0
+    chunk, chunk_bytes = [], len(statement_prefix)
+    for row in rows:
+        # Rough upper bound of the row's size once escaped and inlined into the statement
+        row_bytes = len(row_placeholder) + sum(len(str(value).encode('utf-8')) * 2 + 4 for value in row)
+        if chunk and (chunk_bytes + row_bytes > max_statement_bytes or len(chunk) >= max_rows_per_statement):
+            cursor.execute(statement_prefix + ", ".join([row_placeholder] * len(chunk)), [v for r in chunk for v in r])
+            statements += 1
+            chunk, chunk_bytes = [], len(statement_prefix)
+        chunk.append(row)
+        chunk_bytes += row_bytes
+    cursor.execute(statement_prefix + ", ".join([row_placeholder] * len(chunk)), [v for r in chunk for v in r])
+    return statements + 1
 
 def init_app(app):
     app.teardown_appcontext(close_db)
@@ -1,11 +1,25 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from werkzeug.utils import secure_filename
 import os
 import datetime
 import mimetypes 
+import base64
+import json
+import queue
+import time
+import zipfile
+from werkzeug.exceptions import RequestEntityTooLarge
 
 import db 
-from services import vision_service # This now contains the Gemini logic
+from services import job_queue # OCR + Gemini extraction run in background workers (services/invoice_processor.py)
+from services import upload_storage # Uploads are streamed to disk, hashed on the fly (see UploadRequest)
+from services import line_items # Typed line items (invoice_line_items)
+from services import spend_rollups # Spend totals maintained with every processed / deleted invoice
+from services import invoice_search # FULLTEXT search over raw_text, vendor, invoice number and line items
+from services import response_cache # ETags + server-side cache of invoice reads
+from services import invoice_events # Status transitions for the server-sent events stream
+from services import metrics # Per-stage timers and error counters (/metrics)
+from services import invoice_export # Streaming CSV / NDJSON / Parquet exports
 
 # We might not need google_exceptions if all API calls are within vision_service and handled there
 # from google.api_core import exceptions as google_exceptions 
@@ -13,7 +27,7 @@ from services import vision_service # This now contains the Gemini logic
 # Define a Blueprint for invoice routes
 invoice_bp = Blueprint('invoice_bp', __name__, url_prefix='/api/invoices')
 
-UPLOAD_FOLDER = 'uploads' # Should be a configuration, e.g., app.config['UPLOAD_FOLDER']
+UPLOAD_FOLDER = upload_storage.UPLOAD_FOLDER # Should be a configuration, e.g., app.config['UPLOAD_FOLDER']
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf'}
 
 if not os.path.exists(UPLOAD_FOLDER):
@@ -23,6 +37,25 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def _get_upload_folder():
+    """Returns the absolute upload folder, creating it if needed. Raises OSError if it can't be created."""
+    # Ensure UPLOAD_FOLDER is absolute or correctly relative to the app root
+    upload_folder_abs = upload_storage.get_upload_folder()
+    if not os.path.exists(upload_folder_abs):
+        try:
+            os.makedirs(upload_folder_abs)
+            current_app.logger.info(f"Created upload folder: {upload_folder_abs}")
+        except OSError as e:
+            current_app.logger.error(f"Error creating upload folder {upload_folder_abs}: {e}")
+            raise
+    return upload_folder_abs
+
+@invoice_bp.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    # Raised while the multipart body is streamed to disk (MAX_UPLOAD_BYTES) or by MAX_CONTENT_LENGTH
+    current_app.logger.warning(f"Rejected upload: {e.description}")
+    return jsonify({'error': e.description}), 413
+
 @invoice_bp.route('/upload', methods=['POST'])
 def upload_invoice():
     if 'file' not in request.files:
@@ -36,15 +69,10 @@ def upload_invoice():
 
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        # Ensure UPLOAD_FOLDER is absolute or correctly relative to the app root
-        upload_folder_abs = os.path.join(current_app.root_path, UPLOAD_FOLDER)
-        if not os.path.exists(upload_folder_abs):
-            try:
-                os.makedirs(upload_folder_abs)
-                current_app.logger.info(f"Created upload folder: {upload_folder_abs}")
-            except OSError as e:
-                current_app.logger.error(f"Error creating upload folder {upload_folder_abs}: {e}")
-                return jsonify({'error': 'Could not create upload directory'}), 500
+        try:
+            upload_folder_abs = _get_upload_folder()
+        except OSError:
+            return jsonify({'error': 'Could not create upload directory'}), 500
         
         # Create a unique filename to avoid overwrites
         timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
@@ -52,13 +80,19 @@ def upload_invoice():
         file_path = os.path.join(upload_folder_abs, unique_filename)
         
         try:
-            file.save(file_path)
-            current_app.logger.info(f"File saved to {file_path}")
+            # The body was already streamed into the upload folder while the request was parsed;
+            # this just renames it into place
+            with metrics.stage_timer('file_save'):
+                stored = upload_storage.commit_upload(file, file_path)
+            current_app.logger.info(f"File saved to {file_path} ({stored.size} bytes, sha256 {stored.sha256[:12]})")
+        except RequestEntityTooLarge:
+            raise
         except Exception as e:
             current_app.logger.error(f"Error saving file {file_path}: {e}")
             return jsonify({'error': f'Could not save file: {str(e)}'}), 500
 
-        # At this point, the file is saved. Now, interact with the database.
+        # At this point, the file is saved. Create the invoice row and hand the slow
+        # OCR + Gemini work off to the background workers.
         conn = db.get_db()
         if not conn:
             return jsonify({'error': 'Database connection failed'}), 500
@@ -66,132 +100,251 @@ def upload_invoice():
         invoice_id = None # Initialize invoice_id
 
         try:
-            # Save initial invoice record to database
             sql_insert_invoice = """
-            INSERT INTO invoices (user_id, file_name, original_file_path, status, raw_text)
-            VALUES (%s, %s, %s, 'uploaded', %s) """ # Add raw_text placeholder initially
-            
-            # Perform OCR first to get raw_text
-            mime_type = mimetypes.guess_type(file_path)[0] or file.mimetype
-            with open(file_path, 'rb') as f_content:
-                image_content = f_content.read()
-            
-            ocr_text = "" # Default to empty if OCR fails
+            INSERT INTO invoices (user_id, file_name, original_file_path, status)
+            VALUES (%s, %s, %s, 'uploaded') """
+            with metrics.stage_timer('db_write'):
+                cursor.execute(sql_insert_invoice, (user_id, unique_filename, file_path))
+                invoice_id = cursor.lastrowid
+                invoice_events.record(cursor, invoice_id, 'uploaded')
+                response_cache.touch(cursor)
+                conn.commit()
+            current_app.logger.info(f"Invoice record created with ID: {invoice_id}")
+        except Exception as e:
+            conn.rollback()
+            current_app.logger.error(f"Error creating invoice record for {unique_filename}: {e}", exc_info=True)
+            return jsonify({'error': f'Could not create invoice record: {str(e)}'}), 500
+        finally:
+            cursor.close()
+
+        mime_type = mimetypes.guess_type(file_path)[0] or file.mimetype
+        try:
+            with metrics.stage_timer('enqueue'):
+                job_queue.enqueue('process_invoice', {
+                    'invoice_id': invoice_id,
+                    'file_path': file_path,
+                    'mime_type': mime_type,
+                    'file_sha256': stored.sha256
+                })
+        except Exception as e:
+            current_app.logger.error(f"Could not queue invoice {invoice_id} for processing: {e}", exc_info=True)
+            cursor = conn.cursor()
             try:
-                # Pass file_path and mime_type to handle PDFs differently
-                ocr_text = vision_service.get_ocr_text_from_image(
-                    image_content=image_content,
-                    file_path=file_path,
-                    mime_type=mime_type
-                )
-            except Exception as ocr_error:
-                current_app.logger.error(f"OCR step failed for {unique_filename}: {ocr_error}")
-                # Decide if you want to proceed without OCR text or mark as error
-                # For now, we'll proceed with empty ocr_text but log it.
-
-            cursor.execute(sql_insert_invoice, (user_id, unique_filename, file_path, ocr_text))
-            invoice_id = cursor.lastrowid
-            # conn.commit() # Commit after OCR and initial insert
-            current_app.logger.info(f"Invoice record created with ID: {invoice_id}, OCR text stored (length: {len(ocr_text)}).")
-
-            cursor.execute("UPDATE invoices SET status = 'processing' WHERE id = %s", (invoice_id,))
-            # conn.commit() # Commit status update
-
-            # Now, extract structured data using Gemini
-            structured_data = vision_service.extract_invoice_data_with_gemini(ocr_text)
-            current_app.logger.info(f"Data extracted by Gemini for invoice ID {invoice_id}: {structured_data}")
-            
-            update_sql = """
-            UPDATE invoices 
-            SET total_amount = %s, vendor_name = %s, invoice_date = %s, 
-                status = 'processed', processed_at = CURRENT_TIMESTAMP,
-                raw_text = %s, 
-                invoice_number = %s
-                /* Note: currency column will be added later */
-            WHERE id = %s
-            """
-            
-            db_invoice_date = structured_data.get('invoice_date')
-            # The vision_service now attempts to parse to YYYY-MM-DD, or keeps original string
-            detected_currency = structured_data.get('detected_currency') # Get the detected currency, will be used when currency column exists
-
-            cursor.execute(update_sql, (
-                structured_data.get('total_amount'),
-                structured_data.get('vendor_name'),
-                db_invoice_date, 
-                structured_data.get('raw_text', ocr_text), # Use Gemini's raw_text if it differs, else original OCR
-                structured_data.get('invoice_number'),
-                # detected_currency, # Commenting out until the column exists in the database
-                invoice_id
-            ))
-            
-            # Save line items to invoice_fields table
-            if structured_data.get('line_items') and isinstance(structured_data['line_items'], list):
-                for idx, item in enumerate(structured_data['line_items']):
-                    # Ensure item is a dictionary before trying to get values
-                    if not isinstance(item, dict): 
-                        current_app.logger.warning(f"Skipping line item as it is not a dictionary: {item}")
-                        continue
+                cursor.execute("UPDATE invoices SET status = 'error' WHERE id = %s", (invoice_id,))
+                invoice_events.record(cursor, invoice_id, 'error')
+                response_cache.touch(cursor)
+                conn.commit()
+            except Exception as db_err:
+                current_app.logger.error(f"DB error while setting status to error after queueing failure: {db_err}")
+            finally:
+                cursor.close()
+            return jsonify({'error': f'Could not queue invoice for processing: {str(e)}'}), 500
 
-                    field_sql = "INSERT INTO invoice_fields (invoice_id, field_name, field_value) VALUES (%s, %s, %s)" # Removed confidence and coordinates for now
-                    
-                    desc = str(item.get('description', '')) # Default to empty string if None
-                    amt = str(item.get('item_total', ''))
-                    qty = str(item.get('quantity', ''))
-                    unit_p = str(item.get('unit_price', ''))
-
-                    if desc: cursor.execute(field_sql, (invoice_id, f"line_item_{idx+1}_description", desc))
-                    if amt: cursor.execute(field_sql, (invoice_id, f"line_item_{idx+1}_amount", amt))
-                    if qty: cursor.execute(field_sql, (invoice_id, f"line_item_{idx+1}_quantity", qty))
-                    if unit_p: cursor.execute(field_sql, (invoice_id, f"line_item_{idx+1}_unit_price", unit_p))
-            
-            # Save additional_details from Gemini to invoice_fields table
-            additional_details = structured_data.get('additional_details', {})
-            if isinstance(additional_details, dict):
-                for field_name, field_value in additional_details.items():
-                    if field_value is not None: # Only save if there's a value
-                        field_sql_additional = "INSERT INTO invoice_fields (invoice_id, field_name, field_value) VALUES (%s, %s, %s)" # Removed confidence and coordinates
-                        # Ensure field_value is a string for DB insertion
-                        cursor.execute(field_sql_additional, (invoice_id, str(field_name), str(field_value)))
-                        current_app.logger.info(f"Stored additional detail: {field_name} = {field_value}")
-
-            conn.commit() 
-            current_app.logger.info(f"Invoice ID: {invoice_id} fully processed and updated in DB using Gemini data.")
-
-            return jsonify({
-                'message': 'File uploaded, OCRed, and parsed with Gemini successfully!',
-                'invoice_id': invoice_id,
-                'filename': unique_filename,
-                'raw_text_preview': structured_data.get('raw_text', ocr_text)[:200] + '...' if structured_data.get('raw_text', ocr_text) else 'No OCR text extracted',
-                'extracted_data_gemini': structured_data
-            }), 201
-
-        except ValueError as ve: # Catch specific ValueErrors like missing API keys or JSON parsing issues from Gemini service
-            current_app.logger.error(f"ValueError during processing for invoice {invoice_id if invoice_id else 'unknown'}: {ve}")
-            if invoice_id and cursor and conn: # Ensure cursor and conn are available
-                 try:
-                    cursor.execute("UPDATE invoices SET status = 'error' WHERE id = %s", (invoice_id,))
-                    conn.commit()
-                 except Exception as db_err:
-                    current_app.logger.error(f"DB error while setting status to error after ValueError: {db_err}")
-            return jsonify({'error': f'Configuration or input error: {str(ve)}'}), 500
-        except Exception as e: # Catch other general exceptions, including those re-raised from services
-            if conn: conn.rollback()
-            current_app.logger.error(f"Unexpected error for invoice {invoice_id if invoice_id else 'unknown'}: {e}", exc_info=True)
-            if invoice_id and cursor and conn:
-                 try:
-                    cursor.execute("UPDATE invoices SET status = 'error' WHERE id = %s", (invoice_id,))
-                    conn.commit()
-                 except Exception as db_err:
-                    current_app.logger.error(f"DB error while setting status to error after general Exception: {db_err}")
-            return jsonify({'error': f'An unexpected error occurred: {str(e)}'}), 500
-        finally:
-            if cursor: cursor.close()
+        return jsonify({
+            'message': 'File uploaded and queued for processing.',
+            'invoice_id': invoice_id,
+            'filename': unique_filename,
+            'status': 'uploaded'
+        }), 202
     else:
         return jsonify({'error': 'File type not allowed'}), 400
 
+def _save_batch_files(files, upload_folder_abs, saved):
+    """
+    Saves every allowed file from a batch upload, expanding .zip archives.
+    Appends (unique_filename, file_path) to `saved` as it goes (so the caller can clean up
+    after a failure) and returns the names of rejected files.
+    Raises ValueError if the batch exceeds BATCH_MAX_FILES or BATCH_MAX_TOTAL_BYTES, and
+    RequestEntityTooLarge if a file or zip entry is larger than MAX_UPLOAD_BYTES (the parts
+    themselves are only capped at BATCH_MAX_TOTAL_BYTES while they are streamed, see UploadRequest).
+    """
+    max_upload_bytes = current_app.config.get('MAX_UPLOAD_BYTES')
+    max_files = current_app.config.get('BATCH_MAX_FILES', 500)
+    max_total_bytes = current_app.config.get('BATCH_MAX_TOTAL_BYTES', 500 * 1024 * 1024)
+    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
+    rejected = []
+    total_bytes = 0
+
+    def unique_path(filename):
+        # The item index keeps names unique even when a zip repeats a file name in different folders
+        unique_filename = f"{timestamp}_{len(saved) + 1}_{secure_filename(filename)}"
+        return unique_filename, os.path.join(upload_folder_abs, unique_filename)
+
+    for file in files:
+        if file.filename.lower().endswith('.zip'):
+            with zipfile.ZipFile(file.stream) as archive:
+                for entry in archive.infolist():
+                    entry_name = os.path.basename(entry.filename)
+                    if entry.is_dir() or not entry_name:
+                        continue
+                    if not allowed_file(entry_name):
+                        rejected.append(entry.filename)
+                        continue
+                    # Check the declared sizes up front so a zip bomb is never extracted
+                    total_bytes += entry.file_size
+                    if len(saved) >= max_files or total_bytes > max_total_bytes:
+                        raise ValueError(f"Batch exceeds the limit of {max_files} files / {max_total_bytes} bytes")
+                    unique_filename, file_path = unique_path(entry_name)
+                    saved.append((unique_filename, file_path))
+                    with archive.open(entry) as source:
+                        upload_storage.save_stream(source, file_path, max_upload_bytes)
+        elif allowed_file(file.filename):
+            if len(saved) >= max_files:
+                raise ValueError(f"Batch exceeds the limit of {max_files} files")
+            unique_filename, file_path = unique_path(file.filename)
+            saved.append((unique_filename, file_path))
+            size = upload_storage.commit_upload(file, file_path).size
+            if max_upload_bytes and size > max_upload_bytes:
+                raise RequestEntityTooLarge(f"{file.filename} exceeds the limit of {max_upload_bytes} bytes")
+            total_bytes += size
+            if total_bytes > max_total_bytes:
+                raise ValueError(f"Batch exceeds the limit of {max_total_bytes} bytes")
+        else:
+            rejected.append(file.filename)
+    return rejected
+
+@invoice_bp.route('/batch', methods=['POST'])
+def upload_batch():
+    """
+    Bulk upload: accepts many files (multipart field 'files') and/or .zip archives of invoices.
+    Images are OCRed in groups with Vision batch annotate requests by a background job,
+    then each invoice is extracted and stored individually. Returns a batch id for progress polling.
+    """
+    files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not files:
+        return jsonify({'error': 'No files in request'}), 400
+
+    # Assuming user_id is sent in the form data or from session/token in a real app
+    user_id = request.form.get('user_id', 1) # Placeholder, replace with actual user auth
+
+    try:
+        upload_folder_abs = _get_upload_folder()
+    except OSError:
+        return jsonify({'error': 'Could not create upload directory'}), 500
+
+    saved = []
+    try:
+        rejected = _save_batch_files(files, upload_folder_abs, saved)
+    except (ValueError, zipfile.BadZipFile, OSError, RequestEntityTooLarge) as e:
+        current_app.logger.error(f"Error saving batch upload: {e}")
+        for _, file_path in saved:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        if isinstance(e, RequestEntityTooLarge):
+            raise
+        status_code = 500 if isinstance(e, OSError) else 400
+        return jsonify({'error': f'Could not save batch: {str(e)}'}), status_code
+    if not saved:
+        return jsonify({'error': 'No allowed files in batch', 'rejected': rejected}), 400
+
+    conn = db.get_db()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    cursor = conn.cursor()
+    try:
+        cursor.execute("INSERT INTO invoice_batches (user_id, total_items) VALUES (%s, %s)", (user_id, len(saved)))
+        batch_id = cursor.lastrowid
+        db.bulk_insert(
+            cursor, 'invoices', ('user_id', 'batch_id', 'file_name', 'original_file_path', 'status'),
+            [(user_id, batch_id, unique_filename, file_path, 'uploaded') for unique_filename, file_path in saved]
+        )
+        cursor.execute("SELECT id, file_name FROM invoices WHERE batch_id = %s ORDER BY id", (batch_id,))
+        items = [{'invoice_id': row[0], 'filename': row[1]} for row in cursor.fetchall()]
+        invoice_events.record(cursor, [item['invoice_id'] for item in items], 'uploaded')
+        response_cache.touch(cursor)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        current_app.logger.error(f"Error creating batch records: {e}", exc_info=True)
+        return jsonify({'error': f'Could not create batch records: {str(e)}'}), 500
+    finally:
+        cursor.close()
+
+    try:
+        job_queue.enqueue('process_batch', {'batch_id': batch_id})
+    except Exception as e:
+        current_app.logger.error(f"Could not queue batch {batch_id} for processing: {e}", exc_info=True)
+        return jsonify({'error': f'Could not queue batch for processing: {str(e)}', 'batch_id': batch_id}), 500
+
+    current_app.logger.info(f"Batch {batch_id} created with {len(items)} invoice(s), {len(rejected)} rejected.")
+    return jsonify({
+        'message': 'Batch uploaded and queued for processing.',
+        'batch_id': batch_id,
+        'total_items': len(items),
+        'items': items,
+        'rejected': rejected
+    }), 202
+
+@invoice_bp.route('/batch/<int:batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    """Per-item progress of a batch upload."""
+    conn = db.get_db()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT id, total_items, created_at FROM invoice_batches WHERE id = %s", (batch_id,))
+        batch = cursor.fetchone()
+        if not batch:
+            return jsonify({'error': 'Batch not found'}), 404
+        cursor.execute(
+            "SELECT id, file_name, status, vendor_name, total_amount FROM invoices WHERE batch_id = %s ORDER BY id",
+            (batch_id,)
+        )
+        items = cursor.fetchall()
+        counts = {}
+        for item in items:
+            counts[item['status']] = counts.get(item['status'], 0) + 1
+        completed = counts.get('processed', 0) + counts.get('error', 0)
+        return jsonify({
+            'batch_id': batch_id,
+            'created_at': batch['created_at'].isoformat() if batch.get('created_at') else None,
+            'total_items': batch['total_items'],
+            'completed': completed,
+            'status': 'processed' if completed == len(items) else 'processing',
+            'counts': counts,
+            'items': items
+        }), 200
+    except Exception as e:
+        current_app.logger.error(f"Error fetching batch {batch_id}: {e}")
+        return jsonify({'error': f'Could not fetch batch: {str(e)}'}), 500
+    finally:
+        cursor.close()
+
+# Columns a client can ask for with ?fields=a,b,c (detail also accepts the line_items pseudo-field)
+INVOICE_COLUMNS = ('id', 'user_id', 'batch_id', 'file_name', 'original_file_path', 'status', 'uploaded_at', 'processed_at',
+                   'updated_at', 'vendor_name', 'invoice_number', 'invoice_date', 'total_amount', 'currency', 'raw_text')
+# raw_text is often several KB; it is only returned when asked for
+DETAIL_DEFAULT_FIELDS = tuple(column for column in INVOICE_COLUMNS if column != 'raw_text') + ('line_items',)
+LIST_DEFAULT_FIELDS = ('id', 'user_id', 'file_name', 'uploaded_at', 'status', 'total_amount', 'vendor_name', 'invoice_date')
+
+def _parse_fields(args, default, allowed):
+    """The ?fields= projection as a tuple in a canonical order. Raises ValueError on unknown fields."""
+    if not args.get('fields'):
+        return default
+    requested = {field.strip() for field in args['fields'].split(',') if field.strip()}
+    unknown = requested - set(allowed)
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(field for field in allowed if field in requested)
+
+def _isoformat_dates(invoice):
+    for key in ('uploaded_at', 'processed_at', 'updated_at', 'invoice_date'):
+        if isinstance(invoice.get(key), (datetime.date, datetime.datetime)):
+            invoice[key] = invoice[key].isoformat()
+    return invoice
+
 @invoice_bp.route('/<int:invoice_id>', methods=['GET'])
 def get_invoice(invoice_id):
+    """
+    One invoice. Query parameter: fields (comma separated; default everything but raw_text).
+    Supports If-None-Match / If-Modified-Since (validated by updated_at, see services/response_cache.py).
+    """
+    try:
+        fields = _parse_fields(request.args, DETAIL_DEFAULT_FIELDS, INVOICE_COLUMNS + ('line_items',))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {str(e)}'}), 400
+
     conn = db.get_db()
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
@@ -199,49 +352,400 @@ def get_invoice(invoice_id):
     # Use a dictionary cursor to get column names
     cursor = conn.cursor(dictionary=True) 
     try:
-        cursor.execute("SELECT * FROM invoices WHERE id = %s", (invoice_id,))
-        invoice = cursor.fetchone()
-        if invoice:
-            # Convert datetime objects to string for JSON serialization
-            if invoice.get('uploaded_at'):
-                invoice['uploaded_at'] = invoice['uploaded_at'].isoformat()
-            if invoice.get('processed_at'):
-                invoice['processed_at'] = invoice['processed_at'].isoformat()
-            if invoice.get('invoice_date') and isinstance(invoice['invoice_date'], datetime.date):
-                 invoice['invoice_date'] = invoice['invoice_date'].isoformat()
-
-            return jsonify(invoice), 200
-        else:
+        cursor.execute("SELECT updated_at FROM invoices WHERE id = %s", (invoice_id,))
+        row = cursor.fetchone()
+        if not row:
             return jsonify({'error': 'Invoice not found'}), 404
+        updated_at = row['updated_at']
+        etag = response_cache.make_etag('invoice', invoice_id, updated_at.isoformat(), ','.join(fields))
+        not_modified = response_cache.not_modified(etag, updated_at)
+        if not_modified is not None:
+            return not_modified
+
+        cache_key = ('invoice', invoice_id, updated_at, fields)
+        body = response_cache.get_cache().get(cache_key) if response_cache.is_enabled() else None
+        if body is None:
+            columns = [column for column in INVOICE_COLUMNS if column in fields]
+            cursor.execute(f"SELECT {', '.join(columns) or 'id'} FROM invoices WHERE id = %s", (invoice_id,))
+            invoice = cursor.fetchone()
+            if not invoice:
+                return jsonify({'error': 'Invoice not found'}), 404
+            if 'line_items' in fields:
+                invoice['line_items'] = line_items.get_line_items(conn, invoice_id)
+            body = current_app.json.dumps(_isoformat_dates(invoice)).encode('utf-8')
+            if response_cache.is_enabled():
+                response_cache.get_cache().set(cache_key, body)
+        return response_cache.json_response(body, etag, updated_at)
     except Exception as e:
         current_app.logger.error(f"Error fetching invoice {invoice_id}: {e}")
         return jsonify({'error': f'Could not fetch invoice: {str(e)}'}), 500
     finally:
         cursor.close()
 
+@invoice_bp.route('/<int:invoice_id>', methods=['DELETE'])
+def delete_invoice(invoice_id):
+    """Deletes an invoice (its fields and line items cascade), its spend rollup contribution and its file."""
+    conn = db.get_db()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    cursor = conn.cursor()
+    try:
+        old_contribution = spend_rollups.lock_contribution(cursor, invoice_id)
+        cursor.execute("SELECT original_file_path FROM invoices WHERE id = %s", (invoice_id,))
+        row = cursor.fetchone()
+        if not row:
+            conn.rollback()
+            return jsonify({'error': 'Invoice not found'}), 404
+        invoice_events.record(cursor, invoice_id, 'deleted')
+        cursor.execute("DELETE FROM invoices WHERE id = %s", (invoice_id,))
+        spend_rollups.apply(cursor, old_contribution, None)
+        response_cache.touch(cursor)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        current_app.logger.error(f"Error deleting invoice {invoice_id}: {e}")
+        return jsonify({'error': f'Could not delete invoice: {str(e)}'}), 500
+    finally:
+        cursor.close()
+
+    file_path = row[0]
+    if file_path and os.path.isfile(file_path):
+        try:
+            os.remove(file_path)
+        except OSError as e:
+            current_app.logger.warning(f"Invoice {invoice_id} deleted but its file {file_path} could not be removed: {e}")
+    return jsonify({'message': f'Invoice {invoice_id} deleted'}), 200
+
+MAX_STATS_GROUPS = 1000
+
+@invoice_bp.route('/stats', methods=['GET'])
+def get_spend_overview():
+    """Total spend and invoice count per currency, from the spend rollups."""
+    conn = db.get_db()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        totals = spend_rollups.get_totals(conn, 'currency')
+    except Exception as e:
+        current_app.logger.error(f"Error fetching spend totals: {e}")
+        return jsonify({'error': f'Could not fetch spend totals: {str(e)}'}), 500
+    return jsonify({'totals': totals, 'dimensions': list(spend_rollups.DIMENSIONS)}), 200
+
+@invoice_bp.route('/stats/<dimension>', methods=['GET'])
+def get_spend_stats(dimension):
+    """
+    Spend per vendor, month, currency or user (one group per key and currency), from the spend rollups.
+    Query parameters: currency, limit (largest groups first; months are returned in order).
+    """
+    if dimension not in spend_rollups.DIMENSIONS:
+        return jsonify({'error': f"Unknown dimension '{dimension}'", 'dimensions': list(spend_rollups.DIMENSIONS)}), 404
+    try:
+        limit = min(max(int(request.args.get('limit', MAX_STATS_GROUPS)), 1), MAX_STATS_GROUPS)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {str(e)}'}), 400
+
+    conn = db.get_db()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        groups = spend_rollups.get_totals(conn, dimension, currency=request.args.get('currency'), limit=limit)
+    except Exception as e:
+        current_app.logger.error(f"Error fetching spend by {dimension}: {e}")
+        return jsonify({'error': f'Could not fetch spend totals: {str(e)}'}), 500
+    return jsonify({'dimension': dimension, 'groups': groups}), 200
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def _encode_cursor(uploaded_at, invoice_id):
+    """Opaque keyset cursor: the (uploaded_at, id) of the last row on the page."""
+    payload = json.dumps({'u': uploaded_at.isoformat(), 'i': invoice_id})
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def _decode_cursor(cursor_value):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor_value.encode('ascii')))
+        return datetime.datetime.fromisoformat(payload['u']), int(payload['i'])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+def _build_list_filters(args):
+    """Translates list query parameters into SQL conditions. Raises ValueError on malformed input."""
+    conditions, params = [], []
+    if args.get('user_id'):
+        conditions.append("user_id = %s")
+        params.append(int(args['user_id']))
+    if args.get('status'):
+        conditions.append("status = %s")
+        params.append(args['status'])
+    if args.get('vendor_name'):
+        # Prefix match so the (vendor_name, uploaded_at, id) index can still be used
+        conditions.append("vendor_name LIKE %s")
+        params.append(args['vendor_name'].replace('%', r'\%').replace('_', r'\_') + '%')
+    if args.get('date_from'):
+        conditions.append("invoice_date >= %s")
+        params.append(datetime.date.fromisoformat(args['date_from']))
+    if args.get('date_to'):
+        conditions.append("invoice_date <= %s")
+        params.append(datetime.date.fromisoformat(args['date_to']))
+    if args.get('min_amount'):
+        conditions.append("total_amount >= %s")
+        params.append(float(args['min_amount']))
+    if args.get('max_amount'):
+        conditions.append("total_amount <= %s")
+        params.append(float(args['max_amount']))
+    return conditions, params
+
 @invoice_bp.route('/', methods=['GET'])
 def list_invoices():
-    # Add user_id filtering in a real app
-    # user_id = ... 
+    """
+    Lists invoices newest first using keyset pagination on (uploaded_at, id).
+    Query parameters: limit, cursor (the next_cursor of the previous page), user_id, status,
+    vendor_name (prefix), date_from / date_to (invoice_date, YYYY-MM-DD), min_amount / max_amount,
+    fields (comma separated; id is always included).
+    Supports If-None-Match / If-Modified-Since (validated by the invoices version, see services/response_cache.py).
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        fields = _parse_fields(request.args, LIST_DEFAULT_FIELDS, INVOICE_COLUMNS)
+        conditions, params = _build_list_filters(request.args)
+        if request.args.get('cursor'):
+            cursor_uploaded_at, cursor_id = _decode_cursor(request.args['cursor'])
+            conditions.append("(uploaded_at < %s OR (uploaded_at = %s AND id < %s))")
+            params.extend([cursor_uploaded_at, cursor_uploaded_at, cursor_id])
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {str(e)}'}), 400
+
     conn = db.get_db()
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        version, last_modified = response_cache.current_version(conn)
+    except Exception as e:
+        current_app.logger.error(f"Error reading the invoices cache version: {e}")
+        return jsonify({'error': f'Could not list invoices: {str(e)}'}), 500
+    query = sorted((key, value) for key, value in request.args.items(multi=True) if key != 'fields')
+    etag = response_cache.make_etag('invoices', version, query, ','.join(fields))
+    not_modified = response_cache.not_modified(etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+    cache_key = ('invoices', version, tuple(query), fields)
+    body = response_cache.get_cache().get(cache_key) if response_cache.is_enabled() else None
+    if body is not None:
+        return response_cache.json_response(body, etag, last_modified)
+
     cursor = conn.cursor(dictionary=True)
     try:
-        # Add pagination later
-        cursor.execute("SELECT id, user_id, file_name, uploaded_at, status, total_amount, vendor_name, invoice_date FROM invoices ORDER BY uploaded_at DESC LIMIT 100")
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        # id and uploaded_at are needed for the next page's cursor
+        columns = ['id', 'uploaded_at'] + [column for column in fields if column not in ('id', 'uploaded_at')]
+        # Fetch one extra row to know whether there is a next page
+        cursor.execute(
+            f"SELECT {', '.join(columns)} "
+            f"FROM invoices {where_clause} ORDER BY uploaded_at DESC, id DESC LIMIT %s",
+            (*params, limit + 1)
+        )
         invoices = cursor.fetchall()
+        next_cursor = None
+        if len(invoices) > limit:
+            invoices = invoices[:limit]
+            next_cursor = _encode_cursor(invoices[-1]['uploaded_at'], invoices[-1]['id'])
+
         for invoice in invoices:
-            if invoice.get('uploaded_at'):
-                invoice['uploaded_at'] = invoice['uploaded_at'].isoformat()
-            if invoice.get('invoice_date') and isinstance(invoice['invoice_date'], datetime.date):
-                 invoice['invoice_date'] = invoice['invoice_date'].isoformat()
+            if 'uploaded_at' not in fields:
+                del invoice['uploaded_at']
+            _isoformat_dates(invoice)
 
-        return jsonify(invoices), 200
+        body = current_app.json.dumps({'invoices': invoices, 'next_cursor': next_cursor}).encode('utf-8')
+        if response_cache.is_enabled():
+            response_cache.get_cache().set(cache_key, body)
+        return response_cache.json_response(body, etag, last_modified)
     except Exception as e:
         current_app.logger.error(f"Error listing invoices: {e}")
         return jsonify({'error': f'Could not list invoices: {str(e)}'}), 500
     finally:
         cursor.close()
 
-# You would add more routes here for updating, deleting invoices, etc. 
\ No newline at end of file
+# Exports leave out the storage path and raw_text unless asked for
+EXPORT_DEFAULT_FIELDS = tuple(column for column in INVOICE_COLUMNS if column not in ('original_file_path', 'raw_text'))
+
+@invoice_bp.route('/export', methods=['GET'])
+def export_invoices():
+    """
+    Streams every invoice matching the list filters, oldest first, without paging (see services/invoice_export.py).
+    Query parameters: format (csv, ndjson or parquet; default csv), dataset (invoices, with their
+    invoice_fields, or line_items; default invoices), fields (comma separated invoice columns; id is
+    always included) and the filters of the list endpoint.
+    """
+    config = current_app.config
+    try:
+        export_format = request.args.get('format', 'csv').lower()
+        dataset = request.args.get('dataset', 'invoices')
+        invoice_export.check(dataset, export_format)
+        fields = _parse_fields(request.args, EXPORT_DEFAULT_FIELDS, INVOICE_COLUMNS)
+        conditions, params = _build_list_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {str(e)}'}), 400
+    if export_format == 'parquet' and not invoice_export.parquet_available():
+        return jsonify({'error': 'Parquet export requires the pyarrow package.'}), 501
+
+    conn = db.get_db()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    columns = ('id',) + tuple(column for column in fields if column != 'id')
+    try:
+        cursor = invoice_export.open_cursor(conn, dataset, columns, conditions, params,
+                                            net_write_timeout=config.get('EXPORT_NET_WRITE_TIMEOUT_SECONDS', 600))
+    except Exception as e:
+        current_app.logger.error(f"Error starting invoice export: {e}")
+        return jsonify({'error': f'Could not export invoices: {str(e)}'}), 500
+
+    chunk_rows = config.get('EXPORT_CHUNK_ROWS', 1000)
+    row_group_rows = config.get('EXPORT_PARQUET_ROW_GROUP_ROWS', 10000)
+
+    def generate():
+        completed = False
+        try:
+            records = yield from invoice_export.iter_export(cursor, dataset, export_format, columns,
+                                                            chunk_rows=chunk_rows, row_group_rows=row_group_rows)
+            completed = True
+            current_app.logger.info(f"Exported {records} {dataset} records as {export_format}.")
+        except Exception as e:
+            # The status line was sent long ago; dropping the connection tells the client the file is incomplete
+            current_app.logger.error(f"Invoice export failed while streaming: {e}", exc_info=True)
+            raise
+        finally:
+            if not completed:
+                # Rows left unread on the connection; it can't go back to the pool
+                db.discard_db()
+
+    content_type, extension = invoice_export.FORMATS[export_format]
+    filename = f"{dataset}-{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.{extension}"
+    response = Response(stream_with_context(generate()), content_type=content_type)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no' # Don't let nginx buffer the whole file
+    return response
+
+DEFAULT_SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 50
+MAX_SEARCH_OFFSET = 1000 # Relevance pages are computed in full by MySQL; deeper pages cost more than they're worth
+
+@invoice_bp.route('/search', methods=['GET'])
+def search_invoices():
+    """
+    Full-text search over raw_text, vendor_name, invoice_number and line item descriptions,
+    best match first, with a highlighted snippet per invoice (see services/invoice_search.py).
+    Query parameters: q, limit, cursor (the next_cursor of the previous page) and the filters of the list endpoint.
+    """
+    terms = invoice_search.parse_query(request.args.get('q', ''))
+    if not terms:
+        return jsonify({'error': f'Query must contain a word of at least {invoice_search.MIN_TOKEN_SIZE} characters'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', DEFAULT_SEARCH_PAGE_SIZE)), 1), MAX_SEARCH_PAGE_SIZE)
+        offset = 0
+        if request.args.get('cursor'):
+            offset = int(json.loads(base64.urlsafe_b64decode(request.args['cursor'].encode('ascii')))['o'])
+        if not 0 <= offset <= MAX_SEARCH_OFFSET:
+            raise ValueError('cursor out of range')
+        conditions, params = _build_list_filters(request.args)
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify({'error': f'Invalid query parameter: {str(e)}'}), 400
+
+    conn = db.get_db()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        invoices, has_more = invoice_search.search(conn, terms, conditions, params, limit=limit, offset=offset)
+    except Exception as e:
+        current_app.logger.error(f"Error searching invoices for '{request.args.get('q')}': {e}")
+        return jsonify({'error': f'Could not search invoices: {str(e)}'}), 500
+
+    for invoice in invoices:
+        _isoformat_dates(invoice)
+    next_cursor = None
+    if has_more and offset + limit <= MAX_SEARCH_OFFSET:
+        next_cursor = base64.urlsafe_b64encode(json.dumps({'o': offset + limit}).encode('utf-8')).decode('ascii')
+    return jsonify({'invoices': invoices, 'next_cursor': next_cursor}), 200
+
+@invoice_bp.route('/events', methods=['GET'])
+def invoice_events_stream():
+    """
+    Server-sent events: one 'invoice' event per status transition ({id, invoice_id, user_id, status,
+    summary, at}; summary holds the extracted fields of 'processed' invoices), ': heartbeat' comments
+    in between. Query parameters: user_id, last_event_id (the Last-Event-ID header takes precedence).
+    Missed events are replayed on reconnect; if too many were missed a 'reset' event tells the
+    client to reload the list instead.
+    """
+    config = current_app.config
+    try:
+        user_id = int(request.args['user_id']) if request.args.get('user_id') else None
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {str(e)}'}), 400
+
+    broker = invoice_events.get_broker()
+    try:
+        subscriber = broker.subscribe(max_queued=config.get('EVENTS_SUBSCRIBER_QUEUE', 1000), user_id=user_id)
+    except invoice_events.TooManySubscribers as e:
+        current_app.logger.warning(f"Rejected an invoice events subscriber: {e}")
+        response = jsonify({'error': 'Too many open event streams, retry later'})
+        response.headers['Retry-After'] = str(config.get('EVENTS_RETRY_MS', 3000) // 1000 or 1)
+        return response, 503
+
+    replayed, reset = [], False
+    if last_event_id is not None:
+        # Subscribed first, so nothing committed from here on is missed; duplicates are skipped below
+        subscriber.ready.wait(5)
+        conn = db.get_db()
+        try:
+            if not conn:
+                raise RuntimeError('Database connection failed')
+            replayed, reset = invoice_events.replay(conn, last_event_id, config.get('EVENTS_REPLAY_LIMIT', 500))
+        except Exception as e:
+            broker.unsubscribe(subscriber)
+            current_app.logger.error(f"Error replaying invoice events after {last_event_id}: {e}")
+            return jsonify({'error': f'Could not replay events: {str(e)}'}), 500
+        finally:
+            # The stream must not hold a pooled connection for its whole lifetime
+            db.close_db()
+        if user_id is not None:
+            replayed = [event for event in replayed if event['user_id'] == user_id]
+
+    heartbeat_seconds = config.get('EVENTS_HEARTBEAT_SECONDS', 15)
+    retry_ms = config.get('EVENTS_RETRY_MS', 3000)
+
+    def generate():
+        try:
+            yield invoice_events.format_sse(comment='connected', retry_ms=retry_ms)
+            if reset:
+                yield invoice_events.format_sse({'reason': 'too many missed events'}, event_type='reset')
+            seen = {event['id'] for event in replayed}
+            newest = last_event_id or 0
+            for event in replayed:
+                newest = max(newest, event['id'])
+                yield invoice_events.format_sse(event)
+            while not subscriber.closed.is_set():
+                try:
+                    event = subscriber.queue.get(timeout=heartbeat_seconds)
+                except queue.Empty:
+                    yield invoice_events.format_sse(comment=f"heartbeat {int(time.time())}")
+                    continue
+                if event is None or event['id'] in seen:
+                    continue
+                if event['id'] < newest:
+                    # Committed after a newer event was sent: don't move the client's Last-Event-ID back
+                    yield invoice_events.format_sse(event, set_id=False)
+                    continue
+                newest = event['id']
+                yield invoice_events.format_sse(event)
+        finally:
+            broker.unsubscribe(subscriber)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # Don't let nginx buffer the stream
+    return response
+
+# You would add more routes here for updating invoices, etc. 
\ No newline at end of file
@@ -7,10 +7,20 @@ CREATE TABLE IF NOT EXISTS users (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Batch uploads (POST /api/invoices/batch). Each invoice of a batch references its batch
+CREATE TABLE IF NOT EXISTS invoice_batches (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT,
+    total_items INT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
+);
+
 -- Invoices Table
 CREATE TABLE IF NOT EXISTS invoices (
     id INT AUTO_INCREMENT PRIMARY KEY,
     user_id INT,
+    batch_id INT NULL, -- Set for invoices uploaded through a batch
     file_name VARCHAR(255) NOT NULL,
     original_file_path VARCHAR(512),
     status VARCHAR(50) DEFAULT 'uploaded',
@@ -22,7 +32,10 @@ CREATE TABLE IF NOT EXISTS invoices (
     invoice_date DATE NULL,
     total_amount DECIMAL(15, 2) NULL, -- Increased precision for amount
     currency VARCHAR(10) NULL, -- To store currency code like 'INR', 'USD' or symbol '₹', '$'
-    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL -- Or ON DELETE CASCADE if invoices should be deleted with user
+    line_items_text TEXT NULL, -- Line item descriptions, one per line, for full-text search
+    updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6), -- ETag / Last-Modified of GET /api/invoices/<id>
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL, -- Or ON DELETE CASCADE if invoices should be deleted with user
+    FOREIGN KEY (batch_id) REFERENCES invoice_batches(id) ON DELETE SET NULL
 );
 
 -- Extracted Invoice Fields Table
@@ -36,8 +49,73 @@ CREATE TABLE IF NOT EXISTS invoice_fields (
     FOREIGN KEY (invoice_id) REFERENCES invoices(id) ON DELETE CASCADE
 );
 
+-- Typed line items (see services/line_items.py). They used to be line_item_<n>_<column> rows in invoice_fields.
+-- The primary key keeps an invoice's line items in one clustered index range.
+CREATE TABLE IF NOT EXISTS invoice_line_items (
+    invoice_id INT NOT NULL,
+    line_index INT NOT NULL,            -- 1-based position on the invoice
+    description TEXT NULL,
+    quantity DECIMAL(15, 3) NULL,
+    unit_price DECIMAL(15, 4) NULL,
+    item_total DECIMAL(15, 2) NULL,
+    PRIMARY KEY (invoice_id, line_index),
+    FOREIGN KEY (invoice_id) REFERENCES invoices(id) ON DELETE CASCADE
+);
+
+-- Spend totals of processed invoices per vendor / month / currency / user (see services/spend_rollups.py),
+-- updated in the same transaction as the invoice so dashboards don't GROUP BY over invoices
+CREATE TABLE IF NOT EXISTS invoice_spend_rollups (
+    dimension VARCHAR(16) NOT NULL,          -- 'vendor', 'month', 'currency' or 'user'
+    dimension_key VARCHAR(255) NOT NULL,     -- vendor_name, 'YYYY-MM' of invoice_date, currency or user_id ('' when unknown)
+    currency VARCHAR(10) NOT NULL,           -- '' when unknown
+    invoice_count INT NOT NULL DEFAULT 0,
+    total_amount DECIMAL(19, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (dimension, dimension_key, currency)
+);
+
+-- Invoice status transitions for the server-sent events stream (see services/invoice_events.py),
+-- written in the same transaction as the change. The id is the SSE event id (Last-Event-ID). No foreign key:
+-- 'deleted' events outlive their invoice. Rows older than EVENTS_RETENTION_HOURS are pruned.
+CREATE TABLE IF NOT EXISTS invoice_events (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    invoice_id INT NOT NULL,
+    user_id INT NULL,
+    status VARCHAR(50) NOT NULL,
+    summary TEXT NULL,                       -- JSON: extracted vendor / number / date / total / currency of 'processed' events
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_invoice_events_created_at (created_at)
+);
+
+-- Versions of cached read responses (see services/response_cache.py). Every write to invoices bumps 'invoices'
+CREATE TABLE IF NOT EXISTS cache_versions (
+    name VARCHAR(64) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)
+);
+
+-- Content-addressed cache of OCR text and Gemini extraction results (see services/result_cache.py)
+CREATE TABLE IF NOT EXISTS processing_cache (
+    cache_namespace VARCHAR(32) NOT NULL,    -- 'ocr' (keyed by file SHA-256) or 'extraction' (keyed by prompt version + normalized OCR text)
+    cache_key CHAR(64) NOT NULL,             -- hex SHA-256
+    cache_value MEDIUMTEXT NOT NULL,         -- JSON encoded value
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (cache_namespace, cache_key)
+);
+
 -- Index for faster lookups
 CREATE INDEX IF NOT EXISTS idx_invoices_user_id ON invoices(user_id);
 CREATE INDEX IF NOT EXISTS idx_invoices_status ON invoices(status);
+CREATE INDEX IF NOT EXISTS idx_invoices_batch_id ON invoices(batch_id);
 CREATE INDEX IF NOT EXISTS idx_invoice_fields_invoice_id ON invoice_fields(invoice_id);
-CREATE INDEX IF NOT EXISTS idx_invoice_fields_field_name ON invoice_fields(field_name); 
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_invoice_fields_field_name ON invoice_fields(field_name);
+
+-- Keyset pagination of the invoice list on (uploaded_at, id), optionally filtered.
+-- Each index matches one list query shape so a page fetch reads only about `limit` index entries.
+CREATE INDEX IF NOT EXISTS idx_invoices_uploaded_at_id ON invoices(uploaded_at, id, status, user_id, invoice_date, total_amount);
+CREATE INDEX IF NOT EXISTS idx_invoices_user_uploaded_at_id ON invoices(user_id, uploaded_at, id);
+CREATE INDEX IF NOT EXISTS idx_invoices_status_uploaded_at_id ON invoices(status, uploaded_at, id);
+CREATE INDEX IF NOT EXISTS idx_invoices_vendor_uploaded_at_id ON invoices(vendor_name, uploaded_at, id);
+
+-- Full-text search (services/invoice_search.py). The second index ranks vendor / invoice number matches higher
+CREATE FULLTEXT INDEX IF NOT EXISTS ftx_invoices_search ON invoices(vendor_name, invoice_number, line_items_text, raw_text);
+CREATE FULLTEXT INDEX IF NOT EXISTS ftx_invoices_search_ids ON invoices(vendor_name, invoice_number);
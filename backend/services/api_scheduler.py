@@ -0,0 +1,250 @@
+"""
+Shared scheduler for outbound Gemini and Vision API calls.
+
+Every call to a Google API goes through the APIScheduler for that API, which:
+    - admits calls through token buckets for requests/minute and (Gemini) tokens/minute,
+    - caps the number of calls in flight,
+    - retries retryable errors (429/ResourceExhausted, 500, 503, 504) with exponential
+      backoff and full jitter; a 429 also pauses admission for every caller of that
+      API, so one throttled request slows the whole process down instead of each
+      thread discovering the quota on its own,
+    - admits waiting calls in priority order: the 'interactive' lane (single uploads)
+      always goes before the 'bulk' lane (batch uploads).
+
+The lane of a call comes from the current context, set with `with lane(BULK): ...`.
+Limits are per process: with several gunicorn workers (or `flask run-workers`)
+divide the project quota between them.
+"""
+import contextvars
+import heapq
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+LANES = (INTERACTIVE, BULK) # In priority order
+
+# HTTP status codes (google.api_core exceptions expose them as `.code`) worth retrying
+RETRYABLE_CODES = {429, 500, 503, 504}
+RETRYABLE_ERRORS = {'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable', 'DeadlineExceeded', 'InternalServerError'}
+
+_lane = contextvars.ContextVar('api_lane', default=INTERACTIVE)
+
+
+@contextmanager
+def lane(name):
+    """Runs the block's API calls in the given lane (INTERACTIVE or BULK)."""
+    if name not in LANES:
+        raise ValueError(f"Unknown API lane: {name}")
+    token = _lane.set(name)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def current_lane():
+    return _lane.get()
+
+
+def is_rate_limited(error):
+    return getattr(error, 'code', None) == 429 or type(error).__name__ in ('ResourceExhausted', 'TooManyRequests')
+
+
+def is_retryable(error):
+    return getattr(error, 'code', None) in RETRYABLE_CODES or type(error).__name__ in RETRYABLE_ERRORS
+
+
+class TokenBucket:
+    """
+    Refills at `per_minute` units per minute up to `capacity`. A single take larger
+    than the capacity is admitted once the bucket is full and leaves it in debt.
+    Not thread-safe on its own; APIScheduler guards it with its lock.
+    """
+
+    def __init__(self, per_minute, capacity, clock=time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, float(capacity))
+        self.level = self.capacity
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` units can be taken (0 if they can be taken now)."""
+        self._refill()
+        needed = min(amount, self.capacity)
+        return 0.0 if self.level >= needed else (needed - self.level) / self.rate
+
+    def take(self, amount):
+        self._refill()
+        self.level -= amount
+
+
+class APIScheduler:
+    """Rate limiting, concurrency cap, retries and priority lanes for one API (see the module docstring)."""
+
+    def __init__(self, name, requests_per_minute=0, tokens_per_minute=0, max_in_flight=4, burst_seconds=10,
+                 max_attempts=5, backoff_base_seconds=1.0, backoff_max_seconds=30.0, retry_deadline_seconds=0,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.name = name
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_attempts = max(1, int(max_attempts))
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.retry_deadline_seconds = retry_deadline_seconds
+        self._clock = clock
+        self._sleep = sleep
+        # Buckets start full with `burst_seconds` worth of quota; 0 per minute disables a limit
+        self._requests = (TokenBucket(requests_per_minute, requests_per_minute * burst_seconds / 60.0, clock)
+                          if requests_per_minute else None)
+        self._tokens = (TokenBucket(tokens_per_minute, tokens_per_minute * burst_seconds / 60.0, clock)
+                        if tokens_per_minute else None)
+        self._cond = threading.Condition()
+        self._waiting = [] # Heap of (lane priority, arrival order) tickets
+        self._arrivals = itertools.count()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._stats = {'calls': 0, 'retries': 0, 'rate_limited': 0, 'failures': 0,
+                       'wait_seconds': {name: 0.0 for name in LANES}, 'admitted': {name: 0 for name in LANES}}
+
+    def _admission_wait(self, units, tokens):
+        """Seconds until the head of the queue may start (0 = now). Caller holds the lock."""
+        wait = self._paused_until - self._clock()
+        if self._requests is not None:
+            wait = max(wait, self._requests.wait_time(units))
+        if self._tokens is not None and tokens:
+            wait = max(wait, self._tokens.wait_time(tokens))
+        return max(0.0, wait)
+
+    def _acquire(self, lane_name, units, tokens):
+        ticket = (LANES.index(lane_name), next(self._arrivals))
+        started = self._clock()
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            self._cond.notify_all() # A higher-priority arrival takes over as head
+            try:
+                while True:
+                    if self._waiting[0] != ticket or self._in_flight >= self.max_in_flight:
+                        self._cond.wait()
+                        continue
+                    wait = self._admission_wait(units, tokens)
+                    if wait > 0:
+                        self._cond.wait(wait)
+                        continue
+                    if self._requests is not None:
+                        self._requests.take(units)
+                    if self._tokens is not None and tokens:
+                        self._tokens.take(tokens)
+                    heapq.heappop(self._waiting)
+                    self._in_flight += 1
+                    self._stats['wait_seconds'][lane_name] += self._clock() - started
+                    self._stats['admitted'][lane_name] += 1
+                    self._cond.notify_all()
+                    return
+            except BaseException:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                raise
+
+    def _release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _backoff(self, attempt):
+        # Full jitter: spreads retries of callers that were throttled at the same moment
+        return random.uniform(0, min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** (attempt - 1)))
+
+    def call(self, fn, units=1, tokens=0):
+        """
+        Runs fn() once admitted, retrying retryable errors. `units` counts against the
+        requests/minute limit (e.g. the number of images in a Vision batch request) and
+        `tokens` against the tokens/minute limit.
+        """
+        lane_name = _lane.get()
+        deadline = self._clock() + self.retry_deadline_seconds if self.retry_deadline_seconds else None
+        attempt = 0
+        while True:
+            attempt += 1
+            self._acquire(lane_name, units, tokens)
+            try:
+                with self._cond:
+                    self._stats['calls'] += 1
+                return fn()
+            except Exception as e:
+                delay = self._backoff(attempt)
+                out_of_time = deadline is not None and self._clock() + delay > deadline
+                with self._cond:
+                    if is_rate_limited(e):
+                        self._stats['rate_limited'] += 1
+                        # Hold back every caller of this API, not just this one
+                        self._paused_until = max(self._paused_until, self._clock() + delay)
+                    if not is_retryable(e) or attempt >= self.max_attempts or out_of_time:
+                        self._stats['failures'] += 1
+                        raise
+                    self._stats['retries'] += 1
+                current_app.logger.warning(
+                    f"{self.name} API call failed ({type(e).__name__}: {e}); retry {attempt}/{self.max_attempts - 1} in {delay:.1f}s")
+            finally:
+                self._release()
+            self._sleep(delay)
+
+    def stats(self):
+        with self._cond:
+            stats = {key: (dict(value) if isinstance(value, dict) else value) for key, value in self._stats.items()}
+            stats['in_flight'] = self._in_flight
+            stats['queued'] = len(self._waiting)
+        return stats
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(api):
+    """Returns this process's scheduler for 'gemini' or 'vision', created from the app config on first use."""
+    scheduler = _schedulers.get(api)
+    if scheduler is None:
+        with _schedulers_lock:
+            scheduler = _schedulers.get(api)
+            if scheduler is None:
+                config = current_app.config
+                prefix = api.upper()
+                scheduler = APIScheduler(
+                    api,
+                    requests_per_minute=config.get(f'{prefix}_REQUESTS_PER_MINUTE', 0),
+                    tokens_per_minute=config.get(f'{prefix}_TOKENS_PER_MINUTE', 0),
+                    max_in_flight=config.get(f'{prefix}_MAX_IN_FLIGHT', 4),
+                    burst_seconds=config.get('API_BURST_SECONDS', 10),
+                    max_attempts=config.get('API_MAX_ATTEMPTS', 5),
+                    backoff_base_seconds=config.get('API_BACKOFF_BASE_SECONDS', 1.0),
+                    backoff_max_seconds=config.get('API_BACKOFF_MAX_SECONDS', 30.0),
+                    retry_deadline_seconds=config.get(f'{prefix}_RETRY_DEADLINE_SECONDS', 0),
+                )
+                _schedulers[api] = scheduler
+    return scheduler
+
+
+def set_scheduler(api, scheduler):
+    """Installs a specific scheduler (or None to rebuild from config on next use). Meant for tests/benchmarks."""
+    with _schedulers_lock:
+        if scheduler is None:
+            _schedulers.pop(api, None)
+        else:
+            _schedulers[api] = scheduler
+
+
+def get_all_stats():
+    return {api: scheduler.stats() for api, scheduler in list(_schedulers.items())}
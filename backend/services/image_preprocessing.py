@@ -0,0 +1,297 @@
+"""
+Shrinks invoice images before they are sent to OCR.
+
+Phone photos and 600 dpi scans are often several megabytes, and the OCR request (upload,
+then decode on the service side) grows with them while the text doesn't need that many
+pixels. preprocess_image() does the following, in a process pool so that the decoding
+doesn't hold the GIL of a web or worker process:
+
+    1. applies the EXIF orientation, so the text is upright
+    2. converts to grayscale (JPEGs are decoded at a reduced scale straight into grayscale)
+    3. crops to the document: the paper when it was photographed on a darker background,
+       otherwise the printed area of a scan, keeping a margin
+    4. downscales to the target DPI (scans), and the document to at most a maximum long edge
+    5. re-encodes as JPEG or PNG
+
+The original bytes are kept whenever the result would not be smaller, or when the image
+can't be decoded. Results are cached in memory by the SHA-256 of the original bytes
+and the options, so retries and re-processing of the same upload don't decode it again.
+
+This module does not depend on Flask so that it can run inside pool workers.
+"""
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageFilter, ImageOps
+
+Options = namedtuple('Options', 'max_long_edge target_dpi crop output_format jpeg_quality')
+
+DEFAULT_OPTIONS = Options(max_long_edge=2400, target_dpi=300, crop=True, output_format='JPEG', jpeg_quality=85)
+
+# Size of the thumbnail the document bounds are searched in, and the margin kept around them
+_ANALYSIS_SIZE = 256
+_CROP_MARGIN = 0.02
+_EXIF_ORIENTATION = 0x0112
+_DRAFT_HEADROOM = 1.5
+# Only crop when at least this much of the image is removed
+_MIN_CROP_SAVING = 0.1
+
+
+def _otsu_threshold(histogram):
+    """Gray level separating the two classes of a 256-bin histogram with the largest between-class variance."""
+    total = sum(histogram)
+    weighted_total = sum(level * count for level, count in enumerate(histogram))
+    background, background_sum = 0, 0
+    best_threshold, best_variance = 127, -1.0
+    for level, count in enumerate(histogram):
+        background += count
+        if background == 0:
+            continue
+        foreground = total - background
+        if foreground == 0:
+            break
+        background_sum += level * count
+        mean_background = background_sum / background
+        mean_foreground = (weighted_total - background_sum) / foreground
+        variance = background * foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = level, variance
+    return best_threshold
+
+
+def _document_bbox(gray):
+    """
+    (left, upper, right, lower) of the document in `gray`, or None if cropping wouldn't help.
+    The paper is the bright region; when it fills the whole frame (a scan) the bounds of
+    the dark, printed pixels are used instead.
+    """
+    small = gray.copy()
+    small.thumbnail((_ANALYSIS_SIZE, _ANALYSIS_SIZE))
+    small = ImageOps.autocontrast(small, cutoff=1)
+    threshold = _otsu_threshold(small.histogram())
+    # Min/median filters drop specks (glare, dust, noise) that would stretch the bounds
+    paper = small.point(lambda v: 255 if v > threshold else 0).filter(ImageFilter.MinFilter(5))
+    bbox = paper.getbbox()
+    if bbox is None:
+        return None
+    area = small.width * small.height
+    if (bbox[2] - bbox[0]) * (bbox[3] - bbox[1]) > area * (1 - _MIN_CROP_SAVING):
+        ink = small.point(lambda v: 255 if v <= threshold else 0).filter(ImageFilter.MedianFilter(3))
+        bbox = ink.getbbox()
+        if bbox is None:
+            return None
+
+    scale_x, scale_y = gray.width / small.width, gray.height / small.height
+    margin = int(max(gray.width, gray.height) * _CROP_MARGIN)
+    left = max(0, int(bbox[0] * scale_x) - margin)
+    upper = max(0, int(bbox[1] * scale_y) - margin)
+    right = min(gray.width, int(bbox[2] * scale_x) + margin)
+    lower = min(gray.height, int(bbox[3] * scale_y) + margin)
+    if (right - left) * (lower - upper) > gray.width * gray.height * (1 - _MIN_CROP_SAVING):
+        return None
+    return left, upper, right, lower
+
+
+def _dpi_scale(image, options):
+    """Factor that brings an image with a known DPI (scans) down to the target DPI."""
+    dpi = image.info.get('dpi')
+    if dpi and dpi[0] and options.target_dpi:
+        return min(1.0, options.target_dpi / float(dpi[0]))
+    return 1.0
+
+
+def preprocess_image(source, options=DEFAULT_OPTIONS):
+    """
+    Pool worker: `source` is a file path or the encoded image bytes. Returns (image_bytes, info);
+    image_bytes is None when the original should be sent as-is (it is already smaller, or
+    it can't be decoded), and info describes what was done.
+    """
+    original_bytes = os.path.getsize(source) if isinstance(source, str) else len(source)
+    info = {'original_bytes': original_bytes, 'output_bytes': original_bytes}
+    try:
+        image = Image.open(source if isinstance(source, str) else io.BytesIO(source))
+        info['original_size'] = image.size
+        original_long_edge = max(image.size)
+        dpi_scale = _dpi_scale(image, options)
+        # JPEGs decode at 1/2, 1/4 or 1/8 scale directly into grayscale, skipping most of the work.
+        # The frame is kept large enough for a document filling two thirds of it to reach max_long_edge.
+        draft_scale = min(dpi_scale, _DRAFT_HEADROOM * options.max_long_edge / original_long_edge)
+        image.draft('L', (int(image.width * draft_scale), int(image.height * draft_scale)))
+        decoded_scale = max(image.size) / original_long_edge
+        info['rotated'] = image.getexif().get(_EXIF_ORIENTATION, 1) != 1
+        image = ImageOps.exif_transpose(image)
+        gray = image.convert('L')
+
+        bbox = _document_bbox(gray) if options.crop else None
+        if bbox:
+            gray = gray.crop(bbox)
+        info['cropped'] = bbox is not None
+        target = min(options.max_long_edge, int(max(gray.size) / decoded_scale * dpi_scale))
+        if max(gray.size) > target:
+            gray.thumbnail((target, target), Image.LANCZOS)
+        info['output_size'] = gray.size
+
+        buffer = io.BytesIO()
+        if options.output_format.upper() == 'PNG':
+            gray.save(buffer, format='PNG', optimize=True)
+        else:
+            gray.save(buffer, format='JPEG', quality=options.jpeg_quality, optimize=True)
+    except Exception as e:
+        info['error'] = str(e)
+        return None, info
+
+    if buffer.tell() >= original_bytes:
+        return None, info
+    info['output_bytes'] = buffer.tell()
+    return buffer.getvalue(), info
+
+
+class _ByteLRU:
+    """
+    LRU of preprocessed images bounded by their total size in bytes. Every entry is also charged
+    ENTRY_OVERHEAD_BYTES (key, info dict), so results without image bytes (originals kept) still count.
+    """
+    ENTRY_OVERHEAD_BYTES = 1024
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _size(self, value):
+        return len(value[0] or b'') + self.ENTRY_OVERHEAD_BYTES
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        size = self._size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._size(self._entries.pop(key))
+            self._entries[key] = value
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= self._size(evicted)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class Preprocessor:
+    """Runs preprocess_image() in a process pool, caching results by content hash, with counters."""
+
+    def __init__(self, options=DEFAULT_OPTIONS, workers=2, min_bytes=256 * 1024, cache_max_bytes=64 * 1024 * 1024):
+        self.options = options
+        self.workers = workers
+        self.min_bytes = min_bytes
+        self._cache = _ByteLRU(cache_max_bytes)
+        self._stats = {'images': 0, 'preprocessed': 0, 'kept_original': 0, 'skipped_small': 0, 'cache_hits': 0,
+                       'errors': 0, 'bytes_in': 0, 'bytes_out': 0}
+        self._stats_lock = threading.Lock()
+
+    def _cache_key(self, sha256):
+        return hashlib.sha256(f"{sha256}:{tuple(self.options)}".encode()).hexdigest()
+
+    def _count(self, info, outcome):
+        with self._stats_lock:
+            self._stats['images'] += 1
+            self._stats[outcome] += 1
+            self._stats['bytes_in'] += info['original_bytes']
+            self._stats['bytes_out'] += info['output_bytes']
+
+    def preprocess_many(self, sources, sha256s=None):
+        """
+        Preprocesses file paths or encoded images concurrently. Returns one (image_bytes, info)
+        per source, in order; image_bytes is None when the original should be sent.
+        """
+        sha256s = sha256s or [None] * len(sources)
+        results, pending = [None] * len(sources), []
+        for i, (source, sha256) in enumerate(zip(sources, sha256s)):
+            size = os.path.getsize(source) if isinstance(source, str) else len(source)
+            if size < self.min_bytes:
+                info = {'original_bytes': size, 'output_bytes': size}
+                self._count(info, 'skipped_small')
+                results[i] = (None, info)
+                continue
+            if sha256 is None:
+                sha256 = _sha256(source)
+            key = self._cache_key(sha256)
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._count(cached[1], 'cache_hits')
+                results[i] = cached
+                continue
+            # The worker reads files itself; only in-memory images are sent over the pipe
+            pending.append((i, key, source if isinstance(source, str) else bytes(source)))
+
+        if pending:
+            executor = _get_executor(self.workers)
+            futures = [(i, key, executor.submit(preprocess_image, source, self.options)) for i, key, source in pending]
+            for i, key, future in futures:
+                image_bytes, info = results[i] = future.result()
+                if 'error' in info:
+                    self._count(info, 'errors')
+                    continue
+                self._count(info, 'preprocessed' if image_bytes is not None else 'kept_original')
+                self._cache.set(key, results[i])
+        return results
+
+    def preprocess(self, source, sha256=None):
+        return self.preprocess_many([source], [sha256])[0]
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['cache_entries'] = len(self._cache)
+        stats['bytes_saved'] = stats['bytes_in'] - stats['bytes_out']
+        return stats
+
+
+def _sha256(source):
+    if isinstance(source, str):
+        digest = hashlib.sha256()
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    return hashlib.sha256(source).hexdigest()
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(workers):
+    """Returns this process's pool, recreating it after a fork or when the worker count changed."""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid() or _executor._max_workers != workers:
+            if _executor is not None and _executor_pid == os.getpid():
+                _executor.shutdown(wait=False)
+            # 'spawn' avoids forking a process that is already running request/worker threads
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None and _executor_pid == os.getpid():
+            _executor.shutdown(wait=True)
+        _executor = None
@@ -0,0 +1,260 @@
+"""
+Invoice status events for GET /api/invoices/events (server-sent events).
+
+Every status transition of an invoice (uploaded, processing, processed, error, deleted) is
+recorded in invoice_events by record() in the same transaction as the change, so events are
+never announced for a write that rolled back, and transitions made by a separate worker
+process (`flask run-workers`) reach every web process. A 'processed' event carries the
+extracted summary (vendor, invoice number, date, total, currency).
+
+Each web process runs one EventBroker thread while it has subscribers: it reads new rows
+with a single indexed range query per EVENTS_POLL_SECONDS and fans them out to the
+subscribers' queues, so open tabs don't add database load. Event ids are the row ids, so a
+reconnecting EventSource sends Last-Event-ID and replay() returns what it missed. Ids are
+assigned at INSERT but become visible at COMMIT, so a row can appear after a higher id was
+already delivered; the broker keeps such gaps for EVENTS_GAP_SECONDS and re-reads them.
+
+A subscriber whose queue fills up (a stalled client) is disconnected rather than slowing the
+fan-out down; its EventSource reconnects and catches up through Last-Event-ID.
+"""
+import datetime
+import json
+import queue
+import threading
+import time
+
+from flask import current_app
+
+import db
+
+STATUSES = ('uploaded', 'processing', 'processed', 'error', 'deleted')
+
+_COLUMNS = "id, invoice_id, user_id, status, summary, created_at"
+
+
+def record(cursor, invoice_ids, status, summary=None):
+    """Records a status event for each of `invoice_ids` as part of the caller's transaction (call before DELETEs)."""
+    if isinstance(invoice_ids, int):
+        invoice_ids = [invoice_ids]
+    if not invoice_ids:
+        return
+    placeholders = ", ".join(["%s"] * len(invoice_ids))
+    cursor.execute(
+        f"""INSERT INTO invoice_events (invoice_id, user_id, status, summary)
+            SELECT id, user_id, %s, %s FROM invoices WHERE id IN ({placeholders}) ORDER BY id""",
+        (status, json.dumps(summary, default=str) if summary is not None else None, *invoice_ids)
+    )
+
+
+def _to_event(row):
+    event_id, invoice_id, user_id, status, summary, created_at = row
+    return {
+        'id': event_id,
+        'invoice_id': invoice_id,
+        'user_id': user_id,
+        'status': status,
+        'summary': json.loads(summary) if summary else None,
+        'at': created_at.isoformat() if isinstance(created_at, datetime.datetime) else created_at,
+    }
+
+
+def replay(conn, after_id, limit):
+    """Events after `after_id` in order, at most `limit`. Returns (events, truncated)."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT {_COLUMNS} FROM invoice_events WHERE id > %s ORDER BY id LIMIT %s", (after_id, limit + 1))
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    return [_to_event(row) for row in rows[:limit]], len(rows) > limit
+
+
+def format_sse(event=None, event_type='invoice', comment=None, retry_ms=None, set_id=True):
+    """One text/event-stream message; `set_id` makes the event's id the client's Last-Event-ID."""
+    lines = []
+    if comment is not None:
+        lines.append(f": {comment}")
+    if retry_ms is not None:
+        lines.append(f"retry: {retry_ms}")
+    if event is not None:
+        if set_id and event.get('id') is not None:
+            lines.append(f"id: {event['id']}")
+        lines.append(f"event: {event_type}")
+        lines.append(f"data: {json.dumps(event, default=str, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+
+class Subscriber:
+    def __init__(self, max_queued, user_id=None):
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.user_id = user_id
+        self.closed = threading.Event()
+        # Set once the broker has a starting position, so a replay() after it can't miss events
+        self.ready = threading.Event()
+
+    def deliver(self, event):
+        """False if the subscriber can't keep up (it gets disconnected)."""
+        if self.user_id is not None and event['user_id'] != self.user_id:
+            return True
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            return False
+
+    def close(self):
+        self.closed.set()
+        try:
+            self.queue.put_nowait(None) # Wakes the stream up
+        except queue.Full:
+            pass
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class EventBroker:
+    """One polling thread per process fanning invoice_events rows out to the SSE subscribers."""
+
+    def __init__(self, app, max_subscribers=100, poll_seconds=0.5, gap_seconds=10.0, batch_size=500,
+                 retention_hours=24):
+        self.app = app
+        self.max_subscribers = max_subscribers
+        self.poll_seconds = poll_seconds
+        self.gap_seconds = gap_seconds
+        self.batch_size = batch_size
+        self.retention_hours = retention_hours
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_id = None
+        self._gaps = {} # Skipped event id -> time it was first missed
+        self._last_pruned = 0.0
+        self._stats = {'events': 0, 'polls': 0, 'late_events': 0, 'dropped_subscribers': 0, 'rejected_subscribers': 0}
+
+    def subscribe(self, max_queued=1000, user_id=None):
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                self._stats['rejected_subscribers'] += 1
+                raise TooManySubscribers(f"{len(self._subscribers)} subscribers connected")
+            subscriber = Subscriber(max_queued, user_id)
+            self._subscribers.add(subscriber)
+            if self._last_id is not None:
+                subscriber.ready.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="invoice-events", daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+        subscriber.close()
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'subscribers': len(self._subscribers), 'last_event_id': self._last_id,
+                    'pending_gaps': len(self._gaps)}
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    # Stopped until the next subscribe(); it restarts from the newest event then
+                    self._thread = None
+                    self._last_id = None
+                    self._gaps.clear()
+                    return
+            try:
+                with self.app.app_context():
+                    self._poll()
+            except Exception as e:
+                self.app.logger.error(f"Error polling invoice events: {e}")
+            time.sleep(self.poll_seconds)
+
+    def _poll(self):
+        pool = db.get_pool()
+        conn = pool.acquire()
+        try:
+            cursor = conn.cursor()
+            try:
+                if self._last_id is None:
+                    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM invoice_events")
+                    with self._lock:
+                        self._last_id = cursor.fetchone()[0]
+                        for subscriber in self._subscribers:
+                            subscriber.ready.set()
+                    return
+                rows = []
+                if self._gaps:
+                    placeholders = ", ".join(["%s"] * len(self._gaps))
+                    cursor.execute(f"SELECT {_COLUMNS} FROM invoice_events WHERE id IN ({placeholders})", list(self._gaps))
+                    late = cursor.fetchall()
+                    self._stats['late_events'] += len(late)
+                    rows.extend(late)
+                cursor.execute(f"SELECT {_COLUMNS} FROM invoice_events WHERE id > %s ORDER BY id LIMIT %s",
+                               (self._last_id, self.batch_size))
+                rows.extend(cursor.fetchall())
+                self._prune(cursor, conn)
+            finally:
+                cursor.close()
+        finally:
+            pool.release(conn)
+        self._stats['polls'] += 1
+        self._track_gaps(rows)
+        if rows:
+            self._fan_out([_to_event(row) for row in rows])
+
+    def _track_gaps(self, rows):
+        now = time.monotonic()
+        for row in rows:
+            self._gaps.pop(row[0], None)
+        expected = self._last_id + 1
+        for event_id in sorted(row[0] for row in rows if row[0] > self._last_id):
+            for missing in range(expected, event_id):
+                self._gaps.setdefault(missing, now)
+            expected = event_id + 1
+        self._last_id = max([self._last_id] + [row[0] for row in rows])
+        # Rolled back transactions and auto-increment jumps leave ids that never show up
+        for event_id, missed_at in list(self._gaps.items()):
+            if now - missed_at > self.gap_seconds:
+                del self._gaps[event_id]
+
+    def _fan_out(self, events):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        self._stats['events'] += len(events)
+        for subscriber in subscribers:
+            if not all(subscriber.deliver(event) for event in events):
+                self._stats['dropped_subscribers'] += 1
+                self.app.logger.warning("Disconnecting a slow invoice events subscriber; it will resume with Last-Event-ID.")
+                self.unsubscribe(subscriber)
+
+    def _prune(self, cursor, conn):
+        if not self.retention_hours or time.monotonic() - self._last_pruned < 600:
+            return
+        self._last_pruned = time.monotonic()
+        cursor.execute("DELETE FROM invoice_events WHERE created_at < NOW() - INTERVAL %s HOUR LIMIT 10000",
+                       (self.retention_hours,))
+        conn.commit()
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                config = current_app.config
+                _broker = EventBroker(
+                    current_app._get_current_object(),
+                    max_subscribers=config.get('EVENTS_MAX_SUBSCRIBERS', 100),
+                    poll_seconds=config.get('EVENTS_POLL_SECONDS', 0.5),
+                    gap_seconds=config.get('EVENTS_GAP_SECONDS', 10.0),
+                    retention_hours=config.get('EVENTS_RETENTION_HOURS', 24),
+                )
+    return _broker
@@ -0,0 +1,284 @@
+"""
+Streaming bulk export of invoices (GET /api/invoices/export).
+
+The rows are read with one unbuffered (server-side) cursor and fetched `chunk_rows` at a time;
+each chunk is written out in the requested format and handed to the response before the next
+one is fetched. Memory use therefore depends on the chunk size, not on the number of rows.
+
+Datasets:
+    invoices:    one record per invoice, with its invoice_fields rows (the additional details
+                 found by the extraction) as `fields`: a JSON object column in CSV, a nested
+                 object in NDJSON, a map<string, string> column in Parquet. The fields are
+                 aggregated per invoice by MySQL (JSON_OBJECTAGG over the invoice_id index), so
+                 the invoice columns are not repeated for every field row and the JSON goes
+                 into CSV and NDJSON as it comes from the server.
+    line_items:  one record per line item (invoice_line_items), after the chosen invoice
+                 columns. Invoices not yet migrated by `flask backfill-line-items` have their
+                 line items in the `fields` of the invoices dataset instead.
+
+Formats: csv, ndjson and parquet. Parquet needs the optional pyarrow package; it is written
+one row group per `row_group_rows` records, so that (not the chunk size) bounds its memory use.
+
+An export that is abandoned halfway (client disconnected, error) leaves unread rows on the
+connection: the caller must close that connection rather than reuse it (see db.discard_db).
+
+This module does not depend on Flask.
+"""
+import csv
+import datetime
+import io
+import json
+from decimal import Decimal
+
+# format -> (content type, file extension)
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+DATASETS = ('invoices', 'line_items')
+LINE_ITEM_COLUMNS = ('line_index', 'description', 'quantity', 'unit_price', 'item_total')
+
+# Column types for Parquet, following schema.sql
+INTEGER_COLUMNS = {'id', 'invoice_id', 'user_id', 'batch_id', 'line_index'}
+TIMESTAMP_COLUMNS = {'uploaded_at', 'processed_at', 'updated_at'}
+DATE_COLUMNS = {'invoice_date'}
+DECIMAL_COLUMNS = {'total_amount': (15, 2), 'quantity': (15, 3), 'unit_price': (15, 4), 'item_total': (15, 2)}
+
+
+def check(dataset, export_format):
+    """Raises ValueError for an unknown dataset or format."""
+    if dataset not in DATASETS:
+        raise ValueError(f"unknown dataset: {dataset} (expected one of {', '.join(DATASETS)})")
+    if export_format not in FORMATS:
+        raise ValueError(f"unknown format: {export_format} (expected one of {', '.join(FORMATS)})")
+
+
+def parquet_available():
+    try:
+        import pyarrow.parquet # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def output_columns(dataset, columns):
+    if dataset == 'invoices':
+        return tuple(columns) + ('fields',)
+    return ('invoice_id',) + tuple(columns[1:]) + LINE_ITEM_COLUMNS # Each line item row names its invoice
+
+
+def build_query(dataset, columns, conditions):
+    """
+    The export query. `columns` are invoices columns starting with id; `conditions` are the list
+    endpoint's filters (see routes.invoice_routes._build_list_filters), which only name invoices columns.
+    """
+    select = ", ".join(f"i.{column}" for column in columns)
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    if dataset == 'invoices':
+        return (f"SELECT {select}, (SELECT JSON_OBJECTAGG(f.field_name, f.field_value) FROM invoice_fields f "
+                f"WHERE f.invoice_id = i.id) AS fields_json FROM invoices i {where_clause} ORDER BY i.id")
+    return (f"SELECT {select}, {', '.join(f'li.{column}' for column in LINE_ITEM_COLUMNS)} FROM invoices i "
+            f"JOIN invoice_line_items li ON li.invoice_id = i.id {where_clause} ORDER BY li.invoice_id, li.line_index")
+
+
+def open_cursor(conn, dataset, columns, conditions, params, net_write_timeout=None):
+    """
+    Runs the export query on an unbuffered cursor and returns it; the rows are read by iter_export().
+    `net_write_timeout` (seconds) keeps MySQL from dropping the connection while a slow client
+    holds up the stream (the session setting stays with the pooled connection, where it only
+    matters for results that are read slowly).
+    """
+    if net_write_timeout:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SET SESSION net_write_timeout = %s", (int(net_write_timeout),))
+        finally:
+            cursor.close()
+    cursor = conn.cursor(buffered=False)
+    try:
+        cursor.execute(build_query(dataset, columns, conditions), params)
+    except Exception:
+        cursor.close()
+        raise
+    return cursor
+
+
+def _iter_chunks(cursor, chunk_rows):
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            return
+        yield rows
+
+
+def _fields_json(value):
+    """The aggregated fields as a JSON string, or None for an invoice without fields."""
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode('utf-8')
+    return None if value in (None, '', '{}') else value
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value) # Like the JSON API: amounts keep their exact decimal places
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class _CSVWriter:
+    """Dates and timestamps as 'YYYY-MM-DD[ HH:MM:SS]', NULL as an empty cell, fields as a JSON object."""
+
+    def __init__(self, columns, **options):
+        self.columns = columns
+        self._has_fields = columns[-1] == 'fields'
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+
+    def _take(self):
+        text = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return text.encode('utf-8')
+
+    def begin(self):
+        self._writer.writerow(self.columns)
+        return self._take()
+
+    def write(self, records):
+        if self._has_fields:
+            records = [record[:-1] + (_fields_json(record[-1]),) for record in records]
+        self._writer.writerows(records)
+        return self._take()
+
+    def end(self):
+        return b''
+
+
+class _NDJSONWriter:
+    """One JSON object per line; dates and timestamps in ISO 8601, amounts as strings."""
+
+    def __init__(self, columns, **options):
+        self.columns = columns
+        self._has_fields = columns[-1] == 'fields'
+
+    def begin(self):
+        return b''
+
+    def _line(self, record):
+        if not self._has_fields:
+            return json.dumps(dict(zip(self.columns, record)), ensure_ascii=False, default=_json_default)
+        # The fields are already a JSON object; splice it in instead of parsing and re-encoding it
+        line = json.dumps(dict(zip(self.columns, record[:-1])), ensure_ascii=False, default=_json_default)
+        return f'{line[:-1]}, "fields": {_fields_json(record[-1]) or "{}"}}}'
+
+    def write(self, records):
+        return "".join(self._line(record) + "\n" for record in records).encode('utf-8')
+
+    def end(self):
+        return b''
+
+
+class _Drain(io.RawIOBase):
+    """A write-only file that hands what was written so far to the response, instead of keeping it."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _arrow_type(pa, column):
+    if column in INTEGER_COLUMNS:
+        return pa.int64()
+    if column in TIMESTAMP_COLUMNS:
+        return pa.timestamp('us')
+    if column in DATE_COLUMNS:
+        return pa.date32()
+    if column in DECIMAL_COLUMNS:
+        return pa.decimal128(*DECIMAL_COLUMNS[column])
+    if column == 'fields':
+        return pa.map_(pa.string(), pa.string())
+    return pa.string()
+
+
+class _ParquetWriter:
+    """Buffers `row_group_rows` records at a time and writes them as one row group."""
+
+    def __init__(self, columns, row_group_rows=10000, **options):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self._pa = pa
+        self.columns = columns
+        self.schema = pa.schema([(column, _arrow_type(pa, column)) for column in columns])
+        self.row_group_rows = row_group_rows
+        self._sink = _Drain()
+        self._writer = pq.ParquetWriter(self._sink, self.schema)
+        self._pending = []
+
+    def _flush(self):
+        pa = self._pa
+        values = list(zip(*self._pending))
+        if self.columns[-1] == 'fields':
+            values[-1] = [list(json.loads(_fields_json(fields) or '{}').items()) for fields in values[-1]]
+        arrays = [pa.array(column_values, type=field.type) for column_values, field in zip(values, self.schema)]
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self._pending = []
+
+    def begin(self):
+        return b''
+
+    def write(self, records):
+        self._pending.extend(records)
+        if len(self._pending) >= self.row_group_rows:
+            self._flush()
+        return self._sink.drain()
+
+    def end(self):
+        if self._pending:
+            self._flush()
+        self._writer.close() # Writes the footer
+        return self._sink.drain()
+
+
+_WRITERS = {'csv': _CSVWriter, 'ndjson': _NDJSONWriter, 'parquet': _ParquetWriter}
+
+
+def iter_export(cursor, dataset, export_format, columns, chunk_rows=1000, row_group_rows=10000):
+    """
+    Yields the export as bytes, one piece per chunk of rows read from `cursor` (see open_cursor).
+    Returns the number of records written (the value of `yield from`).
+    """
+    columns = output_columns(dataset, columns)
+    writer = _WRITERS[export_format](columns, row_group_rows=row_group_rows)
+    records = 0
+    data = writer.begin()
+    if data:
+        yield data
+    for chunk in _iter_chunks(cursor, chunk_rows):
+        records += len(chunk)
+        data = writer.write(chunk)
+        if data:
+            yield data
+    data = writer.end()
+    if data:
+        yield data
+    # Only now that every row has been read; see the module docstring for abandoned exports
+    cursor.close()
+    return records
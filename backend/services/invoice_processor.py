@@ -0,0 +1,429 @@
+from flask import current_app
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+import mimetypes
+
+import db
+from services import api_scheduler, invoice_events, job_queue, layout_index, line_items, metrics, ocr_backends, payload_logging, pre_extractor, response_cache, result_cache, spend_rollups, upload_storage, vision_service
+
+
+def _set_status(conn, invoice_id, status):
+    cursor = conn.cursor()
+    try:
+        # Leaving 'processed' (reprocessing) takes the invoice out of the spend rollups
+        old_contribution = spend_rollups.lock_contribution(cursor, invoice_id)
+        cursor.execute("UPDATE invoices SET status = %s WHERE id = %s", (status, invoice_id))
+        spend_rollups.apply(cursor, old_contribution, None)
+        invoice_events.record(cursor, invoice_id, status)
+        response_cache.touch(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def _get_ocr_text(invoice_id, file_path, mime_type, file_sha256=None):
+    """
+    OCRs the file, reusing a cached result when the exact same bytes were seen before.
+    `file_sha256` is the hash computed while the upload was streamed to disk; without it
+    the file is hashed in chunks here.
+    """
+    use_cache = result_cache.is_enabled()
+    file_hash = (file_sha256 or upload_storage.sha256_file(file_path)) if use_cache else None
+    if use_cache:
+        cached_text = result_cache.get_cache().get(result_cache.OCR_NAMESPACE, file_hash)
+        if cached_text is not None:
+            current_app.logger.info(f"OCR cache hit for invoice {invoice_id} (sha256 {file_hash[:12]}).")
+            return cached_text
+
+    try:
+        # Pass file_path and mime_type to handle PDFs differently; image bytes are mapped lazily
+        ocr_text = vision_service.get_ocr_text_from_image(
+            file_path=file_path,
+            mime_type=mime_type,
+            file_sha256=file_hash
+        )
+    except Exception as ocr_error:
+        current_app.logger.error(f"OCR step failed for invoice {invoice_id}: {ocr_error}")
+        # For now, we'll proceed with empty ocr_text but log it. Failures are not cached.
+        return ""
+
+    if use_cache:
+        result_cache.get_cache().set(result_cache.OCR_NAMESPACE, file_hash, ocr_text)
+    return ocr_text
+
+
+def _extract_structured_data(ocr_text):
+    """
+    Extracts structured data from OCR text: with the local pre-extractor when it is confident
+    enough (see services/pre_extractor.py), otherwise with Gemini, reusing a cached result
+    for the same (normalized) OCR text and prompt version. Documents matching a known vendor
+    layout use its learned template or a few-shot prompt (see services/layout_index.py).
+    """
+    pre_extracted = pre_extractor.try_pre_extract(ocr_text)
+    if pre_extracted is not None:
+        return pre_extracted
+
+    if not result_cache.is_enabled() or not ocr_text.strip():
+        return layout_index.extract(ocr_text)[0]
+
+    key = result_cache.extraction_key(ocr_text, vision_service.PROMPT_VERSION)
+    cache = result_cache.get_cache()
+    cached_data = cache.get(result_cache.EXTRACTION_NAMESPACE, key)
+    if cached_data is not None:
+        current_app.logger.info(f"Extraction cache hit (key {key[:12]}), skipping Gemini.")
+        # The cache entry may have been produced from differently formatted text
+        return {**cached_data, 'raw_text': ocr_text}
+
+    structured_data, learned = layout_index.extract(ocr_text)
+    # A learned-template result would be served as Gemini's to every later upload of this text
+    if not learned:
+        cache.set(result_cache.EXTRACTION_NAMESPACE, key, structured_data)
+    return structured_data
+
+
+def build_field_rows(invoice_id, structured_data):
+    """Builds the (invoice_id, field_name, field_value) rows for additional_details (line items go to invoice_line_items)."""
+    rows = []
+    additional_details = structured_data.get('additional_details', {})
+    if isinstance(additional_details, dict):
+        for field_name, field_value in additional_details.items():
+            if field_value is not None: # Only save if there's a value
+                # Ensure field_value is a string for DB insertion
+                rows.append((invoice_id, str(field_name), str(field_value)))
+    return rows
+
+
+def _store_extraction(cursor, invoice_id, ocr_text, structured_data):
+    """
+    Writes the extracted core fields to invoices, line items to invoice_line_items and the rest
+    to invoice_fields, and updates the spend rollups (caller commits).
+    """
+    update_sql = """
+    UPDATE invoices
+    SET total_amount = %s, vendor_name = %s, invoice_date = %s,
+        status = 'processed', processed_at = CURRENT_TIMESTAMP,
+        raw_text = %s,
+        invoice_number = %s,
+        currency = %s,
+        line_items_text = %s
+    WHERE id = %s
+    """
+
+    db_invoice_date = structured_data.get('invoice_date')
+    # The vision_service now attempts to parse to YYYY-MM-DD, or keeps original string
+    detected_currency = structured_data.get('detected_currency')
+    currency = str(detected_currency)[:10] if detected_currency else None # currency is VARCHAR(10)
+
+    old_contribution = spend_rollups.lock_contribution(cursor, invoice_id)
+    cursor.execute(update_sql, (
+        structured_data.get('total_amount'),
+        structured_data.get('vendor_name'),
+        db_invoice_date,
+        structured_data.get('raw_text', ocr_text), # Use Gemini's raw_text if it differs, else original OCR
+        structured_data.get('invoice_number'),
+        currency,
+        line_items.descriptions_text(structured_data.get('line_items')), # Full-text indexed with raw_text
+        invoice_id
+    ))
+    # Read back rather than derived from structured_data, so the keys match what rebuild() computes in SQL
+    spend_rollups.apply(cursor, old_contribution, spend_rollups.lock_contribution(cursor, invoice_id))
+    invoice_events.record(cursor, invoice_id, 'processed', summary={
+        'vendor_name': structured_data.get('vendor_name'),
+        'invoice_number': structured_data.get('invoice_number'),
+        'invoice_date': db_invoice_date,
+        'total_amount': structured_data.get('total_amount'),
+        'currency': currency,
+    })
+    response_cache.touch(cursor)
+
+    stored_line_items = line_items.store(cursor, invoice_id, structured_data.get('line_items'))
+
+    # Save additional_details to invoice_fields in as few round trips as possible
+    field_rows = build_field_rows(invoice_id, structured_data)
+    statements = db.bulk_insert(
+        cursor, 'invoice_fields', ('invoice_id', 'field_name', 'field_value'), field_rows,
+        max_statement_bytes=current_app.config.get('MYSQL_MAX_INSERT_BYTES', 1024 * 1024)
+    )
+    current_app.logger.info(f"Stored {stored_line_items} line items and {len(field_rows)} invoice fields for invoice {invoice_id} "
+                            f"({statements} field statement(s)).")
+
+
+def process_invoice(invoice_id, file_path, mime_type=None, ocr_text=None, file_sha256=None,
+                    lane=api_scheduler.INTERACTIVE):
+    """
+    Runs OCR and Gemini extraction for an already-saved invoice and stores the results.
+    Called by the background workers (see services/job_queue.py); moves the invoice
+    through 'processing' -> 'processed' or 'error'. If `ocr_text` is given (e.g. from a
+    batch OCR request) the OCR step is skipped. `file_sha256` is the upload-time hash.
+    `lane` is the api_scheduler priority lane for its API calls ('bulk' for batch items).
+    """
+    conn = db.get_db()
+    if not conn:
+        raise RuntimeError(f"Database connection failed while processing invoice {invoice_id}")
+
+    _set_status(conn, invoice_id, 'processing')
+    cursor = conn.cursor()
+    try:
+        if ocr_text is None:
+            with api_scheduler.lane(lane):
+                ocr_text = _get_ocr_text(invoice_id, file_path, mime_type, file_sha256)
+
+        # Store the OCR text straight away so it isn't lost if extraction fails
+        with metrics.stage_timer('db_write'):
+            cursor.execute("UPDATE invoices SET raw_text = %s WHERE id = %s", (ocr_text, invoice_id))
+            response_cache.touch(cursor)
+            conn.commit()
+        current_app.logger.info(f"OCR text stored for invoice ID: {invoice_id} (length: {len(ocr_text)}).")
+
+        # Now, extract structured data using Gemini
+        with api_scheduler.lane(lane), metrics.stage_timer('extraction'):
+            structured_data = _extract_structured_data(ocr_text)
+        current_app.logger.info(f"Data extracted by Gemini for invoice ID {invoice_id}.")
+        payload_logging.debug(current_app.logger, f"Data extracted for invoice ID {invoice_id}: ", structured_data)
+
+        with metrics.stage_timer('db_write'):
+            _store_extraction(cursor, invoice_id, ocr_text, structured_data)
+            conn.commit()
+        current_app.logger.info(f"Invoice ID: {invoice_id} fully processed and updated in DB using Gemini data.")
+        return structured_data
+
+    except Exception as e:
+        conn.rollback()
+        current_app.logger.error(f"Processing failed for invoice {invoice_id}: {e}", exc_info=True)
+        try:
+            _set_status(conn, invoice_id, 'error')
+        except Exception as db_err:
+            current_app.logger.error(f"DB error while setting status to error for invoice {invoice_id}: {db_err}")
+        raise
+    finally:
+        cursor.close()
+
+
+def _ocr_image_group(app, backend, group):
+    """OCRs one group of (invoice_id, file_path) images with a single backend batch call. Returns {invoice_id: text}."""
+    with app.app_context(), api_scheduler.lane(api_scheduler.BULK):
+        use_cache = result_cache.is_enabled()
+        texts, misses = {}, []
+        for invoice_id, file_path in group:
+            file_hash = upload_storage.sha256_file(file_path) if use_cache else None
+            cached_text = result_cache.get_cache().get(result_cache.OCR_NAMESPACE, file_hash) if use_cache else None
+            if cached_text is not None:
+                texts[invoice_id] = cached_text
+            else:
+                misses.append((invoice_id, file_hash, file_path))
+        if not misses:
+            return texts
+
+        request_error = None
+        try:
+            preprocessed = vision_service.preprocess_images([file_path for _, _, file_path in misses],
+                                                            [file_hash for _, file_hash, _ in misses])
+            with ExitStack() as stack:
+                # Originals are only mapped for images that preprocessing didn't shrink
+                contents = [image_bytes if image_bytes is not None else stack.enter_context(upload_storage.mapped_file(file_path))
+                            for image_bytes, (_, _, file_path) in zip(preprocessed, misses)]
+                with metrics.stage_timer('ocr'):
+                    results = backend.images_to_text(contents)
+        except Exception as e:
+            request_error = e
+            results = [e] * len(misses)
+        for (invoice_id, file_hash, _), result in zip(misses, results):
+            if isinstance(result, Exception):
+                if result is not request_error: # A failed request was already counted by its timer
+                    metrics.count_error('ocr', result)
+                # Same behaviour as single uploads: log and continue with empty OCR text
+                app.logger.error(f"Batch OCR failed for invoice {invoice_id}: {result}")
+                texts[invoice_id] = ""
+                continue
+            texts[invoice_id] = result
+            if use_cache:
+                result_cache.get_cache().set(result_cache.OCR_NAMESPACE, file_hash, result)
+        return texts
+
+
+def _set_batch_images_error(conn, invoice_ids):
+    """Moves batch images that process_batch had marked 'processing' but not handed on to 'error'."""
+    if not invoice_ids:
+        return
+    cursor = conn.cursor()
+    try:
+        placeholders = ", ".join(["%s"] * len(invoice_ids))
+        # Only rows still 'processing' move (and get an event); one that already finished keeps its status
+        cursor.execute(f"SELECT id FROM invoices WHERE id IN ({placeholders}) AND status = 'processing' FOR UPDATE",
+                       list(invoice_ids))
+        stuck_ids = [row[0] for row in cursor.fetchall()]
+        if stuck_ids:
+            placeholders = ", ".join(["%s"] * len(stuck_ids))
+            cursor.execute(f"UPDATE invoices SET status = 'error' WHERE id IN ({placeholders})", stuck_ids)
+            invoice_events.record(cursor, stuck_ids, 'error')
+            response_cache.touch(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def process_batch(batch_id):
+    """
+    OCRs the images of a batch upload with grouped backend calls (Vision batch_annotate_images,
+    up to VISION_BATCH_SIZE images per request, BATCH_OCR_CONCURRENCY requests at a time), then
+    fans out one process_invoice job per invoice with its OCR text attached. PDFs are queued as-is.
+    If this fails halfway, the images not yet handed to a job are set to 'error'.
+    """
+    conn = db.get_db()
+    if not conn:
+        raise RuntimeError(f"Database connection failed while processing batch {batch_id}")
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT id, original_file_path FROM invoices WHERE batch_id = %s AND status = 'uploaded' ORDER BY id",
+            (batch_id,)
+        )
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    images, others = [], []
+    for invoice_id, file_path in rows:
+        mime_type = mimetypes.guess_type(file_path)[0] or ''
+        (others if 'pdf' in mime_type else images).append((invoice_id, file_path))
+
+    # PDFs go through the regular per-invoice path (pdfplumber + scanned-page OCR)
+    for invoice_id, file_path in others:
+        job_queue.enqueue('process_invoice', {'invoice_id': invoice_id, 'file_path': file_path,
+                                              'mime_type': mimetypes.guess_type(file_path)[0],
+                                              'lane': api_scheduler.BULK})
+    if not images:
+        return
+
+    cursor = conn.cursor()
+    try:
+        placeholders = ", ".join(["%s"] * len(images))
+        cursor.execute(f"UPDATE invoices SET status = 'processing' WHERE id IN ({placeholders})",
+                       [invoice_id for invoice_id, _ in images])
+        invoice_events.record(cursor, [invoice_id for invoice_id, _ in images], 'processing')
+        response_cache.touch(cursor)
+        conn.commit()
+    finally:
+        cursor.close()
+
+    handed_on = set() # Images whose process_invoice / extract_batch job is queued; that job owns their status
+    try:
+        backend = ocr_backends.get_backend()
+        config = current_app.config
+        group_size = max(1, min(config.get('VISION_BATCH_SIZE', 16), ocr_backends.VisionOCRBackend.MAX_BATCH_SIZE))
+        groups = [images[i:i + group_size] for i in range(0, len(images), group_size)]
+        app = current_app._get_current_object()
+        current_app.logger.info(f"Batch {batch_id}: OCR of {len(images)} image(s) in {len(groups)} request(s).")
+
+        ocr_texts = {}
+        with ThreadPoolExecutor(max_workers=max(1, config.get('BATCH_OCR_CONCURRENCY', 4))) as executor:
+            for texts in executor.map(lambda group: _ocr_image_group(app, backend, group), groups):
+                ocr_texts.update(texts)
+
+        if not config.get('GEMINI_BATCH_ENABLED', True):
+            for invoice_id, file_path in images:
+                job_queue.enqueue('process_invoice', {
+                    'invoice_id': invoice_id,
+                    'file_path': file_path,
+                    'mime_type': mimetypes.guess_type(file_path)[0],
+                    'ocr_text': ocr_texts.get(invoice_id, ""),
+                    'lane': api_scheduler.BULK
+                })
+                handed_on.add(invoice_id)
+            return
+
+        # Multi-document Gemini prompts: one extract_batch job per group of invoices
+        max_documents = max(1, config.get('GEMINI_BATCH_MAX_DOCS', 8))
+        items = [{'invoice_id': invoice_id, 'ocr_text': ocr_texts.get(invoice_id, "")} for invoice_id, _ in images]
+        for i in range(0, len(items), max_documents):
+            job_queue.enqueue('extract_batch', {'items': items[i:i + max_documents]})
+            handed_on.update(item['invoice_id'] for item in items[i:i + max_documents])
+    except Exception as e:
+        current_app.logger.error(f"Batch {batch_id} failed: {e}", exc_info=True)
+        try:
+            _set_batch_images_error(conn, [invoice_id for invoice_id, _ in images if invoice_id not in handed_on])
+        except Exception as db_err:
+            current_app.logger.error(f"DB error while setting status to error for batch {batch_id}: {db_err}")
+        raise
+
+
+def extract_batch(items):
+    """
+    Extracts and stores several already-OCRed invoices with multi-document Gemini prompts
+    (see vision_service.extract_invoice_data_batch). `items` is a list of
+    {'invoice_id': ..., 'ocr_text': ...}. Each invoice ends up 'processed' or 'error' on its own.
+    """
+    conn = db.get_db()
+    if not conn:
+        raise RuntimeError("Database connection failed while extracting a batch of invoices")
+
+    use_cache = result_cache.is_enabled()
+    use_layouts = layout_index.is_enabled()
+    results, pending = {}, []
+    for item in items:
+        invoice_id, ocr_text = item['invoice_id'], item['ocr_text']
+        pre_extracted = pre_extractor.try_pre_extract(ocr_text)
+        if pre_extracted is not None:
+            results[str(invoice_id)] = pre_extracted
+            continue
+        cached_data = None
+        if use_cache and ocr_text.strip():
+            key = result_cache.extraction_key(ocr_text, vision_service.PROMPT_VERSION)
+            cached_data = result_cache.get_cache().get(result_cache.EXTRACTION_NAMESPACE, key)
+        if cached_data is None and use_layouts and ocr_text.strip():
+            index = layout_index.get_index()
+            layout, _ = index.match(ocr_text)
+            if layout is not None:
+                cached_data = index.extract_learned(layout, ocr_text)
+        if cached_data is not None:
+            results[str(invoice_id)] = {**cached_data, 'raw_text': ocr_text}
+        else:
+            pending.append((str(invoice_id), ocr_text))
+
+    if pending:
+        try:
+            with api_scheduler.lane(api_scheduler.BULK):
+                batch_results, _ = vision_service.extract_invoice_data_batch(pending)
+        except Exception as e:
+            batch_results = {document_id: e for document_id, _ in pending}
+        for document_id, ocr_text in pending:
+            result = batch_results.get(document_id, ValueError("No extraction result returned"))
+            results[document_id] = result
+            if isinstance(result, Exception):
+                continue
+            layout_index.learn(ocr_text, result)
+            if use_cache and ocr_text.strip():
+                key = result_cache.extraction_key(ocr_text, vision_service.PROMPT_VERSION)
+                result_cache.get_cache().set(result_cache.EXTRACTION_NAMESPACE, key, result)
+
+    for item in items:
+        invoice_id, ocr_text = item['invoice_id'], item['ocr_text']
+        structured_data = results[str(invoice_id)]
+        cursor = conn.cursor()
+        try:
+            if isinstance(structured_data, Exception):
+                raise structured_data
+            with metrics.stage_timer('db_write'):
+                _store_extraction(cursor, invoice_id, ocr_text, structured_data)
+                conn.commit()
+            current_app.logger.info(f"Invoice ID: {invoice_id} processed via batched Gemini extraction.")
+        except Exception as e:
+            conn.rollback()
+            current_app.logger.error(f"Batched processing failed for invoice {invoice_id}: {e}")
+            try:
+                old_contribution = spend_rollups.lock_contribution(cursor, invoice_id)
+                cursor.execute("UPDATE invoices SET status = 'error', raw_text = %s WHERE id = %s", (ocr_text, invoice_id))
+                spend_rollups.apply(cursor, old_contribution, None)
+                invoice_events.record(cursor, invoice_id, 'error')
+                response_cache.touch(cursor)
+                conn.commit()
+            except Exception as db_err:
+                current_app.logger.error(f"DB error while setting status to error for invoice {invoice_id}: {db_err}")
+        finally:
+            cursor.close()
@@ -0,0 +1,122 @@
+"""
+Full-text search over invoices (GET /api/invoices/search).
+
+Backed by two InnoDB FULLTEXT indexes (schema.sql): one over vendor_name, invoice_number,
+line_items_text (the line item descriptions, denormalized by invoice_processor) and
+raw_text, and one over vendor_name and invoice_number alone so matches there rank higher.
+InnoDB maintains both at commit, so processed uploads are searchable right away.
+
+Queries are turned into BOOLEAN MODE expressions where every term is required: plain words
+match as prefixes ("citym" finds CityMart) and tokens with punctuation, such as GSTINs or
+invoice numbers ("ACME-00059"), as phrases of their parts. Terms shorter than
+innodb_ft_min_token_size (3 by default) are not indexed and are dropped.
+Snippets are cut around the first match in raw_text (or the line items) of the page's
+invoices only, with the matched character ranges instead of markup so clients can
+highlight without escaping.
+"""
+import re
+
+MIN_TOKEN_SIZE = 3 # innodb_ft_min_token_size
+FIELD_BOOST = 2.0 # Weight of a vendor_name / invoice_number match relative to the full-text match
+SNIPPET_CHARS = 160
+MAX_HIGHLIGHTS = 10
+_BOOLEAN_OPERATORS = re.compile(r'[+\-<>()~*"@]')
+
+_ALL_COLUMNS = "vendor_name, invoice_number, line_items_text, raw_text"
+_ID_COLUMNS = "vendor_name, invoice_number"
+
+
+def parse_query(query):
+    """Splits a search query into terms, each a list of words (several for 'ACME-00059'). Drops unindexable words."""
+    terms = []
+    for token in query.split():
+        words = [word for word in re.findall(r'\w+', token) if len(word) >= MIN_TOKEN_SIZE]
+        if words:
+            terms.append(words)
+    return terms
+
+
+def boolean_query(terms):
+    """BOOLEAN MODE expression requiring every term: +word* for words, +"part part" for punctuated tokens."""
+    parts = []
+    for words in terms:
+        words = [_BOOLEAN_OPERATORS.sub('', word) for word in words]
+        parts.append(f'+"{" ".join(words)}"' if len(words) > 1 else f'+{words[0]}*')
+    return " ".join(parts)
+
+
+def _term_patterns(terms):
+    return [re.compile(r'\b' + r'\W+'.join(re.escape(word) for word in words) + (r'\w*' if len(words) == 1 else ''),
+                       re.IGNORECASE) for words in terms]
+
+
+def make_snippet(text, terms, width=SNIPPET_CHARS):
+    """{'text': ..., 'highlights': [[start, end], ...]} around the first match in `text`, or None."""
+    if not text:
+        return None
+    patterns = _term_patterns(terms)
+    first = min((m for m in (p.search(text) for p in patterns) if m), key=lambda m: m.start(), default=None)
+    if first is None:
+        return None
+    start = max(0, first.start() - width // 3)
+    end = min(len(text), start + width)
+    # Don't cut words in half
+    while start > 0 and not text[start - 1].isspace() and first.start() - start < width // 2:
+        start -= 1
+    while end < len(text) and not text[end].isspace() and end - start < width + 20:
+        end += 1
+    window = text[start:end]
+    spans = sorted({m.span() for p in patterns for m in p.finditer(window)})[:MAX_HIGHLIGHTS]
+    # Collapse whitespace runs (OCR text is full of line breaks), mapping window offsets to snippet offsets
+    chars, offset_map = [], []
+    for char in window:
+        offset_map.append(len(chars))
+        if char.isspace():
+            if not chars or chars[-1] == ' ':
+                continue
+            char = ' '
+        chars.append(char)
+    offset_map.append(len(chars))
+    prefix = '…' if start > 0 else ''
+    return {
+        'text': prefix + ''.join(chars).rstrip() + ('…' if end < len(text) else ''),
+        'highlights': [[offset_map[s] + len(prefix), offset_map[e] + len(prefix)] for s, e in spans],
+    }
+
+
+def search(conn, terms, conditions=(), params=(), limit=20, offset=0):
+    """
+    One page of matching invoices, best match first, each with its relevance `score` and a `snippet`.
+    `conditions`/`params` are extra WHERE clauses (see invoice_routes._build_list_filters).
+    Returns (invoices, has_more).
+    """
+    expression = boolean_query(terms)
+    where = [f"MATCH({_ALL_COLUMNS}) AGAINST (%s IN BOOLEAN MODE)", *conditions]
+    cursor = conn.cursor(dictionary=True)
+    try:
+        # Fetch one extra row to know whether there is a next page
+        cursor.execute(
+            f"""SELECT id, user_id, file_name, status, uploaded_at, vendor_name, invoice_number, invoice_date,
+                       total_amount, currency,
+                       MATCH({_ALL_COLUMNS}) AGAINST (%s IN BOOLEAN MODE)
+                         + %s * MATCH({_ID_COLUMNS}) AGAINST (%s IN BOOLEAN MODE) AS score
+                FROM invoices WHERE {' AND '.join(where)}
+                ORDER BY score DESC, id DESC LIMIT %s OFFSET %s""",
+            (expression, FIELD_BOOST, expression, expression, *params, limit + 1, offset)
+        )
+        invoices = cursor.fetchall()
+        has_more = len(invoices) > limit
+        invoices = invoices[:limit]
+        if invoices:
+            # The texts are read for the page only, not carried through the sort
+            placeholders = ", ".join(["%s"] * len(invoices))
+            cursor.execute(f"SELECT id, raw_text, line_items_text FROM invoices WHERE id IN ({placeholders})",
+                           [invoice['id'] for invoice in invoices])
+            texts = {row['id']: row for row in cursor.fetchall()}
+            for invoice in invoices:
+                row = texts.get(invoice['id'], {})
+                invoice['score'] = float(invoice['score'])
+                invoice['snippet'] = make_snippet(row.get('raw_text'), terms) or make_snippet(row.get('line_items_text'), terms)
+    finally:
+        cursor.close()
+    return invoices, has_more
@@ -0,0 +1,324 @@
+"""
+Background job queue and worker pool for long-running invoice processing.
+
+Uploads enqueue a job and return immediately; a pool of worker threads picks
+jobs up and runs the registered handler inside an application context, so
+handlers can use db.get_db() and current_app exactly like a route would.
+
+Two queue implementations are available, neither of which needs an external broker:
+    - 'sqlite': jobs are persisted to a local SQLite file and survive restarts.
+    - 'memory': jobs live in a process-local queue.Queue (lost on restart).
+"""
+import atexit
+import itertools
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+Job = namedtuple('Job', ['id', 'job_type', 'payload', 'attempts'])
+
+# Handlers are registered by name so that a job payload only ever contains plain JSON
+_handlers = {}
+_state = {'app': None, 'queue': None, 'pool': None}
+_state_lock = threading.Lock()
+
+
+class InMemoryJobQueue:
+    """Process-local queue. Fast, but pending jobs are lost if the process exits."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._ids = itertools.count(1)
+
+    def put(self, job_type, payload):
+        job_id = next(self._ids)
+        self._queue.put(Job(job_id, job_type, payload, 1))
+        return job_id
+
+    def get(self, timeout=1.0):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def complete(self, job_id):
+        pass
+
+    def fail(self, job_id, error):
+        pass
+
+    def heartbeat(self, job_ids):
+        pass
+
+    def pending_count(self):
+        return self._queue.qsize()
+
+
+class SQLiteJobQueue:
+    """
+    Durable queue backed by a local SQLite file.
+    Several processes (e.g. gunicorn workers) may share the same file; a job is
+    claimed atomically inside a BEGIN IMMEDIATE transaction so it only runs once.
+    While a job runs, its worker pool refreshes updated_at (heartbeat()); a 'running' job
+    whose heartbeat is older than `stale_after_seconds` belonged to a worker that died and
+    is claimed again, up to `max_attempts` claims in all, after which it is failed.
+    """
+
+    def __init__(self, path, stale_after_seconds=600, max_attempts=3):
+        self.path = path
+        self.stale_after_seconds = stale_after_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_type TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT NULL,
+                claimed_by INTEGER NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_id ON jobs(status, id)")
+
+    def _connect(self):
+        # sqlite3 connections must not be shared across threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None puts sqlite3 in autocommit mode; _claim() manages its own transaction
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def put(self, job_type, payload):
+        now = time.time()
+        cursor = self._connect().execute(
+            "INSERT INTO jobs (job_type, payload, status, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?)",
+            (job_type, json.dumps(payload), now, now)
+        )
+        with self._wakeup:
+            self._wakeup.notify()
+        return cursor.lastrowid
+
+    def _claim(self):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # A job that has taken down its worker max_attempts times is not tried again
+            conn.execute(
+                """UPDATE jobs SET status = 'failed', last_error = ?, updated_at = ?
+                   WHERE status = 'running' AND updated_at < ? AND attempts >= ?""",
+                (f"Worker stopped responding on each of {self.max_attempts} attempts", now,
+                 now - self.stale_after_seconds, self.max_attempts)
+            )
+            # Jobs left 'running' by a worker that died are picked up again once they go stale
+            row = conn.execute(
+                """SELECT id, job_type, payload, attempts FROM jobs
+                   WHERE status = 'queued' OR (status = 'running' AND updated_at < ?)
+                   ORDER BY id LIMIT 1""",
+                (now - self.stale_after_seconds,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, claimed_by = ?, updated_at = ? WHERE id = ?",
+                (os.getpid(), now, row[0])
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return Job(row[0], row[1], json.loads(row[2]), row[3] + 1)
+
+    def get(self, timeout=1.0):
+        job = self._claim()
+        if job is None:
+            # Wait for a local put() to wake us up; jobs enqueued by other processes are seen on the next poll
+            with self._wakeup:
+                self._wakeup.wait(timeout)
+            job = self._claim()
+        return job
+
+    def complete(self, job_id):
+        self._connect().execute(
+            "UPDATE jobs SET status = 'done', updated_at = ? WHERE id = ?", (time.time(), job_id)
+        )
+
+    def fail(self, job_id, error):
+        self._connect().execute(
+            "UPDATE jobs SET status = 'failed', last_error = ?, updated_at = ? WHERE id = ?",
+            (str(error)[:2000], time.time(), job_id)
+        )
+
+    def heartbeat(self, job_ids):
+        """Marks running jobs of this process as alive, so they are not claimed again as stale."""
+        if not job_ids:
+            return
+        placeholders = ", ".join("?" for _ in job_ids)
+        self._connect().execute(
+            f"UPDATE jobs SET updated_at = ? WHERE status = 'running' AND claimed_by = ? AND id IN ({placeholders})",
+            (time.time(), os.getpid(), *job_ids)
+        )
+
+    def pending_count(self):
+        row = self._connect().execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()
+        return row[0]
+
+
+class WorkerPool:
+    """A fixed number of daemon threads pulling jobs from a queue and running their handlers."""
+
+    def __init__(self, app, job_queue, concurrency=4, poll_interval=1.0, heartbeat_interval=60.0):
+        self.app = app
+        self.job_queue = job_queue
+        self.concurrency = max(1, int(concurrency))
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self._stop = threading.Event()
+        self._threads = []
+        self._running = set() # Ids of the jobs this pool is executing
+        self._running_lock = threading.Lock()
+
+    def start(self):
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._run, name=f"invoice-worker-{i+1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name="invoice-worker-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        self.app.logger.info(f"Started {self.concurrency} background invoice worker(s).")
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self.job_queue.get(timeout=self.poll_interval)
+            except Exception as e:
+                self.app.logger.error(f"Error fetching job from queue: {e}")
+                time.sleep(self.poll_interval)
+                continue
+            if job is None:
+                continue
+            with self._running_lock:
+                self._running.add(job.id)
+            try:
+                self._execute(job)
+            finally:
+                with self._running_lock:
+                    self._running.discard(job.id)
+
+    def _heartbeat(self):
+        # One thread for the whole pool: a long OCR or Gemini call can't hold up its job's heartbeat
+        while not self._stop.wait(self.heartbeat_interval):
+            with self._running_lock:
+                job_ids = list(self._running)
+            try:
+                self.job_queue.heartbeat(job_ids)
+            except Exception as e:
+                self.app.logger.error(f"Error refreshing the heartbeat of jobs {job_ids}: {e}")
+
+    def _execute(self, job):
+        handler = _handlers.get(job.job_type)
+        if handler is None:
+            self.app.logger.error(f"No handler registered for job type '{job.job_type}' (job {job.id}).")
+            self.job_queue.fail(job.id, f"Unknown job type: {job.job_type}")
+            return
+        with self.app.app_context():
+            try:
+                handler(**job.payload)
+                self.job_queue.complete(job.id)
+            except Exception as e:
+                self.app.logger.error(f"Job {job.id} ({job.job_type}) failed: {e}", exc_info=True)
+                self.job_queue.fail(job.id, e)
+
+
+def register_handler(job_type, handler):
+    """Registers a callable that receives the job payload as keyword arguments."""
+    _handlers[job_type] = handler
+
+
+def _create_queue(app):
+    backend = app.config.get('JOB_QUEUE_BACKEND', 'sqlite')
+    if backend == 'memory':
+        return InMemoryJobQueue()
+    if backend == 'sqlite':
+        return SQLiteJobQueue(
+            app.config['JOB_QUEUE_PATH'],
+            stale_after_seconds=app.config.get('JOB_STALE_AFTER_SECONDS', 600),
+            max_attempts=app.config.get('JOB_MAX_ATTEMPTS', 3)
+        )
+    raise ValueError(f"Unknown JOB_QUEUE_BACKEND: {backend}")
+
+
+def get_queue():
+    return _state['queue']
+
+
+def start_workers():
+    """Starts the worker pool for this process if it isn't running yet."""
+    with _state_lock:
+        if _state['pool'] is not None:
+            return _state['pool']
+        app = _state['app']
+        pool = WorkerPool(
+            app, _state['queue'], concurrency=app.config.get('JOB_WORKER_CONCURRENCY', 4),
+            # Several heartbeats per stale period, so one slow SQLite write doesn't get a job re-claimed
+            heartbeat_interval=app.config.get('JOB_STALE_AFTER_SECONDS', 600) / 4
+        )
+        pool.start()
+        _state['pool'] = pool
+        atexit.register(pool.stop)
+        return pool
+
+
+def enqueue(job_type, payload):
+    """Adds a job to the queue and makes sure this process has workers to run it (if in-process workers are enabled)."""
+    job_id = _state['queue'].put(job_type, payload)
+    if _state['app'].config.get('JOB_WORKERS_IN_PROCESS', True):
+        start_workers()
+    return job_id
+
+
+def init_app(app):
+    _state['app'] = app
+    _state['queue'] = _create_queue(app)
+
+    # Workers are started lazily on the first request (rather than at import time) so that
+    # the werkzeug reloader's parent process and `flask` CLI commands don't spawn threads.
+    if app.config.get('JOB_WORKERS_IN_PROCESS', True):
+        @app.before_request
+        def _ensure_workers_started():
+            if _state['pool'] is None:
+                start_workers()
+
+    @app.cli.command('run-workers')
+    def run_workers_command():
+        """Runs the background invoice workers in the foreground (for a dedicated worker process)."""
+        if app.config.get('METRICS_PORT'):
+            # OCR/Gemini stages run here rather than in the web app, so this process needs its own /metrics
+            from services import metrics
+            metrics.start_http_server(app.config['METRICS_PORT'])
+            app.logger.info(f"Serving worker metrics on port {app.config['METRICS_PORT']}.")
+        pool = start_workers()
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pool.stop()
@@ -0,0 +1,618 @@
+"""
+Vendor layout index learned from previously processed invoices.
+
+Each processed invoice is reduced to a layout fingerprint: a MinHash signature of
+the word shingles of its header and footer lines (lowercased, digits replaced by
+'#', so invoice numbers and dates don't change the fingerprint). Signatures are
+bucketed with LSH (BANDS bands of ROWS hashes), so matching a new upload against
+thousands of known layouts is a handful of dict lookups plus a few signature
+comparisons, well under a millisecond.
+
+Documents whose similarity to a layout is at least LAYOUT_MATCH_THRESHOLD join it.
+For every layout the index learns, from the Gemini results of its samples:
+    - the vendor name and currency, and
+    - for invoice_number, invoice_date and total_amount, the label text that
+      precedes the value on its line ("grand total: inr", "bill no."), or the line
+      number for unlabeled values, plus the shapes the value had ('A-9' for
+      'ACME-00059'), i.e. a field-position template, and
+    - the line item row: a description followed by a fixed number of numeric columns,
+      which of them hold the quantity, unit price and item total, and their shapes.
+      A sample only teaches a row if reading its text with the row gives back exactly
+      the line items Gemini returned (a sample without line items teaches "no rows");
+      samples with a misread number in a row are left out.
+
+When a new document matches a layout with at least LAYOUT_MIN_SAMPLES consistent
+samples, the learned template extracts it, line items included, without any API
+call (and without adding the result to the processing cache). If the template
+can't read every field and row, Gemini gets a short few-shot prompt with one example
+of the same layout instead of the full instructions (vision_service.extract_invoice_data_few_shot).
+
+The index is per process. It is bootstrapped lazily from the most recent processed
+invoices (LAYOUT_INDEX_BOOTSTRAP_LIMIT), updated incrementally with every new
+Gemini result, and evicts layouts not seen for LAYOUT_INDEX_TTL_DAYS or, beyond
+LAYOUT_INDEX_MAX_LAYOUTS, the least recently seen ones.
+"""
+import hashlib
+import itertools
+import re
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from flask import current_app
+
+import db
+from services import line_items, pre_extractor, vision_service
+
+HEADER_LINES = 8
+FOOTER_LINES = 3
+HASH_COUNT = 32
+BANDS = 8
+ROWS = HASH_COUNT // BANDS
+LABEL_AGREEMENT = 0.8 # Share of a layout's samples that must agree on a label / vendor
+MAX_EXAMPLE_CHARS = 4000 # Longer examples would make the few-shot prompt longer than the full one
+LEARNED_FIELDS = ('invoice_number', 'invoice_date', 'total_amount')
+LINE_ITEM_COLUMNS = ('quantity', 'unit_price', 'item_total')
+
+_DATE_RE = re.compile(pre_extractor.DATE_TOKEN, re.IGNORECASE)
+_NUMBER_RE = re.compile(r'[A-Z0-9][A-Z0-9/_-]*', re.IGNORECASE)
+
+
+def _normalize(text):
+    return re.sub(r'\s+', ' ', re.sub(r'\d', '#', text.lower())).strip()
+
+
+def _header_lines(lines):
+    return {_normalize(line) for line in lines[:HEADER_LINES]}
+
+
+def _value_shape(raw):
+    """'ACME-00059' -> 'A-9', '4,422.03' -> '9,9.9': OCR confusions (0/O, ./,) change the shape."""
+    return re.sub(r'[A-Za-z]+', 'A', re.sub(r'\d+', '9', raw))
+
+
+def layout_shingles(ocr_text):
+    """Word bigrams (and single words) of the normalized header and footer lines."""
+    lines = [line for line in ocr_text.splitlines() if line.strip()]
+    shingles = set()
+    for line in lines[:HEADER_LINES] + lines[HEADER_LINES:][-FOOTER_LINES:]:
+        words = re.findall(r'[a-z#]+', _normalize(line))
+        shingles.update(words)
+        shingles.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    return shingles
+
+
+def minhash(shingles):
+    """
+    One-permutation MinHash: each shingle is hashed once and lands in one of HASH_COUNT bins,
+    each bin keeps its minimum. Empty bins borrow the next non-empty bin's value (rotation
+    densification), tagged with the distance so they only agree with equally empty bins.
+    """
+    if not shingles:
+        return None
+    bins = [None] * HASH_COUNT
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+        slot, value = value % HASH_COUNT, value // HASH_COUNT
+        if bins[slot] is None or value < bins[slot]:
+            bins[slot] = value
+    signature = []
+    for slot in range(HASH_COUNT):
+        distance = 0
+        while bins[(slot + distance) % HASH_COUNT] is None:
+            distance += 1
+        signature.append(bins[(slot + distance) % HASH_COUNT] + (distance << 64))
+    return tuple(signature)
+
+
+def similarity(signature_a, signature_b):
+    """Estimated Jaccard similarity of the two shingle sets."""
+    return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / HASH_COUNT
+
+
+def _band_keys(signature):
+    return [(band, signature[band * ROWS:(band + 1) * ROWS]) for band in range(BANDS)]
+
+
+def _label_pattern(label):
+    """Regex for a learned label: digits match any digit, whitespace any whitespace."""
+    parts = []
+    for char in label:
+        parts.append(r'[\d#]' if char == '#' else r'\s+' if char == ' ' else re.escape(char))
+    return re.compile(r'^\s*' + ''.join(parts), re.IGNORECASE)
+
+
+def _value_token(field, text, dayfirst):
+    """(raw, parsed) for the first value of `field` in `text`, or None if it isn't a standalone token."""
+    if field == 'total_amount':
+        match, group = pre_extractor.AMOUNT_RE.search(text), 'amount'
+    elif field == 'invoice_date':
+        match, group = _DATE_RE.search(text), 'date'
+    else:
+        match, group = _NUMBER_RE.search(text), 0
+    if not match:
+        return None
+    start, end = match.span(group)
+    # '2O24-07-13' contains the date '24-07-13'; a fragment of a damaged token is not a value
+    if text[start - 1:start].isalnum() or text[end:end + 1].isalnum():
+        return None
+    raw = match.group(group)
+    if field == 'total_amount':
+        return raw, pre_extractor.parse_amount(raw)
+    if field == 'invoice_date':
+        return raw, pre_extractor.parse_date(raw, dayfirst)
+    return raw, raw
+
+
+def _row_pattern(width):
+    """
+    A line ending in `width` whitespace-separated number-like tokens. Damaged numbers match too,
+    '1O5.00' and digit-less ones like 'S' (5) or 'l' (1), so their row can't be read instead of vanishing.
+    """
+    return re.compile(r'^\s*(\S.*?)' + r'\s+(\S*\d\S*|[OoIlSB.,]+)' * width + r'\s*$')
+
+
+def _rows(lines, width):
+    """(description, [token, ...]) for each line that looks like a row with `width` numeric columns."""
+    pattern = _row_pattern(width)
+    return [(m.group(1).strip(), list(m.groups()[1:])) for m in map(pattern.match, lines) if m]
+
+
+def read_line_items(lines, columns, shapes=None):
+    """
+    Line items of the rows with len(columns) numeric columns. `columns` names the field each
+    column holds (None for numbers that aren't one, e.g. a tax rate). Returns None if a value
+    can't be parsed or has a shape not in `shapes` ({column: shapes}), i.e. a row can't be read.
+    """
+    items = []
+    for description, tokens in _rows(lines, len(columns)):
+        item = {'description': description, **{column: None for column in LINE_ITEM_COLUMNS}}
+        for column, token in zip(columns, tokens):
+            if column is None:
+                continue
+            value = pre_extractor.parse_amount(token)
+            if value is None or (shapes is not None and _value_shape(token) not in shapes[column]):
+                return None
+            item[column] = value
+        items.append(item)
+    return items
+
+
+def _same_number(a, b):
+    if a is None or b is None:
+        return a is None and b is None
+    try:
+        return abs(float(a) - float(b)) < 0.005
+    except (TypeError, ValueError):
+        return False
+
+
+def line_item_row(ocr_text, items):
+    """
+    (columns, {column: value shapes}) of the row layout holding `items` (see read_line_items), ((), {})
+    for a document without line items, (None, {}) if no row layout gives back exactly `items`, or
+    None if a row is damaged (a number OCR misread), so the document says nothing about the rows.
+    """
+    if not items:
+        return (), {}
+    lines = [' '.join(line.split()) for line in ocr_text.splitlines() if line.strip()]
+    votes = Counter()
+    for item in items:
+        description = ' '.join(str(item.get('description') or '').split())
+        line = next((line for line in lines if description and line.lower().startswith(description.lower())
+                     and line[len(description):][:1] in ('', ' ')), None)
+        if line is None:
+            return None, {}
+        columns, unused = [], list(LINE_ITEM_COLUMNS)
+        for token in line[len(description):].split():
+            value = pre_extractor.parse_amount(token)
+            column = next((c for c in unused if value is not None and _same_number(value, item.get(c))), None)
+            if column is not None:
+                unused.remove(column)
+            columns.append(column)
+        votes[tuple(columns)] += 1
+    columns = votes.most_common(1)[0][0]
+    if not any(columns):
+        return None, {}
+    read = read_line_items(lines, columns)
+    if read is None:
+        return None
+    if len(read) != len(items):
+        return None, {}
+    for found, item in zip(read, items):
+        if found['description'].lower() != ' '.join(str(item.get('description') or '').split()).lower() \
+                or not all(_same_number(found[c], item.get(c)) for c in LINE_ITEM_COLUMNS):
+            return None, {}
+    shapes = {column: set() for column in columns if column is not None}
+    for _, tokens in _rows(lines, len(columns)):
+        for column, token in zip(columns, tokens):
+            if column is not None:
+                shapes[column].add(_value_shape(token))
+    return columns, shapes
+
+
+def field_positions(ocr_text, structured_data, dayfirst=True):
+    """
+    For each learned field whose value appears in the text: (position, value shape). The position
+    is ('label', normalized text before the value on its line), or ('line', index among non-empty
+    lines, negative from the bottom for totals) when there is no label.
+    """
+    lines = [line for line in ocr_text.splitlines() if line.strip()]
+    positions = {}
+    for field in LEARNED_FIELDS:
+        expected = structured_data.get(field)
+        if expected in (None, ''):
+            continue
+        # Totals are looked up bottom-up (the last matching line), other fields top-down
+        numbered = [(index - len(lines), lines[index]) for index in range(len(lines) - 1, -1, -1)] \
+            if field == 'total_amount' else list(enumerate(lines))
+        for line_index, line in numbered:
+            if field == 'total_amount':
+                found = [m for m in pre_extractor.AMOUNT_RE.finditer(line)
+                         if pre_extractor.parse_amount(m.group('amount')) == expected]
+                found = [(m.start('amount'), m.group('amount')) for m in found]
+            elif field == 'invoice_date':
+                found = [(m.start('date'), m.group('date')) for m in _DATE_RE.finditer(line)
+                         if pre_extractor.parse_date(m.group('date'), dayfirst) == expected]
+            else:
+                index = line.find(str(expected))
+                found = [(index, str(expected))] if index >= 0 else []
+            if found:
+                start, raw = found[0]
+                label = _normalize(line[:start])
+                position = ('label', label) if len(re.findall(r'[a-z]', label)) >= 2 else ('line', line_index)
+                positions[field] = (position, _value_shape(raw))
+                break
+    return positions
+
+
+class Layout:
+    """A cluster of documents with the same header/footer fingerprint, and what was learned from them."""
+    _ids = itertools.count(1)
+
+    def __init__(self, signature, now):
+        self.id = next(self._ids)
+        self.signature = signature
+        self.samples = 0
+        self.vendors = Counter()
+        self.currencies = Counter()
+        self.positions = {field: Counter() for field in LEARNED_FIELDS}
+        self.shapes = {field: set() for field in LEARNED_FIELDS}
+        self.header_lines = Counter()
+        self.line_item_samples = 0
+        self.row_columns = Counter()
+        self.row_shapes = {}
+        self.example_text = None
+        self.example_data = None
+        self.example_invoice_id = None
+        self.last_seen = now
+        self.hits = 0
+
+    def add(self, ocr_text, structured_data, invoice_id, dayfirst):
+        self.samples += 1
+        if structured_data.get('vendor_name'):
+            self.vendors[structured_data['vendor_name']] += 1
+        if structured_data.get('detected_currency'):
+            self.currencies[structured_data['detected_currency']] += 1
+        for field, (position, shape) in field_positions(ocr_text, structured_data, dayfirst).items():
+            self.positions[field][position] += 1
+            self.shapes[field].add(shape)
+        self.header_lines.update(_header_lines([line for line in ocr_text.splitlines() if line.strip()]))
+        # Bootstrapped samples whose line items weren't loaded, and damaged rows, say nothing about the rows
+        row = line_item_row(ocr_text, structured_data['line_items']) \
+            if isinstance(structured_data.get('line_items'), list) else None
+        if row is not None:
+            columns, shapes = row
+            self.line_item_samples += 1
+            if columns is not None:
+                self.row_columns[columns] += 1
+            for column, column_shapes in shapes.items():
+                self.row_shapes.setdefault(column, set()).update(column_shapes)
+        if self.example_text is None and len(ocr_text) <= MAX_EXAMPLE_CHARS:
+            self.example_text = ocr_text
+            # Bootstrapped samples (with an invoice id) load their example output from the database on first use
+            self.example_data = None if invoice_id is not None else _example_output(structured_data)
+            self.example_invoice_id = invoice_id
+
+    def _agreed(self, counter, samples=None):
+        if not counter:
+            return None
+        value, count = counter.most_common(1)[0]
+        return value if count >= LABEL_AGREEMENT * (self.samples if samples is None else samples) else None
+
+    def template(self, min_samples):
+        """
+        (vendor, currency, {field: position}, header lines every sample had, line item row columns)
+        once enough samples agree, else None.
+        """
+        if self.samples < min_samples or self.line_item_samples < min_samples:
+            return None
+        vendor = self._agreed(self.vendors)
+        positions = {field: self._agreed(counter) for field, counter in self.positions.items()}
+        columns = self._agreed(self.row_columns, self.line_item_samples)
+        if vendor is None or columns is None or any(position is None for position in positions.values()):
+            return None
+        anchors = {line for line, count in self.header_lines.items() if count >= LABEL_AGREEMENT * self.samples}
+        return vendor, self._agreed(self.currencies), positions, anchors, columns
+
+
+def _example_output(structured_data):
+    """Gemini-style JSON for a few-shot example: core fields plus additional details at the top level."""
+    output = {field: structured_data.get(field) for field in vision_service.CORE_FIELDS_SCHEMA}
+    output.update(structured_data.get('additional_details') or {})
+    return output
+
+
+class LayoutIndex:
+    """MinHash/LSH index of Layouts (see the module docstring)."""
+
+    def __init__(self, match_threshold=0.6, min_samples=3, max_layouts=5000, ttl_seconds=90 * 86400, dayfirst=True):
+        self.match_threshold = match_threshold
+        self.min_samples = min_samples
+        self.max_layouts = max_layouts
+        self.ttl_seconds = ttl_seconds
+        self.dayfirst = dayfirst
+        self._layouts = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._stats = {'matches': 0, 'misses': 0, 'learned_extractions': 0, 'evicted': 0}
+
+    def _find(self, signature):
+        candidates = set()
+        for key in _band_keys(signature):
+            candidates.update(self._buckets.get(key, ()))
+        best, best_similarity = None, 0.0
+        for layout_id in candidates:
+            layout = self._layouts[layout_id]
+            score = similarity(signature, layout.signature)
+            if score > best_similarity:
+                best, best_similarity = layout, score
+        if best is not None and best_similarity >= self.match_threshold:
+            return best, best_similarity
+        return None, best_similarity
+
+    def match(self, ocr_text):
+        """Returns (layout, similarity) for the best matching known layout, or (None, best similarity)."""
+        signature = minhash(layout_shingles(ocr_text))
+        if signature is None:
+            return None, 0.0
+        with self._lock:
+            layout, score = self._find(signature)
+            if layout is not None:
+                layout.hits += 1
+                layout.last_seen = time.time()
+                self._stats['matches'] += 1
+            else:
+                self._stats['misses'] += 1
+            return layout, score
+
+    def add_sample(self, ocr_text, structured_data, invoice_id=None, seen_at=None):
+        """Adds an extraction result to its layout (creating the layout if needed). Returns the layout."""
+        signature = minhash(layout_shingles(ocr_text))
+        if signature is None or not structured_data:
+            return None
+        now = seen_at or time.time()
+        with self._lock:
+            layout, _ = self._find(signature)
+            if layout is None:
+                layout = Layout(signature, now)
+                self._layouts[layout.id] = layout
+                for key in _band_keys(signature):
+                    self._buckets.setdefault(key, set()).add(layout.id)
+                self._evict(now)
+            layout.add(ocr_text, structured_data, invoice_id, self.dayfirst)
+            layout.last_seen = max(layout.last_seen, now)
+            return layout
+
+    def _remove(self, layout):
+        del self._layouts[layout.id]
+        for key in _band_keys(layout.signature):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(layout.id)
+                if not bucket:
+                    del self._buckets[key]
+        self._stats['evicted'] += 1
+
+    def _evict(self, now):
+        """Drops layouts unseen for ttl_seconds, then the least recently seen beyond max_layouts (caller holds the lock)."""
+        for layout in [l for l in self._layouts.values() if now - l.last_seen > self.ttl_seconds]:
+            self._remove(layout)
+        if len(self._layouts) > self.max_layouts:
+            by_age = sorted(self._layouts.values(), key=lambda l: l.last_seen)
+            for layout in by_age[:len(self._layouts) - self.max_layouts]:
+                self._remove(layout)
+
+    def evict_stale(self):
+        with self._lock:
+            self._evict(time.time())
+
+    def extract_learned(self, layout, ocr_text):
+        """Extracts with the layout's learned template. Returns structured_data, or None if any field or row can't be read."""
+        with self._lock:
+            template = layout.template(self.min_samples)
+            shapes = {field: set(values) for field, values in layout.shapes.items()}
+            row_shapes = {column: set(values) for column, values in layout.row_shapes.items()}
+        if template is None:
+            return None
+        vendor, currency, positions, anchors, columns = template
+        lines = [line for line in ocr_text.splitlines() if line.strip()]
+        # Layouts shared by several vendors (generic invoice software) never agree on a vendor; documents
+        # missing a header line (the vendor's name, address, tax id) all samples had are another vendor's
+        if not anchors <= _header_lines(lines):
+            return None
+        values = {'vendor_name': vendor, 'detected_currency': currency}
+        for field, (kind, where) in positions.items():
+            if kind == 'line':
+                candidates = [lines[where]] if -len(lines) <= where < len(lines) else []
+            else:
+                pattern = _label_pattern(where)
+                candidates = [line[m.end():] for line in (lines[::-1] if field == 'total_amount' else lines)
+                              for m in [pattern.match(line)] if m]
+            token = next((token for token in (_value_token(field, text, self.dayfirst) for text in candidates[:1]) if token), None)
+            # A value whose shape was never seen in this layout is most likely an OCR confusion
+            if token is None or token[1] is None or _value_shape(token[0]) not in shapes[field]:
+                return None
+            values[field] = token[1]
+        items = read_line_items([' '.join(line.split()) for line in lines], columns, row_shapes) if columns else []
+        # A document of a layout with rows where none, or only a damaged one, can be found goes to Gemini
+        if items is None or (columns and not items):
+            return None
+        values['line_items'] = items
+        with self._lock:
+            self._stats['learned_extractions'] += 1
+        return vision_service._structure_extracted_data(values, ocr_text)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['layouts'] = len(self._layouts)
+            stats['layouts_with_template'] = sum(1 for l in self._layouts.values() if l.template(self.min_samples))
+        return stats
+
+    def __len__(self):
+        return len(self._layouts)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _bootstrap(index):
+    """Seeds the index with the most recent processed invoices."""
+    conn = db.get_db()
+    if not conn:
+        return
+    limit = current_app.config.get('LAYOUT_INDEX_BOOTSTRAP_LIMIT', 5000)
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(
+            """SELECT id, raw_text, vendor_name, invoice_number, invoice_date, total_amount, processed_at
+               FROM invoices WHERE status = 'processed' AND raw_text IS NOT NULL
+               ORDER BY id DESC LIMIT %s""",
+            (limit,)
+        )
+        rows = cursor.fetchall()
+        items = {}
+        if rows:
+            # One range scan of the (invoice_id, line_index) primary key; ids outside `rows` are skipped below
+            cursor.execute(
+                """SELECT invoice_id, description, quantity, unit_price, item_total FROM invoice_line_items
+                   WHERE invoice_id >= %s ORDER BY invoice_id, line_index""",
+                (rows[-1]['id'],)
+            )
+            for item in cursor.fetchall():
+                items.setdefault(item.pop('invoice_id'), []).append(
+                    {key: float(value) if isinstance(value, Decimal) else value for key, value in item.items()})
+    except Exception as e:
+        current_app.logger.warning(f"Could not bootstrap the layout index: {e}")
+        return
+    finally:
+        cursor.close()
+    # Oldest first, so each layout's few-shot example is its earliest sample
+    for row in reversed(rows):
+        structured_data = {
+            'vendor_name': row['vendor_name'],
+            'invoice_number': row['invoice_number'],
+            'invoice_date': row['invoice_date'].strftime('%Y-%m-%d') if row['invoice_date'] else None,
+            'total_amount': float(row['total_amount']) if row['total_amount'] is not None else None,
+        }
+        # Without typed rows we can't tell "no line items" from "not migrated yet", so the sample teaches no row
+        if row['id'] in items:
+            structured_data['line_items'] = items[row['id']]
+        seen_at = row['processed_at'].timestamp() if row['processed_at'] else None
+        index.add_sample(row['raw_text'], structured_data, invoice_id=row['id'], seen_at=seen_at)
+    current_app.logger.info(f"Layout index bootstrapped from {len(rows)} invoice(s): {len(index)} layout(s).")
+
+
+def _load_example_data(layout):
+    """Rebuilds the example output of a bootstrapped layout from invoices, invoice_line_items and invoice_fields."""
+    conn = db.get_db()
+    if not conn or layout.example_invoice_id is None:
+        return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT vendor_name, invoice_number, invoice_date, total_amount FROM invoices WHERE id = %s",
+            (layout.example_invoice_id,)
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+        cursor.execute("SELECT field_name, field_value FROM invoice_fields WHERE invoice_id = %s AND field_name NOT LIKE %s ORDER BY id",
+                       (layout.example_invoice_id, line_items.EAV_FIELD_PATTERN))
+        additional_details = dict(cursor.fetchall())
+    finally:
+        cursor.close()
+    items = [{key: float(value) if isinstance(value, Decimal) else value for key, value in item.items() if key != 'line_index'}
+             for item in line_items.get_line_items(conn, layout.example_invoice_id)]
+    return _example_output({
+        'vendor_name': row[0],
+        'invoice_number': row[1],
+        'invoice_date': row[2].strftime('%Y-%m-%d') if row[2] else None,
+        'total_amount': float(row[3]) if row[3] is not None else None,
+        'detected_currency': layout._agreed(layout.currencies),
+        'line_items': items,
+        'additional_details': additional_details,
+    })
+
+
+def get_index():
+    """The process-wide index, created from the app config and bootstrapped from the database on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                config = current_app.config
+                index = LayoutIndex(
+                    match_threshold=config.get('LAYOUT_MATCH_THRESHOLD', 0.6),
+                    min_samples=config.get('LAYOUT_MIN_SAMPLES', 3),
+                    max_layouts=config.get('LAYOUT_INDEX_MAX_LAYOUTS', 5000),
+                    ttl_seconds=config.get('LAYOUT_INDEX_TTL_DAYS', 90) * 86400,
+                    dayfirst=config.get('PRE_EXTRACTION_DAYFIRST', True),
+                )
+                _bootstrap(index)
+                _index = index
+    return _index
+
+
+def is_enabled():
+    return current_app.config.get('LAYOUT_INDEX_ENABLED', True)
+
+
+def extract(ocr_text):
+    """
+    Extracts structured data for OCR text with the cheapest method that applies:
+    the learned template of a matching layout, a few-shot Gemini prompt with an example
+    of that layout, or the full Gemini prompt. Gemini results are added to the index.
+    Returns (structured_data, learned); learned results shouldn't be cached as Gemini's.
+    """
+    if not is_enabled() or not ocr_text.strip():
+        return vision_service.extract_invoice_data_with_gemini(ocr_text), False
+
+    index = get_index()
+    layout, score = index.match(ocr_text)
+    structured_data = None
+    if layout is not None:
+        structured_data = index.extract_learned(layout, ocr_text)
+        if structured_data is not None:
+            current_app.logger.info(f"Extracted with the learned template of layout {layout.id} (similarity {score:.2f}); skipping Gemini.")
+            return structured_data, True
+        if layout.example_text is not None:
+            if layout.example_data is None:
+                layout.example_data = _load_example_data(layout)
+            if layout.example_data is not None:
+                current_app.logger.info(f"Layout {layout.id} matched (similarity {score:.2f}); using a few-shot prompt.")
+                structured_data = vision_service.extract_invoice_data_few_shot(ocr_text, layout.example_text, layout.example_data)
+
+    if structured_data is None:
+        structured_data = vision_service.extract_invoice_data_with_gemini(ocr_text)
+    index.add_sample(ocr_text, structured_data)
+    return structured_data, False
+
+
+def learn(ocr_text, structured_data):
+    """Adds an extraction result produced elsewhere (e.g. a multi-document prompt) to the index."""
+    if is_enabled() and ocr_text.strip():
+        get_index().add_sample(ocr_text, structured_data)
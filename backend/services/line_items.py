@@ -0,0 +1,191 @@
+"""
+Typed line items (invoice_line_items) instead of EAV rows in invoice_fields.
+
+Line items used to be stored as string rows named line_item_<n>_<column> in
+invoice_fields, so summing quantities or amounts meant string-matching field_name
+and casting field_value for every row. They now live in invoice_line_items with
+DECIMAL columns and a (invoice_id, line_index) primary key: one invoice's line items
+are a single clustered index range.
+
+backfill_from_fields() moves existing EAV rows over in small transactions while the
+app keeps running (`flask backfill-line-items`); until it has finished, reads fall
+back to the EAV rows of invoices that have not been migrated yet (LINE_ITEMS_EAV_FALLBACK).
+"""
+import re
+import time
+from decimal import Decimal, InvalidOperation
+
+from flask import current_app
+
+import db
+
+COLUMNS = ('invoice_id', 'line_index', 'description', 'quantity', 'unit_price', 'item_total')
+# (digits, decimal places) of the DECIMAL columns in schema.sql
+NUMERIC_COLUMNS = {'quantity': (15, 3), 'unit_price': (15, 4), 'item_total': (15, 2)}
+MAX_DESCRIPTION_CHARS = 1000
+EAV_FIELD_RE = re.compile(r'^line_item_(\d+)_(description|amount|quantity|unit_price)$')
+EAV_FIELD_PATTERN = r'line\_item\_%' # LIKE pattern of the EAV field names
+# EAV suffix -> invoice_line_items column ('amount' was the item total)
+EAV_COLUMNS = {'description': 'description', 'amount': 'item_total', 'quantity': 'quantity', 'unit_price': 'unit_price'}
+
+
+def parse_decimal(value, column):
+    """Converts an extracted value ('1,234.50', '₹ 99', 12.5) to a Decimal fitting `column`, or None."""
+    if value is None or isinstance(value, bool):
+        return None
+    text = str(value).strip()
+    # Drop currency symbols/codes and thousands separators; a trailing '-' marks a credit on some invoices
+    negative = text.startswith('-') or text.endswith('-') or (text.startswith('(') and text.endswith(')'))
+    text = re.sub(r'[^\d.]', '', text)
+    if not text:
+        return None
+    digits, places = NUMERIC_COLUMNS[column]
+    try:
+        number = Decimal(text).quantize(Decimal(1).scaleb(-places))
+    except InvalidOperation:
+        return None
+    if number.adjusted() >= digits - places:
+        current_app.logger.warning(f"Line item {column} '{value}' does not fit DECIMAL({digits}, {places}); storing NULL.")
+        return None
+    return -number if negative else number
+
+
+def _row(invoice_id, line_index, item):
+    description = item.get('description')
+    description = str(description)[:MAX_DESCRIPTION_CHARS] if description not in (None, '') else None
+    row = (invoice_id, line_index, description,
+           parse_decimal(item.get('quantity'), 'quantity'),
+           parse_decimal(item.get('unit_price'), 'unit_price'),
+           parse_decimal(item.get('item_total'), 'item_total'))
+    return row if any(value is not None for value in row[2:]) else None
+
+
+def build_rows(invoice_id, line_items):
+    """(invoice_id, line_index, description, quantity, unit_price, item_total) rows for Gemini/pre-extractor line items."""
+    rows = []
+    if not isinstance(line_items, list):
+        return rows
+    for idx, item in enumerate(line_items):
+        if not isinstance(item, dict):
+            current_app.logger.warning(f"Skipping line item as it is not a dictionary: {item}")
+            continue
+        row = _row(invoice_id, idx + 1, item)
+        if row is not None:
+            rows.append(row)
+    return rows
+
+
+def descriptions_text(line_items, max_chars=60000):
+    """The line item descriptions as one text (invoices.line_items_text, full-text indexed), or None."""
+    if not isinstance(line_items, list):
+        return None
+    descriptions = [str(item['description']) for item in line_items
+                    if isinstance(item, dict) and item.get('description') not in (None, '')]
+    return "\n".join(descriptions)[:max_chars] or None
+
+
+def store(cursor, invoice_id, line_items):
+    """Replaces the line items of an invoice (caller commits). Returns the number of rows written."""
+    rows = build_rows(invoice_id, line_items)
+    # Reprocessing an invoice replaces its line items rather than appending to them
+    cursor.execute("DELETE FROM invoice_line_items WHERE invoice_id = %s", (invoice_id,))
+    db.bulk_insert(cursor, 'invoice_line_items', COLUMNS, rows,
+                   max_statement_bytes=current_app.config.get('MYSQL_MAX_INSERT_BYTES', 1024 * 1024))
+    return len(rows)
+
+
+def _eav_line_items(rows):
+    """Groups (invoice_id, field_name, field_value) EAV rows into {invoice_id: {line_index: {column: value}}}."""
+    grouped = {}
+    for invoice_id, field_name, field_value in rows:
+        match = EAV_FIELD_RE.match(field_name)
+        if match:
+            item = grouped.setdefault(invoice_id, {}).setdefault(int(match.group(1)), {})
+            item[EAV_COLUMNS[match.group(2)]] = field_value
+    return grouped
+
+
+def get_line_items(conn, invoice_id):
+    """The line items of an invoice in order, as dicts (numeric columns are Decimals)."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """SELECT line_index, description, quantity, unit_price, item_total
+               FROM invoice_line_items WHERE invoice_id = %s ORDER BY line_index""",
+            (invoice_id,)
+        )
+        rows = cursor.fetchall()
+        if not rows and current_app.config.get('LINE_ITEMS_EAV_FALLBACK', True):
+            # Not migrated yet by backfill_from_fields()
+            cursor.execute(
+                "SELECT invoice_id, field_name, field_value FROM invoice_fields WHERE invoice_id = %s AND field_name LIKE %s",
+                (invoice_id, EAV_FIELD_PATTERN)
+            )
+            items = _eav_line_items(cursor.fetchall()).get(invoice_id, {})
+            return [{'line_index': line_index,
+                     'description': items[line_index].get('description'),
+                     **{column: parse_decimal(items[line_index].get(column), column) for column in NUMERIC_COLUMNS}}
+                    for line_index in sorted(items)]
+    finally:
+        cursor.close()
+    return [dict(zip(('line_index', 'description', 'quantity', 'unit_price', 'item_total'), row)) for row in rows]
+
+
+def backfill_from_fields(conn, batch_size=500, pause_seconds=0.0, delete_eav=True):
+    """
+    Moves EAV line item rows from invoice_fields to invoice_line_items, walking invoices by id
+    in batches of `batch_size`, one short transaction per batch (safe to run while the app is
+    serving and to re-run after an interruption). Invoices that already have typed line items
+    (written or reprocessed after the switch) keep them; their stale EAV rows are only deleted.
+    Returns counters.
+    """
+    stats = {'batches': 0, 'invoices': 0, 'line_items': 0, 'eav_rows_deleted': 0}
+    last_id = 0
+    while True:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT id FROM invoices WHERE id > %s ORDER BY id LIMIT %s", (last_id, batch_size))
+            invoice_ids = [row[0] for row in cursor.fetchall()]
+            if not invoice_ids:
+                break
+            last_id = invoice_ids[-1]
+            placeholders = ", ".join(["%s"] * len(invoice_ids))
+            cursor.execute(
+                f"SELECT invoice_id, field_name, field_value FROM invoice_fields "
+                f"WHERE invoice_id IN ({placeholders}) AND field_name LIKE %s",
+                (*invoice_ids, EAV_FIELD_PATTERN)
+            )
+            grouped = _eav_line_items(cursor.fetchall())
+            if grouped:
+                migrated_ids = list(grouped)
+                placeholders = ", ".join(["%s"] * len(migrated_ids))
+                cursor.execute(f"SELECT DISTINCT invoice_id FROM invoice_line_items WHERE invoice_id IN ({placeholders})",
+                               migrated_ids)
+                already_typed = {row[0] for row in cursor.fetchall()}
+                rows = []
+                for invoice_id, items in grouped.items():
+                    if invoice_id not in already_typed:
+                        rows.extend(row for row in (_row(invoice_id, line_index, items[line_index]) for line_index in sorted(items))
+                                    if row is not None)
+                db.bulk_insert(cursor, 'invoice_line_items', COLUMNS, rows,
+                               max_statement_bytes=current_app.config.get('MYSQL_MAX_INSERT_BYTES', 1024 * 1024))
+                if delete_eav:
+                    cursor.execute(f"DELETE FROM invoice_fields WHERE invoice_id IN ({placeholders}) AND field_name LIKE %s",
+                                   (*migrated_ids, EAV_FIELD_PATTERN))
+                    stats['eav_rows_deleted'] += cursor.rowcount
+                stats['invoices'] += len(grouped) - len(already_typed)
+                stats['line_items'] += len(rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        stats['batches'] += 1
+        if stats['batches'] % 20 == 0:
+            current_app.logger.info(f"Line item backfill: up to invoice {last_id}, {stats}")
+        if pause_seconds:
+            # Leaves room for the app's own queries between batches
+            time.sleep(pause_seconds)
+    current_app.logger.info(f"Line item backfill finished: {stats}")
+    return stats
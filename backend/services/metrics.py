@@ -0,0 +1,206 @@
+"""
+In-process metrics for the invoice pipeline, exposed in the Prometheus text format at /metrics.
+
+    with metrics.stage_timer('ocr'):
+        text = backend.image_to_text(content)
+
+observes the block's duration in the `invoice_stage_duration_seconds{stage}` histogram and,
+if it raises, counts the exception in `invoice_stage_errors_total{stage, error}` (the
+exception's class name) before re-raising. Errors that are handled without raising are
+counted with count_error(). The stages are:
+
+    file_save, db_write, enqueue        upload requests (routes/invoice_routes.py)
+    ocr, pdf_text, image_preprocess     OCR of images, text extraction from PDFs (vision_service)
+    extraction                          pre-extraction / cache / layouts / Gemini for one invoice
+    gemini, json_parse                  each Gemini request (including scheduler waits) and
+                                        the parsing of its response
+
+A timed block costs two perf_counter() calls, one lock and a bisect over the buckets (a couple
+of microseconds, against stages of milliseconds to minutes), so timers stay on unconditionally.
+Values are per process: with several gunicorn workers, or `flask run-workers` in its own
+process (see METRICS_PORT), each process is scraped separately.
+
+This module does not depend on Flask.
+"""
+import bisect
+import math
+import threading
+import time
+from wsgiref.simple_server import WSGIRequestHandler, make_server
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; upload stages take milliseconds, OCR and Gemini seconds to minutes
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _check(self, labelvalues):
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {labelvalues}")
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = sorted(self._snapshot().items())
+        for labelvalues, value in items:
+            lines.extend(self._render_sample(labelvalues, value))
+        return lines
+
+
+class Counter(_Metric):
+    """A monotonically increasing count per label set."""
+    type_name = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        self._check(labelvalues)
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues):
+        with self._lock:
+            return self._values.get(labelvalues, 0)
+
+    def _snapshot(self):
+        return dict(self._values)
+
+    def _render_sample(self, labelvalues, value):
+        return [f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative `le` buckets per label set, with their sum and count."""
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, amount, *labelvalues):
+        self._check(labelvalues)
+        index = bisect.bisect_left(self.buckets, amount) # Buckets are upper bounds (le), inclusive
+        with self._lock:
+            series = self._values.get(labelvalues)
+            if series is None:
+                series = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += amount
+            series[2] += 1
+
+    def summary(self, *labelvalues):
+        """(count, sum) for one label set."""
+        with self._lock:
+            series = self._values.get(labelvalues)
+            return (series[2], series[1]) if series else (0, 0.0)
+
+    def _snapshot(self):
+        return {labelvalues: (list(counts), total, count) for labelvalues, (counts, total, count) in self._values.items()}
+
+    def _render_sample(self, labelvalues, value):
+        counts, total, count = value
+        lines, cumulative = [], 0
+        for upper_bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, labelvalues, [('le', _format_value(upper_bound))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, labelvalues)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram('invoice_stage_duration_seconds', 'Time spent in each stage of the invoice pipeline.', ('stage',))
+STAGE_ERRORS = Counter('invoice_stage_errors_total', 'Errors raised in each stage of the invoice pipeline, by exception class.',
+                       ('stage', 'error'))
+
+
+class _StageTimer:
+    # A class rather than @contextmanager: no generator to create and resume on every block
+    __slots__ = ('stage', 'started')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        STAGE_SECONDS.observe(time.perf_counter() - self.started, self.stage)
+        if exc_type is not None:
+            STAGE_ERRORS.inc(self.stage, exc_type.__name__)
+        return False
+
+
+def stage_timer(stage):
+    """Times the block as `stage` and counts its exceptions (see the module docstring)."""
+    return _StageTimer(stage)
+
+
+def count_error(stage, error):
+    """Counts an error of `stage` that was handled without propagating (`error` is an exception or a name)."""
+    STAGE_ERRORS.inc(stage, error if isinstance(error, str) else type(error).__name__)
+
+
+def render():
+    """All metrics of this process in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass # Scrapes every few seconds would flood stderr
+
+
+def _metrics_app(environ, start_response):
+    if environ.get('PATH_INFO') not in ('/', '/metrics'):
+        start_response('404 Not Found', [('Content-Type', 'text/plain')])
+        return [b'Not Found\n']
+    body = render().encode('utf-8')
+    start_response('200 OK', [('Content-Type', CONTENT_TYPE), ('Content-Length', str(len(body)))])
+    return [body]
+
+
+def start_http_server(port, host='0.0.0.0'):
+    """
+    Serves /metrics from a daemon thread, for processes without the Flask app's HTTP server
+    (`flask run-workers`). Returns the server; server.shutdown() stops it.
+    """
+    server = make_server(host, port, _metrics_app, handler_class=_QuietHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
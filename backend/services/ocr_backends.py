@@ -0,0 +1,134 @@
+"""
+Pluggable OCR backends for images and for scanned (image-only) PDF pages.
+
+The backend is chosen with the OCR_BACKEND config value:
+    - 'vision':    Google Cloud Vision text detection (default)
+    - 'tesseract': local Tesseract via pytesseract (optional dependency)
+
+Tests and benchmarks can install any object with an image_to_text(image_content)
+method through set_backend(), e.g. a fake that returns canned text.
+"""
+import io
+
+from flask import current_app
+
+
+class OCRBackend:
+    """
+    Interface: turn encoded image bytes (PNG/JPEG) into plain text. image_content may be
+    bytes or a read-only buffer such as the mmap from upload_storage.mapped_file().
+    """
+    name = 'base'
+
+    def image_to_text(self, image_content):
+        raise NotImplementedError
+
+    def images_to_text(self, image_contents):
+        """
+        OCRs several images. Returns one entry per image, in order: the text, or the
+        Exception raised for that image. Backends with a batch API override this.
+        """
+        results = []
+        for image_content in image_contents:
+            try:
+                results.append(self.image_to_text(image_content))
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+class VisionOCRBackend(OCRBackend):
+    name = 'vision'
+    MAX_BATCH_SIZE = 16 # Images per synchronous batch_annotate_images request allowed by the API
+
+    def image_to_text(self, image_content):
+        from google.cloud import vision # Imported lazily so other backends don't need the SDK
+        from services import api_scheduler, vision_service
+
+        current_app.logger.info("Attempting OCR with Google Cloud Vision API...")
+        try:
+            # Shared, long-lived client (see vision_service._ClientRegistry)
+            client = vision_service.get_vision_client()
+            image = vision.Image(content=bytes(image_content)) # No copy for bytes; reads a mapped file once
+            response = api_scheduler.get_scheduler('vision').call(
+                lambda: client.text_detection(image=image, **vision_service.get_vision_call_options()))
+
+            if response.error.message:
+                current_app.logger.error(f'Google Cloud Vision API error: {response.error.message}')
+                raise Exception(f'Google Cloud Vision API error: {response.error.message}')
+
+            if response.text_annotations:
+                full_text = response.text_annotations[0].description
+                current_app.logger.info(f"OCR successful with Google Cloud Vision API ({len(full_text)} characters).")
+                return full_text
+            else:
+                current_app.logger.info("No text found in image by Google Cloud Vision API.")
+                return ""
+        except Exception as e:
+            current_app.logger.error(f"Google Cloud Vision API request failed: {e}")
+            raise
+
+    def images_to_text(self, image_contents):
+        """One batch_annotate_images request for all images (callers keep groups within MAX_BATCH_SIZE)."""
+        from google.cloud import vision
+        from services import api_scheduler, vision_service
+
+        current_app.logger.info(f"Sending {len(image_contents)} image(s) to Google Cloud Vision batch annotate...")
+        client = vision_service.get_vision_client()
+        feature = vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)
+        requests = [vision.AnnotateImageRequest(image=vision.Image(content=bytes(content)), features=[feature])
+                    for content in image_contents]
+        # Vision quotas count every image in a batch request, so each one takes a unit of the rate limit
+        response = api_scheduler.get_scheduler('vision').call(
+            lambda: client.batch_annotate_images(requests=requests, **vision_service.get_vision_call_options()),
+            units=len(requests))
+
+        results = []
+        for image_response in response.responses:
+            if image_response.error.message:
+                results.append(Exception(f'Google Cloud Vision API error: {image_response.error.message}'))
+            elif image_response.text_annotations:
+                results.append(image_response.text_annotations[0].description)
+            else:
+                results.append("")
+        return results
+
+
+class TesseractOCRBackend(OCRBackend):
+    name = 'tesseract'
+
+    def image_to_text(self, image_content):
+        try:
+            import pytesseract
+            from PIL import Image
+        except ImportError:
+            raise ValueError("OCR_BACKEND=tesseract requires the pytesseract and Pillow packages.")
+
+        current_app.logger.info("Attempting OCR with local Tesseract...")
+        # Pillow reads a mapped file directly, without copying it into a BytesIO first
+        source = image_content if hasattr(image_content, 'read') else io.BytesIO(image_content)
+        with Image.open(source) as image:
+            return pytesseract.image_to_string(image, lang=current_app.config.get('TESSERACT_LANG', 'eng'))
+
+
+_backend_classes = {
+    VisionOCRBackend.name: VisionOCRBackend,
+    TesseractOCRBackend.name: TesseractOCRBackend,
+}
+_override = None
+
+
+def set_backend(backend):
+    """Forces a specific backend instance (or None to go back to OCR_BACKEND). Meant for tests/benchmarks."""
+    global _override
+    _override = backend
+
+
+def get_backend():
+    if _override is not None:
+        return _override
+    name = current_app.config.get('OCR_BACKEND', 'vision')
+    try:
+        return _backend_classes[name]()
+    except KeyError:
+        raise ValueError(f"Unknown OCR_BACKEND: {name}")
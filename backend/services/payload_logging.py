@@ -0,0 +1,29 @@
+"""
+DEBUG logging of large payloads (OCR text, Gemini prompts and responses, extracted data).
+
+    payload_logging.debug(logger, "Gemini raw response text:\n", response.text)
+    payload_logging.debug(logger, "Structured data: ", lambda: structured_data)
+
+Nothing is formatted unless the logger is enabled for DEBUG (LOG_LEVEL), and then only for a
+LOG_PAYLOAD_SAMPLE_RATE share of calls; a callable payload is only called at that point. The
+logged text is cut at LOG_PAYLOAD_MAX_CHARS.
+"""
+import logging
+import random
+
+from flask import current_app
+
+
+def debug(logger, message, payload):
+    """Logs `message` followed by `payload` (a value, or a callable returning one) at DEBUG, sampled and truncated."""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    config = current_app.config
+    sample_rate = config.get('LOG_PAYLOAD_SAMPLE_RATE', 1.0)
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    text = str(payload() if callable(payload) else payload)
+    max_chars = config.get('LOG_PAYLOAD_MAX_CHARS', 2000)
+    if max_chars and len(text) > max_chars:
+        text = f"{text[:max_chars]}... [{len(text) - max_chars} more characters]"
+    logger.debug(f"{message}{text}")
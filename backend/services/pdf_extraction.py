@@ -0,0 +1,168 @@
+"""
+Streaming, optionally parallel text extraction for PDFs.
+
+iter_page_texts() yields (page_number, text) one page at a time, in page order,
+releasing each pdfplumber page's cached layout objects as soon as its text has
+been read, so memory is bounded per page instead of per document. Large PDFs
+can be split into page ranges that are extracted in a process pool; results are
+merged back in order with a bounded number of ranges in flight.
+
+Pages are classified as they are read: a page with a usable text layer is used
+as-is, while an image-only (scanned) page is rasterized to PNG and handed to an
+OCR callable, so only scanned pages ever pay for an OCR round trip.
+
+This module does not depend on Flask so that it can run inside pool workers.
+"""
+import io
+import multiprocessing
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pdfplumber
+
+# Phrases that mark the totals section of an invoice or statement
+TOTALS_PATTERN = re.compile(
+    r'\b(grand\s+total|total\s+amount\s+(due|payable)|amount\s+(due|payable)|balance\s+due|net\s+payable|total\s+due)\b',
+    re.IGNORECASE
+)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(workers):
+    """One process pool per (forked) process, created on first use."""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid() or _executor._max_workers != workers:
+            if _executor is not None and _executor_pid == os.getpid():
+                _executor.shutdown(wait=False)
+            # 'spawn' avoids forking a process that is already running request/worker threads
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None and _executor_pid == os.getpid():
+            _executor.shutdown(wait=True)
+        _executor = None
+
+
+def _read_page(page, rasterize, min_text_chars, resolution):
+    """
+    Returns (text, png_bytes). png_bytes is only set for image-only pages (too little
+    text in the text layer, but at least one embedded image) when rasterize is True.
+    """
+    text = page.extract_text() or ""
+    png_bytes = None
+    if rasterize and len(text.strip()) < min_text_chars and page.images:
+        buffer = io.BytesIO()
+        page.to_image(resolution=resolution).original.save(buffer, format='PNG')
+        png_bytes = buffer.getvalue()
+    # Drop the parsed layout objects; they are many times larger than the text itself
+    page.close()
+    return text, png_bytes
+
+
+def _extract_page_range(file_path, start, stop, rasterize, min_text_chars, resolution):
+    """Pool worker: returns (text, png_bytes) for pages [start, stop)."""
+    with pdfplumber.open(file_path) as pdf:
+        return [_read_page(pdf.pages[i], rasterize, min_text_chars, resolution) for i in range(start, stop)]
+
+
+def count_pages(file_path):
+    with pdfplumber.open(file_path) as pdf:
+        return len(pdf.pages)
+
+
+def _iter_sequential(file_path, page_options):
+    with pdfplumber.open(file_path) as pdf:
+        for i, page in enumerate(pdf.pages):
+            yield (i + 1, *_read_page(page, *page_options))
+
+
+def _iter_parallel(file_path, page_count, workers, pages_per_task, page_options):
+    executor = _get_executor(workers)
+    ranges = deque((start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task))
+    in_flight = deque()
+    try:
+        while ranges or in_flight:
+            # Keep at most two ranges per worker queued so finished text doesn't pile up in memory
+            while ranges and len(in_flight) < workers * 2:
+                start, stop = ranges.popleft()
+                in_flight.append((start, executor.submit(_extract_page_range, file_path, start, stop, *page_options)))
+            start, future = in_flight.popleft()
+            for offset, (text, png_bytes) in enumerate(future.result()):
+                yield start + offset + 1, text, png_bytes
+    finally:
+        # Reached when the consumer stops early (e.g. totals found) or an error occurs
+        for _, future in in_flight:
+            future.cancel()
+
+
+def _iter_with_ocr(pages, ocr_page, ocr_concurrency):
+    """
+    Replaces the text of image-only pages with ocr_page(png_bytes), running up to
+    `ocr_concurrency` OCR calls at a time while still yielding pages in order.
+    """
+    with ThreadPoolExecutor(max_workers=ocr_concurrency) as executor:
+        pending = deque() # (page_number, text or Future), in page order
+        try:
+            for page_number, text, png_bytes in pages:
+                pending.append((page_number, executor.submit(ocr_page, png_bytes) if png_bytes else text))
+                while len(pending) > ocr_concurrency or (pending and isinstance(pending[0][1], str)):
+                    number, result = pending.popleft()
+                    yield number, result if isinstance(result, str) else result.result()
+            while pending:
+                number, result = pending.popleft()
+                yield number, result if isinstance(result, str) else result.result()
+        finally:
+            for _, result in pending:
+                if not isinstance(result, str):
+                    result.cancel()
+
+
+def iter_page_texts(file_path, workers=1, parallel_min_pages=16, pages_per_task=4, stop_at_totals=False,
+                    ocr_page=None, ocr_concurrency=4, min_text_chars=20, ocr_resolution=200):
+    """
+    Yields (page_number, text) for each page, in order.
+
+    Parameters:
+        workers: Number of processes to use; 1 extracts in the calling process
+        parallel_min_pages: PDFs with fewer pages are always extracted sequentially
+        pages_per_task: Number of consecutive pages each pool task extracts
+        stop_at_totals: Stop after the first page containing a totals phrase (see TOTALS_PATTERN)
+        ocr_page: Optional callable(png_bytes) -> text used for image-only pages. If None,
+                  scanned pages yield whatever (usually empty) text their text layer has.
+        ocr_concurrency: Maximum number of concurrent ocr_page calls
+        min_text_chars: Pages whose text, stripped of leading and trailing whitespace, is shorter
+                        than this and that embed at least one image count as image-only
+        ocr_resolution: DPI used to rasterize image-only pages
+    """
+    page_options = (ocr_page is not None, min_text_chars, ocr_resolution)
+    page_count = count_pages(file_path) if workers > 1 else 0
+    if workers > 1 and page_count >= parallel_min_pages:
+        raw_pages = _iter_parallel(file_path, page_count, workers, pages_per_task, page_options)
+    else:
+        raw_pages = _iter_sequential(file_path, page_options)
+
+    if ocr_page is not None:
+        pages = _iter_with_ocr(raw_pages, ocr_page, max(1, ocr_concurrency))
+    else:
+        pages = ((page_number, text) for page_number, text, _ in raw_pages)
+
+    try:
+        for page_number, text in pages:
+            yield page_number, text
+            if stop_at_totals and TOTALS_PATTERN.search(text):
+                return
+    finally:
+        pages.close()
+        raw_pages.close()
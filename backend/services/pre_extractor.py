@@ -0,0 +1,298 @@
+"""
+Fast, deterministic extraction of the core invoice fields from OCR text.
+
+Runs before Gemini: when its confidence is at least PRE_EXTRACTION_THRESHOLD the
+Gemini call is skipped and the result (same structured_data shape as
+vision_service.extract_invoice_data_with_gemini) is used directly.
+
+Two layers:
+    - Vendor templates for known, fixed-layout vendors, loaded from the JSON file
+      at VENDOR_TEMPLATES_PATH (see vendor_templates.example.json). Templates are
+      compiled once per file version and indexed by vendor fingerprint: the
+      normalized text of a header line and/or the vendor's tax id (GSTIN/VAT),
+      so finding a document's template is a few dict lookups, not a regex scan
+      per template.
+    - Generic label-based rules ("Grand Total", "Invoice No", "Invoice Date", ...)
+      for any field a template doesn't cover or for unknown vendors. These are
+      deliberately scored so that they alone stay below the default threshold.
+
+Confidence is the weighted sum of per-field confidences (see FIELD_WEIGHTS).
+"""
+import datetime
+import json
+import os
+import re
+import threading
+from collections import namedtuple
+
+from dateutil import parser as date_parse
+from flask import current_app
+
+from services import vision_service
+
+PreExtraction = namedtuple('PreExtraction', ['structured_data', 'confidence', 'template'])
+
+# How much each core field contributes to the overall confidence
+FIELD_WEIGHTS = {
+    'total_amount': 0.35,
+    'invoice_date': 0.2,
+    'vendor_name': 0.2,
+    'invoice_number': 0.15,
+    'detected_currency': 0.1,
+}
+TEMPLATE_FIELD_CONFIDENCE = 1.0
+HEADER_LINES = 8 # Lines at the top of the document searched for a vendor fingerprint
+
+AMOUNT = r'(?P<amount>\d{1,3}(?:,\d{2,3})+(?:\.\d{1,2})?|\d+\.\d{1,2}|\d+)'
+CURRENCY = r'(?P<currency>₹|\$|€|£|INR|USD|EUR|GBP|Rs\.?)'
+# Amounts must stand alone: '666B.23' or '3525,62' are OCR damage, not the amounts 23 or 62
+AMOUNT_RE = re.compile(rf'(?:{CURRENCY}\s*)?(?<![\w.,]){AMOUNT}(?![\w,]|\.\d)')
+CURRENCY_CODES = {'₹': 'INR', 'RS': 'INR', 'RS.': 'INR', '$': 'USD', '€': 'EUR', '£': 'GBP'}
+TAX_ID_RE = re.compile(r'\b(\d{2}[A-Z]{5}\d{4}[A-Z][A-Z\d]Z[A-Z\d])\b|(?:VAT\s*(?:No|Reg(?:istration)?\s*No)?|Tax\s*ID)[:.\s#]*([A-Z]{0,2}[\dA-Z-]{6,18})', re.IGNORECASE)
+
+# Generic rules: (compiled pattern, confidence), tried in order; the first match wins
+TOTAL_RULES = [
+    (re.compile(r'\b(grand\s+total|total\s+amount\s+(?:due|payable)|amount\s+(?:due|payable)|balance\s+due|net\s+payable|total\s+due)\b', re.IGNORECASE), 0.9),
+    (re.compile(r'(?<!sub)(?<!sub\s)\btotal\b(?!\s*(?:qty|quantity|items?|tax|gst|vat|discount))', re.IGNORECASE), 0.7),
+]
+DATE_TOKEN = r'(?P<date>\d{4}-\d{2}-\d{2}|\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}|\d{1,2}[\s-](?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*[\s,-]+\d{2,4}|(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\s+\d{1,2},?\s+\d{4})'
+DATE_RULES = [
+    (re.compile(rf'\b(?:invoice|bill|receipt|tax\s+invoice)?\s*date\b[^\n\d]{{0,12}}{DATE_TOKEN}', re.IGNORECASE), 0.9),
+    (re.compile(rf'\b{DATE_TOKEN}\b', re.IGNORECASE), 0.5),
+]
+NUMBER_RULES = [
+    (re.compile(r'\b(?:invoice|bill|receipt|inv)\s*(?:no\.?|number|num|#)\s*[:.#-]?\s*(?P<value>[A-Z0-9][A-Z0-9/_-]{1,30})', re.IGNORECASE), 0.9),
+]
+GENERIC_VENDOR_CONFIDENCE = 0.5
+# Document titles that are never the vendor name
+TITLE_LINES = {'invoice', 'tax invoice', 'retail invoice', 'bill', 'bill of supply', 'receipt', 'cash memo',
+               'original for recipient', 'duplicate for transporter', 'estimate', 'quotation'}
+
+
+def vendor_fingerprint(text):
+    """Normalized form of a vendor header line: lowercase letters and single spaces only."""
+    return re.sub(r'\s+', ' ', re.sub(r'[^a-z]+', ' ', text.lower())).strip()
+
+
+def parse_amount(text):
+    try:
+        return float(text.replace(',', ''))
+    except (AttributeError, ValueError):
+        return None
+
+
+def normalize_currency(symbol):
+    if not symbol:
+        return None
+    symbol = symbol.strip()
+    return CURRENCY_CODES.get(symbol.upper(), symbol.upper())
+
+
+def parse_date(text, dayfirst=True, formats=()):
+    for date_format in formats:
+        try:
+            return datetime.datetime.strptime(text, date_format).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    try:
+        # ISO dates are unambiguous; dayfirst would turn 2024-03-04 into April 3rd
+        return date_parse.parse(text, dayfirst=dayfirst and not re.match(r'\d{4}-', text)).strftime('%Y-%m-%d')
+    except (ValueError, OverflowError):
+        return None
+
+
+class VendorTemplate:
+    """A compiled vendor template (see vendor_templates.example.json for the JSON format)."""
+
+    def __init__(self, spec):
+        self.vendor_name = spec['vendor_name']
+        self.fingerprints = [vendor_fingerprint(line) for line in spec.get('fingerprints', [self.vendor_name])]
+        self.tax_ids = [tax_id.upper() for tax_id in spec.get('tax_ids', [])]
+        self.currency = spec.get('currency')
+        self.dayfirst = spec.get('dayfirst', True)
+        self.date_formats = tuple(spec.get('date_formats', ()))
+        # Each field pattern must have exactly one capture group holding the value; fields
+        # other than the core ones end up in additional_details, as with Gemini
+        self.fields = {name: re.compile(pattern, re.IGNORECASE | re.MULTILINE)
+                       for name, pattern in spec.get('fields', {}).items()}
+        line_item = spec.get('line_item')
+        self.line_item = re.compile(line_item, re.MULTILINE) if line_item else None
+
+    def extract(self, ocr_text):
+        """Returns ({field: value}, {field: confidence}) for the fields this template could read."""
+        values, confidences = {'vendor_name': self.vendor_name}, {'vendor_name': TEMPLATE_FIELD_CONFIDENCE}
+        for name, pattern in self.fields.items():
+            match = pattern.search(ocr_text)
+            if not match:
+                continue
+            raw = match.group(1).strip()
+            if name == 'total_amount':
+                value = parse_amount(raw)
+            elif name == 'invoice_date':
+                value = parse_date(raw, self.dayfirst, self.date_formats)
+            elif name == 'detected_currency':
+                value = normalize_currency(raw)
+            else:
+                value = raw
+            if value is not None:
+                values[name] = value
+                confidences[name] = TEMPLATE_FIELD_CONFIDENCE
+        if self.currency and 'detected_currency' not in values:
+            values['detected_currency'] = self.currency
+            confidences['detected_currency'] = TEMPLATE_FIELD_CONFIDENCE
+        if self.line_item is not None:
+            values['line_items'] = [
+                {key: (parse_amount(value) if key != 'description' else value.strip())
+                 for key, value in match.groupdict().items()}
+                for match in self.line_item.finditer(ocr_text)
+            ]
+        return values, confidences
+
+
+class TemplateIndex:
+    """Vendor templates indexed by header-line fingerprint and by tax id."""
+
+    def __init__(self, templates=()):
+        self.templates = list(templates)
+        self._by_key = {}
+        for template in self.templates:
+            for key in template.fingerprints + template.tax_ids:
+                self._by_key.setdefault(key, template)
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls(VendorTemplate(spec) for spec in json.load(f))
+
+    def match(self, ocr_text):
+        """Returns the template for this document's vendor, or None."""
+        if not self._by_key:
+            return None
+        for match in TAX_ID_RE.finditer(ocr_text):
+            template = self._by_key.get((match.group(1) or match.group(2)).upper())
+            if template is not None:
+                return template
+        header = [line for line in ocr_text.splitlines() if line.strip()][:HEADER_LINES]
+        for line in header:
+            template = self._by_key.get(vendor_fingerprint(line))
+            if template is not None:
+                return template
+        return None
+
+    def __len__(self):
+        return len(self.templates)
+
+
+def _first_rule_match(rules, lines):
+    for pattern, confidence in rules:
+        for line in lines:
+            match = pattern.search(line)
+            if match:
+                yield line, match, confidence
+
+
+def extract_generic(ocr_text, dayfirst=True):
+    """Label-based rules for any vendor. Returns ({field: value}, {field: confidence})."""
+    lines = [line.strip() for line in ocr_text.splitlines() if line.strip()]
+    values, confidences = {}, {}
+
+    # Total: the last amount on the first (most specific) matching line, searching bottom-up
+    for line, match, confidence in _first_rule_match(TOTAL_RULES, lines[::-1]):
+        amounts = list(AMOUNT_RE.finditer(line[match.end():]))
+        if amounts:
+            values['total_amount'] = parse_amount(amounts[-1].group('amount'))
+            confidences['total_amount'] = confidence
+            if amounts[-1].group('currency'):
+                values['detected_currency'] = normalize_currency(amounts[-1].group('currency'))
+                confidences['detected_currency'] = 0.9
+            break
+
+    for _, match, confidence in _first_rule_match(DATE_RULES, lines):
+        parsed = parse_date(match.group('date'), dayfirst)
+        if parsed:
+            values['invoice_date'], confidences['invoice_date'] = parsed, confidence
+            break
+
+    for _, match, confidence in _first_rule_match(NUMBER_RULES, lines):
+        values['invoice_number'], confidences['invoice_number'] = match.group('value'), confidence
+        break
+
+    if 'detected_currency' not in values:
+        currencies = [normalize_currency(m.group('currency')) for m in re.finditer(CURRENCY, ocr_text)]
+        if currencies:
+            values['detected_currency'] = max(set(currencies), key=currencies.count)
+            confidences['detected_currency'] = 0.7
+
+    for line in lines[:HEADER_LINES]:
+        if vendor_fingerprint(line) in TITLE_LINES or not re.search(r'[A-Za-z]{3}', line):
+            continue
+        values['vendor_name'], confidences['vendor_name'] = line, GENERIC_VENDOR_CONFIDENCE
+        break
+    return values, confidences
+
+
+def pre_extract(ocr_text, index=None, dayfirst=True):
+    """
+    Extracts the core fields without calling any API. Returns a PreExtraction whose
+    structured_data has the same shape as Gemini's (CORE_FIELDS_SCHEMA + raw_text +
+    additional_details), its confidence in [0, 1], and the matched template (or None).
+    """
+    values, confidences = extract_generic(ocr_text, dayfirst)
+    template = index.match(ocr_text) if index is not None else None
+    if template is not None:
+        template_values, template_confidences = template.extract(ocr_text)
+        # A field the vendor's template should have read but couldn't is usually OCR
+        # damage, so a generic value for it only counts half
+        for field in template.fields:
+            if field not in template_confidences and field in confidences:
+                confidences[field] *= 0.5
+        values.update(template_values)
+        confidences.update(template_confidences)
+
+    if values.get('total_amount') is not None and values['total_amount'] <= 0:
+        confidences['total_amount'] = 0.0
+    confidence = sum(weight * confidences.get(field, 0.0) for field, weight in FIELD_WEIGHTS.items())
+    structured_data = vision_service._structure_extracted_data(values, ocr_text)
+    return PreExtraction(structured_data, round(confidence, 4), template)
+
+
+_index_state = {'key': None, 'index': None}
+_index_lock = threading.Lock()
+
+
+def get_template_index():
+    """Templates from VENDOR_TEMPLATES_PATH, compiled once and recompiled only when the file changes."""
+    path = current_app.config.get('VENDOR_TEMPLATES_PATH')
+    try:
+        key = (path, os.path.getmtime(path)) if path else None
+    except OSError:
+        key = None
+    with _index_lock:
+        if _index_state['key'] != key or _index_state['index'] is None:
+            index = TemplateIndex()
+            if key is not None:
+                try:
+                    index = TemplateIndex.from_file(path)
+                    current_app.logger.info(f"Loaded {len(index)} vendor template(s) from {path}.")
+                except (OSError, ValueError, KeyError, re.error) as e:
+                    current_app.logger.error(f"Could not load vendor templates from {path}: {e}")
+            _index_state.update(key=key, index=index)
+        return _index_state['index']
+
+
+def try_pre_extract(ocr_text):
+    """
+    Returns structured_data when pre-extraction is enabled and confident enough
+    (>= PRE_EXTRACTION_THRESHOLD), otherwise None (the caller goes on to Gemini).
+    """
+    config = current_app.config
+    if not config.get('PRE_EXTRACTION_ENABLED', True) or not ocr_text.strip():
+        return None
+    result = pre_extract(ocr_text, get_template_index(), config.get('PRE_EXTRACTION_DAYFIRST', True))
+    threshold = config.get('PRE_EXTRACTION_THRESHOLD', 0.9)
+    source = f"template '{result.template.vendor_name}'" if result.template else "generic rules"
+    if result.confidence < threshold:
+        current_app.logger.info(f"Pre-extraction confidence {result.confidence:.2f} ({source}) below {threshold}; using Gemini.")
+        return None
+    current_app.logger.info(f"Pre-extraction confidence {result.confidence:.2f} ({source}); skipping Gemini.")
+    return result.structured_data
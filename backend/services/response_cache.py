@@ -0,0 +1,137 @@
+"""
+Conditional GET (ETag / Last-Modified) and a server-side response cache for invoice reads.
+
+Validators are cheap to compute without building the response:
+    - an invoice's detail is validated by invoices.updated_at (maintained by MySQL on
+      every change of the row), one primary key lookup;
+    - invoice lists are validated by the 'invoices' row of cache_versions, which every
+      write to invoices bumps in its own transaction (touch()), so a list ETag is the
+      version plus the normalized query, and a worker process finishing an invoice
+      invalidates the lists cached by every web process.
+
+A matching If-None-Match (or, without one, If-Modified-Since) gets a 304 without running
+the list query or reading raw_text. Otherwise the response body is looked up in a
+process-local LRU keyed by the same validator, so unchanged responses are served
+without touching the invoices table, and entries of older versions simply stop being
+looked up and age out.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import Response, current_app, request
+
+INVOICES_SCOPE = 'invoices'
+
+
+def touch(cursor, scope=INVOICES_SCOPE):
+    """Bumps the version of `scope` as part of the caller's transaction (call it with every write to invoices)."""
+    cursor.execute(
+        "INSERT INTO cache_versions (name, version) VALUES (%s, 1) ON DUPLICATE KEY UPDATE version = version + 1",
+        (scope,)
+    )
+
+
+def current_version(conn, scope=INVOICES_SCOPE):
+    """(version, last modified datetime or None) of `scope`."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT version, updated_at FROM cache_versions WHERE name = %s", (scope,))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    return (row[0], row[1]) if row else (0, None)
+
+
+def make_etag(*parts):
+    return hashlib.sha1("\x1f".join(str(part) for part in parts).encode('utf-8')).hexdigest()[:24]
+
+
+def not_modified(etag, last_modified=None):
+    """A 304 response if the request's validators match, else None."""
+    if request.if_none_match:
+        matches = request.if_none_match.contains_weak(etag)
+    else:
+        matches = bool(last_modified and request.if_modified_since
+                       and last_modified.replace(microsecond=0, tzinfo=None) <= request.if_modified_since.replace(tzinfo=None))
+    if not matches:
+        return None
+    get_cache().record_not_modified()
+    response = Response(status=304)
+    _set_validators(response, etag, last_modified)
+    return response
+
+
+def _set_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Let browsers keep the body but revalidate every time (lists change as invoices are processed)
+    response.headers['Cache-Control'] = 'private, no-cache'
+
+
+def json_response(body, etag, last_modified=None):
+    """A 200 JSON response from already serialized bytes, with validators."""
+    response = Response(body, status=200, mimetype='application/json')
+    _set_validators(response, etag, last_modified)
+    return response
+
+
+class ResponseCache:
+    """Thread-safe LRU of serialized response bodies, bounded by total size."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'evictions': 0}
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return body
+
+    def set(self, key, body):
+        if len(body) > self.max_bytes // 4: # A few huge entries would flush everything else
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = body
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self._stats['evictions'] += 1
+
+    def record_not_modified(self):
+        with self._lock:
+            self._stats['not_modified'] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'entries': len(self._entries), 'bytes': self._bytes}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(current_app.config.get('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    return _cache
+
+
+def is_enabled():
+    return current_app.config.get('RESPONSE_CACHE_ENABLED', True)
@@ -0,0 +1,161 @@
+"""
+Content-addressed cache for OCR text and Gemini extraction results.
+
+Two namespaces are used:
+    - 'ocr':        SHA-256 of the uploaded file bytes -> raw OCR text
+    - 'extraction': SHA-256 of (prompt version + normalized OCR text) -> structured data
+
+Lookups go through a per-process in-memory LRU first and then the persistent
+`processing_cache` MySQL table, so an exact duplicate upload never calls the
+Vision or Gemini APIs again.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+import db
+
+OCR_NAMESPACE = 'ocr'
+EXTRACTION_NAMESPACE = 'extraction'
+
+
+def sha256_bytes(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def normalize_ocr_text(text):
+    """Collapses whitespace so that insignificant OCR layout differences map to the same key."""
+    lines = (re.sub(r'[ \t]+', ' ', line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def extraction_key(ocr_text, prompt_version):
+    return sha256_bytes(f"{prompt_version}\n{normalize_ocr_text(ocr_text)}".encode('utf-8'))
+
+
+class LRUCache:
+    """Thread-safe LRU with a maximum entry count and a per-entry TTL."""
+
+    def __init__(self, max_entries=1024, ttl_seconds=86400):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ContentCache:
+    """In-memory LRU in front of the persistent processing_cache table, with hit/miss counters."""
+
+    def __init__(self, max_entries=1024, ttl_seconds=86400):
+        self.memory = LRUCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, namespace, outcome):
+        with self._stats_lock:
+            counters = self._stats.setdefault(namespace, {'memory_hits': 0, 'db_hits': 0, 'misses': 0})
+            counters[outcome] += 1
+
+    def get(self, namespace, key):
+        value = self.memory.get((namespace, key))
+        if value is not None:
+            self._count(namespace, 'memory_hits')
+            return value
+
+        conn = db.get_db()
+        if conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    "SELECT cache_value FROM processing_cache WHERE cache_namespace = %s AND cache_key = %s",
+                    (namespace, key)
+                )
+                row = cursor.fetchone()
+            except Exception as e:
+                current_app.logger.warning(f"Cache lookup failed ({namespace}/{key[:12]}): {e}")
+                row = None
+            finally:
+                cursor.close()
+            if row:
+                value = json.loads(row[0])
+                self.memory.set((namespace, key), value)
+                self._count(namespace, 'db_hits')
+                return value
+
+        self._count(namespace, 'misses')
+        return None
+
+    def set(self, namespace, key, value):
+        self.memory.set((namespace, key), value)
+        conn = db.get_db()
+        if not conn:
+            return
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                """INSERT INTO processing_cache (cache_namespace, cache_key, cache_value)
+                   VALUES (%s, %s, %s)
+                   ON DUPLICATE KEY UPDATE cache_value = VALUES(cache_value)""",
+                (namespace, key, json.dumps(value))
+            )
+            conn.commit()
+        except Exception as e:
+            # The cache is an optimisation only; never fail processing because of it
+            current_app.logger.warning(f"Cache write failed ({namespace}/{key[:12]}): {e}")
+            conn.rollback()
+        finally:
+            cursor.close()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = {namespace: dict(counters) for namespace, counters in self._stats.items()}
+        stats['memory_entries'] = len(self.memory)
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Returns the process-wide cache, creating it from the app config on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ContentCache(
+                    max_entries=current_app.config.get('CACHE_MEMORY_MAX_ENTRIES', 1024),
+                    ttl_seconds=current_app.config.get('CACHE_MEMORY_TTL_SECONDS', 86400)
+                )
+    return _cache
+
+
+def is_enabled():
+    return current_app.config.get('CACHE_ENABLED', True)
@@ -0,0 +1,127 @@
+"""
+Spend totals by vendor, month, currency and user, kept in invoice_spend_rollups.
+
+Each processed invoice contributes (1 invoice, total_amount) to one row per dimension:
+('vendor', vendor_name), ('month', 'YYYY-MM' of invoice_date), ('currency', currency)
+and ('user', user_id), always split by currency since amounts in different currencies
+can't be added up. Reading the totals of a dimension is a range scan over its groups,
+independent of the number of invoices.
+
+The rows are maintained in the same transaction as the invoice change: callers lock the
+invoice row with lock_contribution() before changing it, read the new contribution after,
+and apply() the difference. Any write that moves an invoice into or out of 'processed'
+(extraction, reprocessing, deletion) goes through this. rebuild() recomputes everything
+from invoices (`flask --app app rebuild-spend-rollups`).
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from flask import current_app
+
+DIMENSIONS = ('vendor', 'month', 'currency', 'user')
+UNKNOWN_KEY = '' # Invoices without a vendor / date / currency / user
+
+# Group keys; rebuild() computes the same keys in SQL
+_KEY_EXPRESSIONS = {
+    'vendor': "COALESCE(vendor_name, '')",
+    'month': "COALESCE(DATE_FORMAT(invoice_date, '%Y-%m'), '')",
+    'currency': "COALESCE(currency, '')",
+    'user': "COALESCE(CAST(user_id AS CHAR), '')",
+}
+
+_UPSERT_PREFIX = "INSERT INTO invoice_spend_rollups (dimension, dimension_key, currency, invoice_count, total_amount) VALUES "
+_UPSERT_SUFFIX = (" ON DUPLICATE KEY UPDATE invoice_count = invoice_count + VALUES(invoice_count),"
+                  " total_amount = total_amount + VALUES(total_amount)")
+
+
+def lock_contribution(cursor, invoice_id):
+    """
+    Locks the invoice row (until the caller commits) and returns what it currently
+    contributes to the rollups: (keys by dimension, currency, amount), or None unless processed.
+    """
+    cursor.execute(
+        "SELECT status, vendor_name, invoice_date, currency, user_id, total_amount FROM invoices WHERE id = %s FOR UPDATE",
+        (invoice_id,)
+    )
+    row = cursor.fetchone()
+    if row is None or row[0] != 'processed':
+        return None
+    _, vendor_name, invoice_date, currency, user_id, total_amount = row
+    currency = currency or UNKNOWN_KEY
+    keys = {
+        'vendor': vendor_name or UNKNOWN_KEY,
+        'month': invoice_date.strftime('%Y-%m') if invoice_date else UNKNOWN_KEY,
+        'currency': currency,
+        'user': str(user_id) if user_id is not None else UNKNOWN_KEY,
+    }
+    amount = Decimal(str(total_amount)) if total_amount is not None else Decimal('0')
+    return keys, currency, amount
+
+
+def apply(cursor, old, new):
+    """Moves an invoice's contribution from `old` to `new` (either may be None). Returns the rows touched."""
+    deltas = defaultdict(lambda: [0, Decimal('0')])
+    for contribution, sign in ((old, -1), (new, 1)):
+        if contribution is None:
+            continue
+        keys, currency, amount = contribution
+        for dimension in DIMENSIONS:
+            delta = deltas[(dimension, keys[dimension], currency)]
+            delta[0] += sign
+            delta[1] += sign * amount
+    # Unchanged groups (e.g. a reprocessed invoice that kept its vendor) need no write; sorted keys
+    # make concurrent transactions lock shared rollup rows in the same order
+    rows = [(*key, count, amount) for key, (count, amount) in sorted(deltas.items()) if count or amount]
+    if rows:
+        cursor.execute(_UPSERT_PREFIX + ", ".join(["(%s, %s, %s, %s, %s)"] * len(rows)) + _UPSERT_SUFFIX,
+                       [value for row in rows for value in row])
+    return len(rows)
+
+
+def rebuild(conn):
+    """Recomputes all rollup rows from invoices in one transaction. Returns the number of rows written."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM invoice_spend_rollups")
+        rows = 0
+        for dimension in DIMENSIONS:
+            key = _KEY_EXPRESSIONS[dimension]
+            cursor.execute(
+                f"""INSERT INTO invoice_spend_rollups (dimension, dimension_key, currency, invoice_count, total_amount)
+                    SELECT '{dimension}', {key}, COALESCE(currency, ''), COUNT(*), COALESCE(SUM(total_amount), 0)
+                    FROM invoices WHERE status = 'processed'
+                    GROUP BY {key}, COALESCE(currency, '')"""
+            )
+            rows += cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    current_app.logger.info(f"Spend rollups rebuilt: {rows} rows.")
+    return rows
+
+
+def get_totals(conn, dimension, currency=None, limit=None):
+    """Groups of a dimension, largest total first (months in order), as dicts."""
+    if dimension not in DIMENSIONS:
+        raise ValueError(f"Unknown dimension '{dimension}', expected one of {', '.join(DIMENSIONS)}")
+    sql = """SELECT dimension_key, currency, invoice_count, total_amount FROM invoice_spend_rollups
+             WHERE dimension = %s AND invoice_count > 0"""
+    params = [dimension]
+    if currency is not None:
+        sql += " AND currency = %s"
+        params.append(currency)
+    sql += " ORDER BY dimension_key, currency" if dimension == 'month' else " ORDER BY total_amount DESC, dimension_key"
+    if limit:
+        sql += " LIMIT %s"
+        params.append(limit)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    return [{'key': key or None, 'currency': row_currency or None, 'invoice_count': count, 'total_amount': total}
+            for key, row_currency, count, total in rows]
@@ -0,0 +1,119 @@
+"""
+Compaction and chunking of OCR text before it is put into a Gemini prompt.
+
+The text stored as invoices.raw_text is left as extracted; only the prompt gets the
+compacted version. compact() does the following:
+
+    - collapses runs of spaces/tabs and blank lines, and drops separator lines
+      ("-----", "=====") and page-number lines ("Page 2 of 7")
+    - for multi-page documents (pages are separated by PAGE_BREAK, see
+      vision_service.extract_text_from_pdf), keeps only the first occurrence of lines that
+      repeat on at least half of the pages: letterheads, running footers, T&C boilerplate.
+      Lines with an amount in them are never removed, so identical line items (or charges)
+      on different pages are all kept.
+
+split_into_chunks() cuts a document that is still too long for one prompt at page, then
+line boundaries, for map-reduce extraction (see vision_service.extract_invoice_data_with_gemini).
+
+This module does not depend on Flask.
+"""
+import math
+import re
+from collections import namedtuple
+
+PAGE_BREAK = "\f"
+
+_HORIZONTAL_SPACE = re.compile(r'[ \t\u00a0]+')
+_SEPARATOR_LINE = re.compile(r'^[\s\-=_*~.·•|+#]{3,}$')
+_PAGE_NUMBER_LINE = re.compile(r'^(page|pg\.?)?\s*\d+\s*((of|/)\s*\d+)?$', re.IGNORECASE)
+_PAGE_CUE = re.compile(r'\b(page|pg)\b', re.IGNORECASE)
+_AMOUNT = re.compile(r'\d[\d,]*[.,]\d{2}\b')
+_DIGITS = re.compile(r'\d+')
+
+CompactionResult = namedtuple('CompactionResult', 'text pages repeated_lines_removed')
+
+
+def _clean_page(page):
+    lines = []
+    for line in page.splitlines():
+        line = _HORIZONTAL_SPACE.sub(' ', line).strip()
+        if not line:
+            if lines and lines[-1]:
+                lines.append('') # Keep one blank line between blocks
+            continue
+        if _SEPARATOR_LINE.match(line) or (_PAGE_NUMBER_LINE.match(line) and _PAGE_CUE.search(line)):
+            continue
+        lines.append(line)
+    while lines and not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def _repeat_key(line):
+    # "Page 3 - Acme Corp" repeats as the same header with a different number
+    return _DIGITS.sub('#', line.lower()) if _PAGE_CUE.search(line) else line.lower()
+
+
+def _may_repeat(line):
+    """Blank lines and lines with amounts are never boilerplate."""
+    return bool(line) and not _AMOUNT.search(line)
+
+
+def compact(text, min_page_share=0.5):
+    """Returns a CompactionResult with the compacted text."""
+    pages = [_clean_page(page) for page in text.split(PAGE_BREAK)]
+    pages = [lines for lines in pages if lines]
+    removed = 0
+    if len(pages) >= 2:
+        pages_with_key = {}
+        for lines in pages:
+            for key in {_repeat_key(line) for line in lines if _may_repeat(line)}:
+                pages_with_key[key] = pages_with_key.get(key, 0) + 1
+        min_pages = max(2, math.ceil(len(pages) * min_page_share))
+        repeated = {key for key, count in pages_with_key.items() if count >= min_pages}
+        seen = set()
+        for page_index, lines in enumerate(pages):
+            kept = []
+            for line in lines:
+                key = _repeat_key(line) if _may_repeat(line) else None
+                if key in repeated:
+                    if key in seen:
+                        removed += 1
+                        continue
+                    seen.add(key)
+                kept.append(line)
+            pages[page_index] = kept
+
+    compacted = "\n\n".join("\n".join(lines).strip('\n') for lines in pages)
+    return CompactionResult(re.sub(r'\n{3,}', '\n\n', compacted), len(pages), removed)
+
+
+def split_into_chunks(text, max_tokens, estimate_tokens):
+    """
+    Splits compacted text into chunks of at most `max_tokens` (by `estimate_tokens`),
+    cutting between pages/blocks first and between lines when a block is too long.
+    """
+    pieces = []
+    for block in text.split("\n\n"):
+        if estimate_tokens(block) <= max_tokens:
+            pieces.append(block)
+            continue
+        for line in block.split("\n"):
+            if estimate_tokens(line) <= max_tokens:
+                pieces.append(line)
+                continue
+            # A single line longer than a chunk (OCR text without line breaks) is cut by characters
+            step = max(1, len(line) * max_tokens // estimate_tokens(line))
+            pieces.extend(line[i:i + step] for i in range(0, len(line), step))
+
+    chunks, current, current_tokens = [], [], 0
+    for piece in pieces:
+        tokens = estimate_tokens(piece)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
@@ -0,0 +1,144 @@
+"""
+Streaming storage for uploaded invoice files.
+
+By default werkzeug spools every multipart file part into an anonymous temporary
+file, which the upload routes then copied into uploads/. UploadRequest instead
+writes file parts straight into a temporary file inside the upload folder while
+the request body is parsed, computing the SHA-256 and size of each file on the
+fly and enforcing MAX_UPLOAD_BYTES as the chunks arrive (BATCH_MAX_TOTAL_BYTES for the parts
+of a batch upload, whose zip archives hold many invoices). commit_upload() then
+atomically renames that temporary file to its final name, so a file in uploads/
+is always complete and is written exactly once.
+
+Processing code reads files back lazily with mapped_file() (mmap): the OS only
+loads the pages an OCR backend actually touches, and PDFs (which pdfplumber
+reads by path) are never read into memory by us at all.
+"""
+import hashlib
+import mmap
+import os
+import tempfile
+from collections import namedtuple
+from contextlib import contextmanager
+
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+
+UPLOAD_FOLDER = 'uploads' # Relative to the app root
+BATCH_ENDPOINT = 'invoice_bp.upload_batch' # Its zip parts are checked per entry when they are extracted
+TEMP_PREFIX = '.upload-' # Partially written files; never picked up as invoices
+CHUNK_SIZE = 1024 * 1024
+
+StoredFile = namedtuple('StoredFile', ['path', 'sha256', 'size'])
+
+
+def get_upload_folder():
+    return os.path.join(current_app.root_path, UPLOAD_FOLDER)
+
+
+class HashingUploadFile:
+    """
+    A temporary file in `directory` that hashes and counts bytes as they are written,
+    raising RequestEntityTooLarge (and deleting itself) once more than `max_bytes` arrive.
+    Reads, seeks etc. go to the underlying file, so werkzeug's FileStorage can use it as
+    its stream. Unless commit() moved it into place, close() deletes the temporary file.
+    """
+    _file = None
+
+    def __init__(self, directory, max_bytes=None):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=directory)
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.committed_path = None
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes and self.size > self.max_bytes:
+            self.close()
+            raise RequestEntityTooLarge(f"Uploaded file exceeds the limit of {self.max_bytes} bytes")
+        self._hash.update(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def commit(self, file_path):
+        """Flushes the data to disk and atomically renames the temporary file to file_path."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        os.replace(self.temp_path, file_path)
+        self.committed_path = file_path
+        return StoredFile(file_path, self.sha256, self.size)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if self.committed_path is None and os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class UploadRequest(Request):
+    """Request class that streams uploaded file parts into the upload folder (see the module docstring)."""
+
+    def _max_part_bytes(self):
+        if self.endpoint == BATCH_ENDPOINT:
+            return current_app.config.get('BATCH_MAX_TOTAL_BYTES')
+        return current_app.config.get('MAX_UPLOAD_BYTES')
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingUploadFile(get_upload_folder(), self._max_part_bytes())
+
+
+def save_stream(stream, file_path, max_bytes=None):
+    """Copies a readable binary stream to file_path in chunks (temp file + atomic rename). Returns a StoredFile."""
+    target = HashingUploadFile(os.path.dirname(file_path), max_bytes)
+    try:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            target.write(chunk)
+        return target.commit(file_path)
+    finally:
+        target.close()
+
+
+def commit_upload(file_storage, file_path):
+    """
+    Moves an uploaded werkzeug FileStorage to file_path and returns StoredFile(path, sha256, size).
+    Parts parsed by UploadRequest are already on disk and are just renamed; any other
+    stream (e.g. a request built without UploadRequest) is copied in chunks.
+    """
+    if isinstance(file_storage.stream, HashingUploadFile):
+        return file_storage.stream.commit(file_path)
+    return save_stream(file_storage.stream, file_path, current_app.config.get('MAX_UPLOAD_BYTES'))
+
+
+def sha256_file(file_path):
+    """SHA-256 of a file on disk, read in chunks (for files whose hash wasn't recorded at upload time)."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextmanager
+def mapped_file(file_path):
+    """
+    Yields a read-only mmap of the file (b'' for an empty file). Nothing is read from disk
+    until the bytes are accessed, and the pages are shared with the OS page cache.
+    """
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
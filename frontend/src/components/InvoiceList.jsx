@@ -1,39 +1,112 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef, useCallback } from 'react';
 import axios from 'axios';
 import Spinner from './Spinner';
 import './InvoiceList.css';
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:5000';
 
+const PAGE_SIZE = 50;
+
 function InvoiceList({ refreshTrigger, onFetchError, onInvoiceSelect }) {
     const [invoices, setInvoices] = useState([]);
     const [isLoading, setIsLoading] = useState(true);
+    const [isLoadingMore, setIsLoadingMore] = useState(false);
+    const [nextCursor, setNextCursor] = useState(null);
     const [error, setError] = useState('');
+    const sentinelRef = useRef(null);
+
+    // Fetches one page; the server returns rows newest first plus an opaque cursor for the next page
+    const fetchPage = useCallback(async (cursor) => {
+        const params = { limit: PAGE_SIZE };
+        if (cursor) {
+            params.cursor = cursor;
+        }
+        const response = await axios.get(`${API_URL}/api/invoices/`, { params });
+        return response.data;
+    }, []);
+
+    const handleError = useCallback((err) => {
+        console.error('Error fetching invoices:', err);
+        const errorMessage = err.response?.data?.error || 'Failed to fetch invoices.';
+        setError(errorMessage);
+        if (onFetchError) {
+            onFetchError(errorMessage);
+        }
+    }, [onFetchError]);
 
     useEffect(() => {
-        const fetchInvoices = async () => {
+        const fetchFirstPage = async () => {
             setIsLoading(true);
             setError('');
             try {
-                const response = await axios.get(`${API_URL}/api/invoices/`);
-                const sortedInvoices = response.data.sort((a, b) => 
-                    new Date(b.uploaded_at) - new Date(a.uploaded_at)
-                );
-                setInvoices(sortedInvoices);
+                const data = await fetchPage(null);
+                setInvoices(data.invoices);
+                setNextCursor(data.next_cursor);
             } catch (err) {
-                console.error('Error fetching invoices:', err);
-                const errorMessage = err.response?.data?.error || 'Failed to fetch invoices.';
-                setError(errorMessage);
-                if (onFetchError) {
-                    onFetchError(errorMessage);
-                }
+                handleError(err);
                 setInvoices([]);
+                setNextCursor(null);
             }
             setIsLoading(false);
         };
 
-        fetchInvoices();
-    }, [refreshTrigger, onFetchError]);
+        fetchFirstPage();
+    }, [refreshTrigger, fetchPage, handleError]);
+
+    // Live status updates (server-sent events) instead of polling the list: rows already on screen are
+    // patched in place; EventSource reconnects by itself and the server replays what was missed
+    useEffect(() => {
+        if (typeof EventSource === 'undefined') return;
+        const source = new EventSource(`${API_URL}/api/invoices/events`);
+        source.addEventListener('invoice', (message) => {
+            const event = JSON.parse(message.data);
+            setInvoices(prev => {
+                if (event.status === 'deleted') {
+                    return prev.filter(invoice => invoice.id !== event.invoice_id);
+                }
+                return prev.map(invoice => invoice.id === event.invoice_id
+                    ? { ...invoice, status: event.status, ...(event.summary || {}) }
+                    : invoice);
+            });
+        });
+        // Too many events were missed while disconnected: reload the first page
+        source.addEventListener('reset', async () => {
+            try {
+                const data = await fetchPage(null);
+                setInvoices(data.invoices);
+                setNextCursor(data.next_cursor);
+            } catch (err) {
+                handleError(err);
+            }
+        });
+        return () => source.close();
+    }, [fetchPage, handleError]);
+
+    const loadMore = useCallback(async () => {
+        if (!nextCursor || isLoadingMore) return;
+        setIsLoadingMore(true);
+        try {
+            const data = await fetchPage(nextCursor);
+            setInvoices(prev => [...prev, ...data.invoices]);
+            setNextCursor(data.next_cursor);
+        } catch (err) {
+            handleError(err);
+        }
+        setIsLoadingMore(false);
+    }, [nextCursor, isLoadingMore, fetchPage, handleError]);
+
+    // Infinite scroll: load the next page when the sentinel below the table becomes visible
+    useEffect(() => {
+        const sentinel = sentinelRef.current;
+        if (!sentinel || !nextCursor) return;
+        const observer = new IntersectionObserver((entries) => {
+            if (entries[0].isIntersecting) {
+                loadMore();
+            }
+        }, { rootMargin: '200px' });
+        observer.observe(sentinel);
+        return () => observer.disconnect();
+    }, [nextCursor, loadMore]);
 
     const formatDate = (dateString) => {
         if (!dateString) return 'N/A';
@@ -104,6 +177,9 @@ function InvoiceList({ refreshTrigger, onFetchError, onInvoiceSelect }) {
                         ))}
                     </tbody>
                 </table>
+                <div ref={sentinelRef} className="invoice-list-sentinel">
+                    {isLoadingMore && <Spinner size="small" />}
+                </div>
             </div>
         </div>
     );
@@ -42,7 +42,7 @@ function InvoiceUploadForm({ onUploadSuccess, onUploadError }) {
                 fileInputRef.current.value = ''; // Reset file input
             }
             if (onUploadSuccess) {
-                onUploadSuccess(response.data, `File '${selectedFile.name}' processed successfully! Invoice ID: ${response.data.invoice_id}`);
+                onUploadSuccess(response.data, `File '${selectedFile.name}' uploaded and queued for processing. Invoice ID: ${response.data.invoice_id}`);
             }
         } catch (error) {
             console.error('Error uploading file:', error);